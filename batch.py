@@ -0,0 +1,139 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import sys
+import json
+import time
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from scoring import Scorer
+from time_table import read_input_file, check_input, apply_patch, create_solver, TimeTableModel
+
+
+def load_scenarios(path, base=None):
+    # ディレクトリなら *.json を，そうでなければ JSONL を1行1シナリオとして読む
+    ## JSONL の各行は入力そのもの，{'name': 名前, 'input': 入力}，
+    ## または base があれば {'name': 名前, 'patch': apply_patch の変更} のどれか
+    scenarios = []
+    if os.path.isdir(path):
+        for filename in sorted(os.listdir(path)):
+            if filename.endswith('.json'):
+                with open(os.path.join(path, filename), encoding='utf-8') as f:
+                    scenarios.append((os.path.splitext(filename)[0], json.load(f)))
+        return scenarios
+    with open(path, encoding='utf-8') as f:
+        for n, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            name = entry.get('name', 'line {0}'.format(n))
+            if 'patch' in entry:
+                if base is None:
+                    raise ValueError('{0}: a patch scenario needs a base input'.format(name))
+                scenarios.append((name, apply_patch(base, entry['patch'])))
+            else:
+                scenarios.append((name, entry.get('input', entry)))
+    return scenarios
+
+
+def run_scenario(name, input, options, callback=None):
+    # 1つのシナリオを解く (ソルバの作業ディレクトリはソルバごとに一時ディレクトリが作られる)
+    ## callback があれば，求解中に見つかった暫定解を (目的関数値, 時間割) で渡す
+    result = {'scenario': name, 'status': 'no solution'}
+    log = io.StringIO()
+    begin = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+            check_input(input)
+            if options['solver'] == 'heuristic':
+                from heuristic import heuristic_time_table
+                time_table = heuristic_time_table(input, options['time_limit'] or 1.0)
+            else:
+                solver = create_solver(options['solver'], options['scip'], options['format'],
+                                       node_limit=options['node_limit'], time_limit=options['time_limit'],
+                                       quiet=True)
+                model = TimeTableModel(input, options['formulation'])
+                time_table = model.solve(solver, callback=callback)
+                result['solver_status'] = model.status
+    except SystemExit:
+        result['status'] = 'invalid'
+        time_table = None
+    except Exception as e:
+        result['status'] = 'error: {0}'.format(e)
+        time_table = None
+    result['time'] = time.perf_counter() - begin
+    if time_table:
+        scorer = Scorer(input)
+        attendance = scorer.attendance(scorer.encode(time_table))[0]
+        result['status'] = 'solved'
+        result['objective'] = float(attendance.dot(scorer.weights))
+        ## 見たい講座のうち見れないものの数
+        result['unmet'] = int(scorer.wishes.sum() - attendance.sum())
+        result['requests'] = int(scorer.wishes.sum())
+        result['time_table'] = time_table
+    if options.get('log'):
+        result['log'] = log.getvalue()
+    return result
+
+
+def run_batch(scenarios, options, workers=None):
+    results = []
+    with ProcessPoolExecutor(workers or os.cpu_count()) as executor:
+        futures = [executor.submit(run_scenario, name, input, options) for name, input in scenarios]
+        for n, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            print('[{0}/{1}] {2}: {3} ({4:.2f}s)'.format(n, len(futures), result['scenario'],
+                                                      result['status'], result['time']),
+                  file=sys.stderr)
+            results.append(result)
+    order = dict((name, n) for n, (name, _) in enumerate(scenarios))
+    return sorted(results, key=lambda r: order[r['scenario']])
+
+
+def print_report(results):
+    print('|シナリオ|状態|目的関数値|見れない講座|時間 (s)|')
+    for r in results:
+        print('|{0}|{1}|{2}|{3}|{4:.2f}|'.format(
+            r['scenario'], r['status'],
+            '{0:.4f}'.format(r['objective']) if 'objective' in r else '-',
+            '{0}/{1}'.format(r['unmet'], r['requests']) if 'unmet' in r else '-',
+            r['time']))
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    parser = OptionParser(usage='python3 batch.py [options] (DIRECTORY | scenarios.jsonl)')
+    parser.add_option("--base", dest="base", metavar="FILE",
+                      help="base input for JSONL lines of the form {\"name\": ..., \"patch\": {...}}")
+    parser.add_option("--jobs", dest="jobs", type="int",
+                      help="number of scenarios solved at once (default: number of CPUs)", metavar="N")
+    parser.add_option("--solver", dest="solver", choices=["scip", "cplex", "bnb", "heuristic"],
+                      help="solver to use (scip, cplex, bnb, heuristic)")
+    parser.add_option("--scip", dest="scip", help="path to a SCIP solver", metavar="PATH")
+    parser.add_option("--format", dest="format", default="lp", choices=["lp", "mps", "mps.gz"],
+                      help="model file format (lp, mps, mps.gz)")
+    parser.add_option("--formulation", dest="formulation", default="slot", choices=["slot", "compact"],
+                      help="model formulation (slot, compact)")
+    parser.add_option("--time-limit", dest="time_limit", type="float",
+                      help="time limit in seconds per scenario", metavar="SECONDS")
+    parser.add_option("--node-limit", dest="node_limit", type="int", default=100000,
+                      help="branch-and-bound node limit (bnb)", metavar="N")
+    parser.add_option("--json", dest="json", metavar="FILE",
+                      help="also write the results (with time tables and solver logs) as JSON to FILE")
+    options, args = parser.parse_args()
+
+    if len(args) != 1:
+        parser.print_usage(sys.stderr)
+        exit(-1)
+    base = read_input_file(options.base) if options.base else None
+    scenarios = load_scenarios(args[0], base)
+    settings = {'solver': options.solver, 'scip': options.scip, 'format': options.format,
+                'formulation': options.formulation, 'time_limit': options.time_limit,
+                'node_limit': options.node_limit, 'log': bool(options.json)}
+    results = run_batch(scenarios, settings, options.jobs)
+    print_report(results)
+    if options.json:
+        with open(options.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,228 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import json
+import time
+import random
+import platform
+import tempfile
+import contextlib
+import subprocess
+import numpy as np
+from milp import SCIP
+from profiling import Profiler
+from time_table import read_input_file, check_input, create_solver, score_time_table, TimeTableModel
+
+PHASES = ('validate', 'build', 'export', 'solve', 'parse')
+
+
+def synthetic_input(participants, sessions, rooms=2, wishes=3, seed=0, courses=None, density=None):
+    # 実行可能な時間割を1つ隠し持つランダムな入力を作る
+    ## courses: 講座数 (省略時は枠の 9 割)
+    ## density: 各参加者が希望する講座の割合 (指定すると wishes の代わりに使い，講座の人気に偏りを付ける)
+    rng = random.Random(seed)
+    names = ['p{0}'.format(i) for i in range(participants)]
+    session_names = ['s{0}'.format(i) for i in range(sessions)]
+    ## セッションごとの講座時間を決めて，枠を (ほぼ) 全て埋める講座を置く
+    lengths = [rng.choice([60, 90]) for _ in range(sessions)]
+    slots = [(sid, i, room) for sid, t in enumerate(lengths)
+             for i in range(180 // t) for room in range(rooms)]
+    rng.shuffle(slots)
+    slots = slots[:max(1, min(courses or len(slots) * 9 // 10, len(slots)))]
+    time_slots = {'60': 0, '90': 0}
+    courses = []
+    teaching = {}
+    for sid, i, room in slots:
+        t = lengths[sid]
+        time_slots[str(t)] += 1
+        lecturer = rng.choice([n for n in names if (sid, i) not in teaching.get(n, ())])
+        teaching.setdefault(lecturer, set()).add((sid, i))
+        courses.append({'name': lecturer, 'title': 'c{0}'.format(len(courses)),
+                        'times': [t] if rng.random() < 0.2 else [], 'applicants': []})
+    ## 出席期間は講座を担当するセッションを含むようにする
+    presence = {}
+    for name in names:
+        sids = [sid for sid, _ in teaching.get(name, ())]
+        first = rng.randrange(sessions) if not sids else rng.randint(0, min(sids))
+        last = rng.randint(max(sids + [first]), sessions - 1)
+        presence[name] = {'first': session_names[first], 'last': session_names[last]}
+    if density is None:
+        for name in names:
+            for course in rng.sample(courses, min(wishes, len(courses))):
+                if course['name'] != name:
+                    course['applicants'].append(name)
+    else:
+        popularity = [rng.paretovariate(2.0) for _ in courses]
+        for name in names:
+            count = min(max(1, int(round(rng.gauss(density, density / 3) * len(courses)))), len(courses))
+            chosen = set()
+            while len(chosen) < count:
+                chosen.add(rng.choices(range(len(courses)), popularity)[0])
+            for cid in sorted(chosen):
+                if courses[cid]['name'] != name:
+                    courses[cid]['applicants'].append(name)
+    for course in courses:
+        if not course['applicants']:
+            course['applicants'].append(rng.choice([n for n in names if n != course['name']]))
+    return {'time_slots': time_slots,
+            'sessions': [{'name': n, 'rooms': rooms, 'time': 180} for n in session_names],
+            'participants': presence,
+            'courses': courses}
+
+
+def run_phases(name, input, solver_factory=None, formulation='slot', format='lp', trace_memory=True):
+    # 入力の検査・モデル作成・書き出し・求解・解の読み込みと時間割の取り出しを別々に測る
+    ## 外部ソルバ自身の書き出しと解の読み込みの時間は solve ではなく export と parse に入る
+    result = {'instance': name, 'formulation': formulation, 'format': format,
+              'participants': len(input['participants']), 'courses': len(input['courses']),
+              'sessions': len(input['sessions']),
+              'applications': sum(len(course['applicants']) for course in input['courses'])}
+    log = io.StringIO()
+    with Profiler(trace_memory) as profiler, contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        with profiler.phase('validate'):
+            check_input(input)
+        with profiler.phase('build'):
+            model = TimeTableModel(input, formulation)
+        result['columns'] = model.model.num_columns
+        result['rows'] = model.model.num_rows
+        result['nonzeros'] = model.model.num_nonzeros
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'model.{0}'.format(format))
+            with profiler.phase('export'):
+                SCIP(format=format, quiet=True, presolve=False)._export(
+                    filename, False, model.objective, model.model)
+            result['file_size'] = os.path.getsize(filename)
+        if solver_factory is not None:
+            solver = solver_factory()
+            profiler.instrument_solver(solver, 'export', 'parse')
+            with profiler.phase('solve'):
+                solution = solver.maximize(model.objective, model.model)
+            profiler.restore()
+            result['status'] = solution.status if solution else 'no solution'
+            result['solver'] = solution.statistics if solution else {}
+            if solution:
+                with profiler.phase('parse'):
+                    time_table = model.time_table(solution)
+                result['objective'] = score_time_table(input, time_table)
+    result['time'] = dict((phase, profiler.phases[phase]['time']) for phase in PHASES if phase in profiler.phases)
+    if trace_memory:
+        result['peak_memory'] = dict((phase, profiler.phases[phase]['peak_memory']) for phase in result['time'])
+    return result
+
+
+def compare_formulations(name, input, solver_factory=None, formulations=('slot', 'compact')):
+    # 定式化ごとのモデルの大きさと作成時間 (solver_factory があれば求解時間と目的関数値も)
+    results = []
+    for formulation in formulations:
+        result = {'instance': name, 'formulation': formulation}
+        begin = time.perf_counter()
+        model = TimeTableModel(input, formulation)
+        result['build'] = time.perf_counter() - begin
+        result['columns'] = model.model.num_columns
+        result['rows'] = model.model.num_rows
+        result['nonzeros'] = model.model.num_nonzeros
+        if solver_factory is not None:
+            ## 作ったモデルをそのまま解く (作成時間は solve に含めない)
+            solver = solver_factory()
+            begin = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                time_table = model.solve(solver)
+            result['solve'] = time.perf_counter() - begin
+            result['objective'] = score_time_table(input, time_table) if time_table else None
+        results.append(result)
+    return results
+
+
+def environment():
+    # 結果を比較するときに必要な実行環境の情報
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    try:
+        import resource
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except ImportError:
+        max_rss = None
+    return {'commit': commit, 'date': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(), 'numpy': np.__version__,
+            'platform': platform.platform(), 'cpus': os.cpu_count(), 'max_rss': max_rss}
+
+
+def print_phases(results):
+    print('|instance|formulation|columns|rows|nonzeros|' +
+          '|'.join('{0} (s)'.format(phase) for phase in PHASES) + '|peak (MB)|objective|')
+    for r in results:
+        print('|{0}|{1}|{2}|{3}|{4}|{5}|{6}|{7}|'.format(
+            r['instance'], r['formulation'], r['columns'], r['rows'], r['nonzeros'],
+            '|'.join('{0:.3f}'.format(r['time'][phase]) if phase in r['time'] else '-' for phase in PHASES),
+            '{0:.1f}'.format(max(r['peak_memory'].values()) / 2 ** 20) if 'peak_memory' in r else '-',
+            '{0:.4f}'.format(r['objective']) if r.get('objective') is not None else '-'))
+
+
+def print_results(results):
+    print('|instance|formulation|columns|rows|nonzeros|build (s)|solve (s)|objective|')
+    for r in results:
+        print('|{0}|{1}|{2}|{3}|{4}|{5:.3f}|{6}|{7}|'.format(
+            r['instance'], r['formulation'], r['columns'], r['rows'], r['nonzeros'], r['build'],
+            '{0:.3f}'.format(r['solve']) if 'solve' in r else '-',
+            '{0:.4f}'.format(r['objective']) if r.get('objective') is not None else '-'))
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    parser = OptionParser(usage='python3 benchmark.py [options] [input.json ...]')
+    parser.add_option("--solver", dest="solver", choices=["scip", "cplex", "bnb"],
+                      help="also solve each model (scip, cplex, bnb); default: only build")
+    parser.add_option("--scip", dest="scip", default="scip", help="path to a SCIP solver", metavar="PATH")
+    parser.add_option("--time-limit", dest="time_limit", type="float",
+                      help="time limit in seconds", metavar="SECONDS")
+    parser.add_option("--synthetic", dest="synthetic", default="20x4,50x6,200x8",
+                      help="synthetic instances as PARTICIPANTSxSESSIONS[xROOMS[xCOURSES]],... "
+                      "(default: %default)")
+    parser.add_option("--density", dest="density", type="float",
+                      help="fraction of the courses each synthetic participant applies to (default: 3 courses)")
+    parser.add_option("--seed", dest="seed", type="int", default=0)
+    parser.add_option("--phases", dest="phases", action="store_true", default=False,
+                      help="time validation, build, export, solve and parse separately")
+    parser.add_option("--format", dest="format", default="lp", choices=["lp", "mps", "mps.gz"],
+                      help="model file format for --phases (lp, mps, mps.gz)")
+    parser.add_option("--formulation", dest="formulations", action="append", choices=["slot", "compact"],
+                      help="formulation to benchmark (may be repeated; default: both)")
+    parser.add_option("--no-memory", dest="memory", action="store_false", default=True,
+                      help="do not trace peak memory with tracemalloc (it slows down --phases)")
+    parser.add_option("--json", dest="json", metavar="FILE",
+                      help="also write the results and the environment (commit, versions) as JSON to FILE")
+    options, args = parser.parse_args()
+
+    solver_factory = None
+    if options.solver:
+        solver_factory = lambda: create_solver(options.solver, options.scip if options.solver == 'scip' else None,
+                                               options.format, time_limit=options.time_limit, quiet=True)
+    formulations = tuple(options.formulations or ('slot', 'compact'))
+    instances = [(filename, read_input_file(filename)) for filename in args]
+    for spec in filter(None, options.synthetic.split(',')):
+        sizes = list(map(int, spec.split('x')))
+        participants, sessions = sizes[:2]
+        rooms = sizes[2] if len(sizes) > 2 else 2
+        courses = sizes[3] if len(sizes) > 3 else None
+        instances.append((spec, synthetic_input(participants, sessions, rooms, seed=options.seed,
+                                                courses=courses, density=options.density)))
+    results = []
+    for name, input in instances:
+        if options.phases:
+            for formulation in formulations:
+                results.append(run_phases(name, input, solver_factory, formulation, options.format,
+                                          options.memory))
+        else:
+            results.extend(compare_formulations(name, input, solver_factory, formulations))
+    if options.phases:
+        print_phases(results)
+    else:
+        print_results(results)
+    if options.json:
+        with open(options.json, 'w', encoding='utf-8') as f:
+            json.dump({'environment': environment(), 'results': results}, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,168 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import sys
+import math
+import time
+import random
+import itertools
+from time_table import InstanceIndex, slot_length_patterns, pattern_upper_bound
+
+
+class LocalSearch(object):
+    # 講座時間を固定した上で，講座を置く枠 (sid, i) を貪欲法 + 焼きなまし法で決める
+    def __init__(self, input, index, lengths, rng):
+        self.input = input
+        self.index = index
+        self.lengths = lengths
+        self.rng = rng
+        self.rooms = [session['rooms'] for session in input['sessions']]
+        self.lecturer = [course['name'] for course in input['courses']]
+        ## 講座ごとに置ける枠
+        self.options = [[(slot[1], slot[2]) for slot in index.allowed_slots[cid]
+                         if slot[0] == lengths[slot[1]]]
+                        for cid in range(len(input['courses']))]
+        ## 講座を動かしたときに目的関数値が変わり得る人
+        self.affected = []
+        for cid, course in enumerate(input['courses']):
+            people = set(course['applicants'])
+            if course['name'] in index.courses_by_applicant:
+                people.add(course['name'])
+            self.affected.append(people)
+        self.slot_of = {}
+        self.occupants = {}
+
+    def value(self, applicant):
+        wishes = self.index.courses_by_applicant[applicant]
+        teaching = set(self.slot_of.get(cid) for cid in self.index.courses_by_lecturer.get(applicant, ()))
+        slots = set()
+        for cid in wishes:
+            slot = self.slot_of.get(cid)
+            if (slot is not None and self.lecturer[cid] != applicant and slot not in teaching and
+                    self.index.present(applicant, slot[0])):
+                slots.add(slot)
+        return len(slots) / len(wishes)
+
+    def objective(self):
+        return sum(self.value(applicant) for applicant in self.index.courses_by_applicant)
+
+    def can_place(self, cid, slot, ignore=None):
+        occupants = [other for other in self.occupants.get(slot, ()) if other != ignore]
+        return (len(occupants) < self.rooms[slot[0]] and
+                all(self.lecturer[other] != self.lecturer[cid] for other in occupants))
+
+    def place(self, cid, slot):
+        self.slot_of[cid] = slot
+        self.occupants.setdefault(slot, []).append(cid)
+
+    def remove(self, cid):
+        self.occupants[self.slot_of.pop(cid)].remove(cid)
+
+    def construct(self):
+        ## 置ける枠の少ない講座から，目的関数値が一番増える枠に置く
+        quota = dict((int(t), n) for t, n in self.input['time_slots'].items())
+        order = sorted(range(len(self.options)), key=lambda cid: (len(self.options[cid]), self.rng.random()))
+        for cid in order:
+            best, best_gain = None, None
+            for slot in self.options[cid]:
+                if quota[self.lengths[slot[0]]] <= 0 or not self.can_place(cid, slot):
+                    continue
+                before = sum(self.value(a) for a in self.affected[cid])
+                self.place(cid, slot)
+                gain = sum(self.value(a) for a in self.affected[cid]) - before + 1e-6 * self.rng.random()
+                self.remove(cid)
+                if best_gain is None or gain > best_gain:
+                    best, best_gain = slot, gain
+            if best is None:
+                return False
+            self.place(cid, best)
+            quota[self.lengths[best[0]]] -= 1
+        return True
+
+    def neighbour(self):
+        ## move: 同じ講座時間の空いている枠へ / swap: 2つの講座の枠を交換
+        cid = self.rng.randrange(len(self.options))
+        source = self.slot_of[cid]
+        if self.rng.random() < 0.5:
+            target = self.rng.choice(self.options[cid])
+            if (target == source or self.lengths[target[0]] != self.lengths[source[0]] or
+                    not self.can_place(cid, target)):
+                return None
+            return [(cid, target)]
+        other = self.rng.randrange(len(self.options))
+        target = self.slot_of[other]
+        if target == source or target not in self.options[cid] or source not in self.options[other]:
+            return None
+        if not self.can_place(cid, target, other) or not self.can_place(other, source, cid):
+            return None
+        return [(cid, target), (other, source)]
+
+    def apply(self, moves):
+        for cid, _ in moves:
+            self.remove(cid)
+        for cid, slot in moves:
+            self.place(cid, slot)
+
+    def anneal(self, deadline, temperature=0.3, cooling=0.9995):
+        current = self.objective()
+        best, best_slots = current, dict(self.slot_of)
+        while time.time() < deadline:
+            for _ in range(100):
+                moves = self.neighbour()
+                if moves is None:
+                    continue
+                undo = [(cid, self.slot_of[cid]) for cid, _ in moves]
+                people = set.union(*[self.affected[cid] for cid, _ in moves])
+                before = sum(self.value(a) for a in people)
+                self.apply(moves)
+                delta = sum(self.value(a) for a in people) - before
+                if delta >= 0 or self.rng.random() < math.exp(delta / temperature):
+                    current += delta
+                    if current > best + 1e-9:
+                        best, best_slots = current, dict(self.slot_of)
+                else:
+                    self.apply(undo)
+                temperature = max(temperature * cooling, 1e-4)
+        self.slot_of = {}
+        self.occupants = {}
+        for cid, slot in best_slots.items():
+            self.place(cid, slot)
+        return best
+
+    def time_table(self):
+        result = []
+        for sid, session in enumerate(self.input['sessions']):
+            t = self.lengths[sid]
+            ret = {'name': session['name'], 'rooms': session['rooms'], 'time': session['time'],
+                   'courses': [], 'slot': t}
+            for i in range(session['time'] // t):
+                ret['courses'].append([(self.input['courses'][cid]['name'], self.input['courses'][cid]['title'])
+                                       for cid in sorted(self.occupants.get((sid, i), []))])
+            result.append(ret)
+        return result
+
+
+def heuristic_time_table(input, time_limit=1.0, seed=0, patterns=4, quiet=False):
+    # 上界の大きい講座時間の組み合わせから順に，持ち時間を等分して焼きなます
+    deadline = time.time() + time_limit
+    rng = random.Random(seed)
+    index = InstanceIndex(input)
+    candidates = sorted(itertools.islice(slot_length_patterns(input, index), 4096),
+                        key=lambda lengths: -pattern_upper_bound(input, index, lengths))[:patterns]
+    best, best_time_table = None, None
+    for n, lengths in enumerate(candidates):
+        search = LocalSearch(input, index, lengths, rng)
+        for _ in range(10):
+            if search.construct():
+                break
+            search = LocalSearch(input, index, lengths, rng)
+        else:
+            continue
+        value = search.anneal(time.time() + (deadline - time.time()) / (len(candidates) - n))
+        if not quiet:
+            print('heuristic: pattern {0}: objective: {1:.4f}'.format(lengths, value), file=sys.stderr)
+        if best is None or value > best:
+            best, best_time_table = value, search.time_table()
+    if best is not None:
+        print('objective value: {0}'.format(best))
+    return best_time_table
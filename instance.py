@@ -0,0 +1,209 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import zipfile
+import hashlib
+import numpy as np
+from time_table import check_input
+
+## これより小さい入力は .npz を読むより JSON を解析するほうが速い
+CACHE_MIN_SIZE = 64 * 1024
+
+## 入力の各要素のうち配列にするキー (これ以外のキーは extras にそのまま残す)
+KNOWN_KEYS = {'input': ('time_slots', 'sessions', 'participants', 'courses'),
+              'sessions': ('name', 'rooms', 'time'),
+              'participants': ('first', 'last'),
+              'courses': ('name', 'title', 'times', 'applicants')}
+
+
+def _extras(items, known):
+    # 知らないキーを持つ要素だけ {番号: {キー: 値}} で集める
+    extras = {}
+    for i, item in items:
+        extra = dict((key, value) for key, value in item.items() if key not in known)
+        if extra:
+            extras[str(i)] = extra
+    return extras
+
+
+class Instance(object):
+    # 入力 JSON を参加者・講座・セッション・講座時間・timeslot の整数 ID で表したもの
+    ## 名前 (ID -> 文字列のリスト) のほかは整数の配列なので .npz に保存・読み込みできる
+    ## 配列にしないキーは extras (JSON) に残し，to_input で元の入力に戻す
+    VERSION = 2
+    INTEGER_FIELDS = ('registered', 'presence', 'session_rooms', 'session_time',
+                      'lengths', 'length_count', 'slots',
+                      'course_lecturer', 'course_lengths', 'times_ptr', 'times',
+                      'applicant_ptr', 'applicant_ids')
+    STRING_FIELDS = ('participant_names', 'session_names', 'course_titles')
+    FIELDS = STRING_FIELDS + INTEGER_FIELDS + ('extras',)
+
+    def __init__(self, **arrays):
+        for name in Instance.FIELDS:
+            setattr(self, name, arrays[name])
+
+    @classmethod
+    def compile(cls, input):
+        # 入力を検査してから整数 ID に変換する
+        check_input(input)
+        sessions = input['sessions']
+        session_ids = dict((session['name'], sid) for sid, session in enumerate(sessions))
+        ## 参加者 (出欠を書いていない受講希望者は後ろに足し，どのセッションにもいないことにする)
+        names = list(input['participants'])
+        registered = len(names)
+        participant_ids = dict((name, n) for n, name in enumerate(names))
+        for course in input['courses']:
+            for applicant in course['applicants']:
+                if applicant not in participant_ids:
+                    participant_ids[applicant] = len(names)
+                    names.append(applicant)
+        presence = np.zeros((len(names), 2), dtype=np.int32)
+        presence[registered:] = (0, -1)
+        for name, p in input['participants'].items():
+            presence[participant_ids[name]] = (session_ids[p['first']], session_ids[p['last']])
+        ## 講座時間と timeslot (講座時間, セッション, 何番目)
+        lengths = [int(t) for t in input['time_slots']]
+        session_time = np.array([session['time'] for session in sessions], dtype=np.int32)
+        slots = np.array([(t, sid, j) for t in lengths for sid in range(len(sessions))
+                          for j in range(session_time[sid] // t)], dtype=np.int32).reshape(-1, 3)
+        ## 講座 (希望時間と，講座時間ごとに行えるか)
+        courses = input['courses']
+        course_lengths = np.array([[not course['times'] or t in course['times'] for t in lengths]
+                                   for course in courses], dtype=bool).reshape(len(courses), len(lengths))
+        applicants = [[participant_ids[a] for a in course['applicants']] for course in courses]
+        extras = {'input': _extras([(0, input)], KNOWN_KEYS['input']).get('0', {}),
+                  'sessions': _extras(enumerate(sessions), KNOWN_KEYS['sessions']),
+                  'participants': _extras(enumerate(input['participants'].values()), KNOWN_KEYS['participants']),
+                  'courses': _extras(enumerate(courses), KNOWN_KEYS['courses'])}
+        return cls(participant_names=names,
+                   registered=np.arange(len(names)) < registered,
+                   presence=presence,
+                   session_names=[session['name'] for session in sessions],
+                   session_rooms=np.array([session['rooms'] for session in sessions], dtype=np.int32),
+                   session_time=session_time,
+                   lengths=np.array(lengths, dtype=np.int32),
+                   length_count=np.array([input['time_slots'][str(t)] for t in lengths], dtype=np.int32),
+                   slots=slots,
+                   course_lecturer=np.array([participant_ids[course['name']] for course in courses],
+                                            dtype=np.int32),
+                   course_titles=[course['title'] for course in courses],
+                   course_lengths=course_lengths,
+                   times_ptr=np.cumsum([0] + [len(course['times']) for course in courses]).astype(np.int32),
+                   times=np.array([t for course in courses for t in course['times']], dtype=np.int32),
+                   applicant_ptr=np.cumsum([0] + [len(a) for a in applicants]).astype(np.int32),
+                   applicant_ids=np.array([a for ids in applicants for a in ids], dtype=np.int32),
+                   extras=json.dumps(extras, ensure_ascii=False))
+
+    @classmethod
+    def load(cls, filename):
+        # npz は要素ごとに zip を読むので遅い
+        ## 整数の配列 (先頭に版と各配列の大きさ) と，文字列を NUL でつないだ UTF-8 の2つだけにまとめてある
+        with np.load(filename, allow_pickle=False) as data:
+            integers, text = data['integers'], data['text'].tobytes().decode('utf-8')
+        if int(integers[0]) != cls.VERSION:
+            raise ValueError('{0}: unsupported instance version {1}'.format(filename, int(integers[0])))
+        fields = len(cls.INTEGER_FIELDS)
+        layout = integers[1:1 + 3 * fields].reshape(fields, 3).tolist()
+        arrays = {}
+        begin = 1 + 3 * fields
+        for name, (size, columns, boolean) in zip(cls.INTEGER_FIELDS, layout):
+            array = integers[begin:begin + size]
+            if columns >= 0:
+                array = array.reshape(-1, columns)
+            arrays[name] = array.astype(bool) if boolean else array
+            begin += size
+        strings = text.split('\0')
+        counts = (len(arrays['presence']), len(arrays['session_time']), len(arrays['course_lecturer']))
+        begin = 0
+        for name, count in zip(cls.STRING_FIELDS, counts):
+            arrays[name] = strings[begin:begin + count]
+            begin += count
+        arrays['extras'] = strings[begin]
+        return cls(**arrays)
+
+    def save(self, filename):
+        integers = [getattr(self, name) for name in Instance.INTEGER_FIELDS]
+        layout = [(a.size, a.shape[1] if a.ndim == 2 else -1, a.dtype == bool) for a in integers]
+        strings = [string for name in Instance.STRING_FIELDS for string in getattr(self, name)] + [self.extras]
+        if any('\0' in string for string in strings):
+            raise ValueError('names must not contain NUL characters')
+        with open(filename, 'wb') as f:
+            np.savez(f, integers=np.concatenate([np.array([Instance.VERSION], dtype=np.int32),
+                                                 np.array(layout, dtype=np.int32).ravel()] +
+                                                [a.astype(np.int32).ravel() for a in integers]),
+                     text=np.frombuffer('\0'.join(strings).encode('utf-8'), dtype=np.uint8))
+
+    def applicants(self, cid):
+        # 講座 cid の受講希望者の参加者 ID
+        return self.applicant_ids[self.applicant_ptr[cid]:self.applicant_ptr[cid + 1]]
+
+    def present(self, sids):
+        # 参加者 × セッションの出席表
+        sids = np.asarray(sids)
+        return (self.presence[:, :1] <= sids) & (sids <= self.presence[:, 1:])
+
+    def unregistered(self):
+        # 出欠を書いていない受講希望者の名前
+        return [name for name, registered in zip(self.participant_names, self.registered.tolist())
+                if not registered]
+
+    def to_input(self):
+        # 元の入力 (find_best_time_table などが受け取る dict) に戻す
+        ## 受講希望者の名前は参加者の名前の文字列をそのまま使い回す
+        names = self.participant_names
+        sessions = self.session_names
+        extras = json.loads(self.extras)
+        input = extras['input']
+        input['time_slots'] = dict((str(t), n) for t, n in zip(self.lengths.tolist(), self.length_count.tolist()))
+        input['sessions'] = [{'name': name, 'rooms': rooms, 'time': time}
+                             for name, rooms, time in zip(sessions, self.session_rooms.tolist(),
+                                                          self.session_time.tolist())]
+        registered = int(self.registered.sum())
+        presence = np.array(sessions, dtype=object)[self.presence[:registered]].T.tolist()
+        input['participants'] = {name: {'first': first, 'last': last}
+                                 for name, first, last in zip(names[:registered], *presence)}
+        applicants = np.array(names, dtype=object)[self.applicant_ids].tolist()
+        applicant_ptr = self.applicant_ptr.tolist()
+        times = self.times.tolist()
+        times_ptr = self.times_ptr.tolist()
+        input['courses'] = [{'name': names[lecturer], 'title': title,
+                             'times': times[times_ptr[cid]:times_ptr[cid + 1]],
+                             'applicants': applicants[applicant_ptr[cid]:applicant_ptr[cid + 1]]}
+                            for cid, (lecturer, title) in enumerate(zip(self.course_lecturer.tolist(),
+                                                                        self.course_titles))]
+        for key, items in (('sessions', input['sessions']), ('participants', list(input['participants'].values())),
+                           ('courses', input['courses'])):
+            for i, extra in extras[key].items():
+                items[int(i)].update(extra)
+        return input
+
+
+def compile_input_file(filename, cache):
+    # 入力ファイルを内容のハッシュで cache ディレクトリに .npz として保存し，2回目からは検査を省く
+    ## ファイルの中身が変われば別のキーになるので，古い .npz は使われない
+    with open(filename, 'rb') as f:
+        raw = f.read()
+    key = hashlib.sha256(raw).hexdigest()
+    path = os.path.join(cache, '{0}.v{1}.npz'.format(key, Instance.VERSION))
+    try:
+        instance = Instance.load(path)
+    except (OSError, ValueError, KeyError, IndexError, zipfile.BadZipFile):
+        pass
+    else:
+        ## 検査の警告は毎回出す
+        for applicant in instance.unregistered():
+            print('Warning: 講座見たい人 {0} さんが出欠を書いていません'.format(applicant), file=sys.stderr)
+        return instance
+    instance = Instance.compile(json.loads(raw.decode('utf-8')))
+    os.makedirs(cache, exist_ok=True)
+    temporary = '{0}.{1}.tmp'.format(path, os.getpid())
+    try:
+        instance.save(temporary)
+    except ValueError:
+        ## 保存できない名前 (NUL を含む) があれば毎回 JSON から読む
+        return instance
+    os.replace(temporary, path)
+    return instance
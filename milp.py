@@ -2,13 +2,51 @@
 # -*- coding: utf-8 -*-
 
 import os
+import io
 import sys
+import time
+import errno
+import shutil
+import tempfile
 import subprocess
+import contextlib
 import numbers
-from collections import MutableSet, MutableMapping
+import weakref
+import itertools
+from array import array
+from collections.abc import MutableSet, MutableMapping
+
+import numpy as np
+
+
+## 変数名ごとの整数 ID (名前が同じ変数は同じ変数として扱う)
+## 変数そのものは持たず，変数を受け取った VariableDict や Model が持つ
+## 表は名前 -> _VariableId の弱参照で，その名前の変数が1つも残っていなければ項目が消える
+## (ID で変数を引く VariableDict や Model は変数も持っているので，使われている ID が消えることはない)
+## そのため service.py のワーカーや TimeTableSession のように長く動くプロセスでも表は大きくならない
+class _VariableId(object):
+    __slots__ = ('id', '__weakref__')
+
+
+_variable_ids = weakref.WeakValueDictionary()
+_next_variable_id = itertools.count()
+
+
+def _variable_id(name):
+    key = _variable_ids.get(name)
+    if key is None:
+        key = _VariableId()
+        key.id = next(_next_variable_id)
+        _variable_ids[name] = key
+    return key
 
 
 class Variable(object):
+    def _register(self):
+        ## _key を持っている間は同じ名前の変数が同じ ID になる
+        self._key = _variable_id(self.name)
+        self.id = self._key.id
+
     def _to_linear_expression(self):
         terms = VariableDict()
         terms[self] = 1.0
@@ -76,6 +114,7 @@ class RealVariable(Variable):
         if name is None:
             name = 'ur{0}'.format(RealVariable._real_variable_number)
         self.name = name.replace(' ', '')
+        self._register()
 
     def __repr__(self):
         return 'RealVariable({0})'.format(repr(self.name))
@@ -92,6 +131,7 @@ class IntegerVariable(Variable):
         if name is None:
             name = 'ui{0}'.format(IntegerVariable._integer_variable_number)
         self.name = name.replace(' ', '')
+        self._register()
 
     def __repr__(self):
         return 'IntegerVariable({0})'.format(repr(self.name))
@@ -108,6 +148,7 @@ class BinaryVariable(Variable):
         if name is None:
             name = 'ub{0}'.format(BinaryVariable._binary_variable_number)
         self.name = name.replace(' ', '')
+        self._register()
 
     def __repr__(self):
         return 'BinaryVariable({0})'.format(repr(self.name))
@@ -116,81 +157,101 @@ class BinaryVariable(Variable):
         return self.name
 
 
-class VariableWrapperForCollections(object):
-    def __init__(self, variable):
-        self.variable = variable
-        self.name = str(variable)
-        self.hash = hash(self.name)
-
-    def __eq__(self, lhs):
-        return self.name == lhs.name
-
-    def __ne__(self, rhs):
-        return not self == rhs
-
-    def __hash__(self):
-        return self.hash
-
-
 class VariableSet(MutableSet):
     def __init__(self):
-        self._set = set()
+        self._variables = dict()
 
     def add(self, variable):
-        self._set.add(VariableWrapperForCollections(variable))
+        self._variables.setdefault(variable.id, variable)
 
     def discard(self, variable):
-        self._set.discard(VariableWrapperForCollections(variable))
+        self._variables.pop(variable.id, None)
 
     def __contains__(self, variable):
-        return VariableWrapperForCollections(variable) in self._set
+        return variable.id in self._variables
 
     def __iter__(self):
-        return iter([wrapper.variable for wrapper in self._set])
+        return iter(self._variables.values())
 
     def __len__(self):
-        return len(self._set)
+        return len(self._variables)
 
     def __str__(self):
-        return '{{{0}}}'.format(', '.join((str(wrapper.variable) for wrapper in self._set)))
+        return '{{{0}}}'.format(', '.join((str(v) for v in self)))
 
 
 class VariableDict(MutableMapping):
     def __init__(self, args=[]):
         self._dict = dict()
+        self._variables = dict()
         for k, v in args:
             self[k] = v
 
     def __delitem__(self, variable):
-        del self._dict[VariableWrapperForCollections(variable)]
+        del self._dict[variable.id]
+        del self._variables[variable.id]
 
     def __getitem__(self, variable):
-        return self._dict[VariableWrapperForCollections(variable)]
+        return self._dict[variable.id]
+
+    def __contains__(self, variable):
+        return variable.id in self._dict
 
     def __iter__(self):
-        return iter([wrapper.variable for wrapper in self._dict])
+        return iter(self._variables.values())
 
     def __len__(self):
         return len(self._dict)
 
     def __setitem__(self, variable, value):
-        self._dict[VariableWrapperForCollections(variable)] = value
+        self._variables.setdefault(variable.id, variable)
+        self._dict[variable.id] = value
+
+    def get(self, variable, default=None):
+        return self._dict.get(variable.id, default)
 
     def copy(self):
         copied_dictionary = VariableDict()
-        for k in self:
-            copied_dictionary[k] = self[k]
+        copied_dictionary._dict = self._dict.copy()
+        copied_dictionary._variables = self._variables.copy()
         return copied_dictionary
 
 
 class Solution(VariableDict):
     def __init__(self):
         self.objective_value = None
+        self.status = None
+        self.gap = None
+        self.statistics = {}
         VariableDict.__init__(self)
 
+    def __getitem__(self, variable):
+        return self._dict.get(variable.id, 0.0)
+
+    def __setitem__(self, variable, value):
+        if value:
+            VariableDict.__setitem__(self, variable, value)
+        elif variable.id in self._dict:
+            VariableDict.__delitem__(self, variable)
+
+    def get(self, variable, default=0.0):
+        return self._dict.get(variable.id, default)
+
+    def copy(self):
+        copied = Solution()
+        copied.objective_value = self.objective_value
+        copied.status = self.status
+        copied.gap = self.gap
+        copied.statistics = dict(self.statistics)
+        copied._dict = self._dict.copy()
+        copied._variables = self._variables.copy()
+        return copied
+
 
 class LinearExpression(object):
-    def __init__(self, variable_terms=VariableDict(), constant=0.0):
+    def __init__(self, variable_terms=None, constant=0.0):
+        if variable_terms is None:
+            variable_terms = VariableDict()
         self.variable_terms = variable_terms
         self.constant = constant
 
@@ -221,23 +282,36 @@ class LinearExpression(object):
 
         return ' '.join(term_strs)
 
-    def __add__(self, rhs):
+    def _add_scaled(self, rhs, scale):
         if isinstance(rhs, numbers.Number):
-            return LinearExpression(self.variable_terms, self.constant + rhs)
-        new_variable_terms = self.variable_terms.copy()
-        if isinstance(rhs, Variable):
-            if rhs in new_variable_terms:
-                new_variable_terms[rhs] += 1.0
-            else:
-                new_variable_terms[rhs] = 1.0
-            return LinearExpression(new_variable_terms, self.constant)
+            self.constant += scale * rhs
+        elif isinstance(rhs, Variable):
+            terms = self.variable_terms._dict
+            terms[rhs.id] = terms.get(rhs.id, 0.0) + scale
+            self.variable_terms._variables.setdefault(rhs.id, rhs)
         elif isinstance(rhs, LinearExpression):
-            for v, c in rhs.variable_terms.items():
-                if v in new_variable_terms:
-                    new_variable_terms[v] += c
-                else:
-                    new_variable_terms[v] = c
-            return LinearExpression(new_variable_terms, self.constant + rhs.constant)
+            terms = self.variable_terms._dict
+            for id, c in rhs.variable_terms._dict.items():
+                terms[id] = terms.get(id, 0.0) + scale * c
+            variables = self.variable_terms._variables
+            for id, v in rhs.variable_terms._variables.items():
+                variables.setdefault(id, v)
+            self.constant += scale * rhs.constant
+        else:
+            return NotImplemented
+        return self
+
+    def copy(self):
+        return LinearExpression(self.variable_terms.copy(), self.constant)
+
+    def __add__(self, rhs):
+        return self.copy()._add_scaled(rhs, 1.0)
+
+    def __iadd__(self, rhs):
+        return self._add_scaled(rhs, 1.0)
+
+    def __isub__(self, rhs):
+        return self._add_scaled(rhs, -1.0)
 
     def __radd__(self, lhs):
         return self + lhs
@@ -280,6 +354,169 @@ class LinearExpression(object):
         return LinearConstraint(self, '=', rhs)
 
 
+def quicksum(terms):
+    expression = LinearExpression()
+    for term in terms:
+        expression += term
+    return expression
+
+
+def _index_keys(index_sets, positions):
+    columns = [list(map(s.__getitem__, column)) for s, column in zip(index_sets, positions.T.tolist())]
+    return zip(*columns)
+
+
+class VariableArray(object):
+    def __init__(self, name, index_sets, mask=None, variable=BinaryVariable):
+        index_sets = [list(s) for s in index_sets]
+        shape = tuple(len(s) for s in index_sets)
+        if mask is None:
+            positions = np.indices(shape).reshape(len(shape), -1).T
+            keys = _index_keys(index_sets, positions)
+        elif isinstance(mask, np.ndarray):
+            if mask.shape != shape:
+                raise ValueError('mask shape {0} does not match {1}'.format(mask.shape, shape))
+            positions = np.argwhere(mask)
+            keys = _index_keys(index_sets, positions)
+        else:
+            keys = list(mask)
+            labels = [dict((key, i) for i, key in enumerate(s)) for s in index_sets]
+            positions = np.array([list(map(label.__getitem__, column))
+                                  for label, column in zip(labels, zip(*keys))],
+                                 dtype=np.int64).reshape(len(shape), -1).T
+        variables = [variable(name.format(*key)) for key in keys]
+        self._assign(index_sets, positions, variables)
+
+    @classmethod
+    def _from(cls, index_sets, positions, variables):
+        array = cls.__new__(cls)
+        array._assign(index_sets, positions, variables)
+        return array
+
+    def _assign(self, index_sets, positions, variables):
+        self.index_sets = index_sets
+        self.shape = tuple(len(s) for s in index_sets)
+        self._labels = [dict((key, i) for i, key in enumerate(s)) for s in index_sets]
+        self._positions = np.asarray(positions, dtype=np.int64).reshape(-1, len(self.shape))
+        self._variables = list(variables)
+        self._ids = np.fromiter((v.id for v in self._variables), dtype=np.int64, count=len(self._variables))
+        self._index = None
+        self._by_id = None
+
+    def _lookup(self):
+        # 添字の位置 -> 何番目の変数か (スカラーの添字で引かれたときに初めて作る)
+        if self._index is None:
+            self._index = dict(zip(map(tuple, self._positions.tolist()), range(len(self._variables))))
+        return self._index
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def index_of(self, label, axis=0):
+        # 軸 axis の添字 label が index_sets[axis] の何番目か (ない添字なら None)
+        ## values や nonzero が返す位置と同じ番号になる
+        return self._labels[axis].get(label)
+
+    def __len__(self):
+        return len(self._variables)
+
+    def __iter__(self):
+        return zip(_index_keys(self.index_sets, self._positions), self._variables)
+
+    def _key(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > self.ndim:
+            raise IndexError('too many indices for VariableArray of dimension {0}'.format(self.ndim))
+        return key + (slice(None),) * (self.ndim - len(key))
+
+    def __contains__(self, key):
+        key = self._key(key)
+        try:
+            position = tuple(label[k] for label, k in zip(self._labels, key))
+        except (KeyError, TypeError):
+            return False
+        return position in self._lookup()
+
+    def __getitem__(self, key):
+        key = self._key(key)
+        if not any(isinstance(k, (slice, list)) for k in key):
+            position = tuple(label[k] for label, k in zip(self._labels, key))
+            index = self._lookup().get(position)
+            if index is None:
+                raise KeyError(key)
+            return self._variables[index]
+        selected = np.ones(len(self._variables), dtype=bool)
+        axes, index_sets, columns = [], [], []
+        for axis, k in enumerate(key):
+            column = self._positions[:, axis]
+            if isinstance(k, slice):
+                chosen = list(range(self.shape[axis]))[k]
+            elif isinstance(k, list):
+                chosen = [self._labels[axis][label] for label in k]
+            else:
+                selected &= column == self._labels[axis][k]
+                continue
+            renumber = np.full(self.shape[axis], -1, dtype=np.int64)
+            renumber[chosen] = np.arange(len(chosen))
+            selected &= renumber[column] >= 0
+            axes.append(axis)
+            index_sets.append([self.index_sets[axis][i] for i in chosen])
+            columns.append(renumber)
+        rows = np.flatnonzero(selected)
+        positions = np.stack([renumber[self._positions[rows, axis]]
+                              for axis, renumber in zip(axes, columns)], axis=1)
+        return VariableArray._from(index_sets, positions, [self._variables[i] for i in rows.tolist()])
+
+    def _expression(self, rows):
+        terms = VariableDict()
+        terms._variables = dict((self._variables[k].id, self._variables[k]) for k in rows)
+        terms._dict = dict.fromkeys(terms._variables, 1.0)
+        return LinearExpression(terms)
+
+    def sum(self, axis=None):
+        if axis is None:
+            return self._expression(range(len(self._variables)))
+        axes = (axis,) if isinstance(axis, int) else tuple(axis)
+        kept = [a for a in range(self.ndim) if a not in axes]
+        shape = tuple(self.shape[a] for a in kept)
+        groups = {}
+        flat = np.ravel_multi_index(self._positions[:, kept].T, shape) if kept else \
+            np.zeros(len(self._variables), dtype=np.int64)
+        for k, cell in enumerate(flat.tolist()):
+            groups.setdefault(cell, []).append(k)
+        result = np.empty(shape, dtype=object)
+        for cell in range(result.size):
+            result.flat[cell] = self._expression(groups.get(cell, ()))
+        return result
+
+    def _solution_values(self, solution):
+        values = solution._dict
+        if len(values) < len(self._variables):
+            if self._by_id is None:
+                self._by_id = dict(zip(self._ids.tolist(), range(len(self._variables))))
+            found = [(self._by_id[id], value) for id, value in values.items() if id in self._by_id]
+            found.sort()
+            rows = np.array([k for k, _ in found], dtype=np.int64)
+            return rows, np.array([value for _, value in found], dtype=np.float64)
+        found = np.fromiter((values.get(id, 0.0) for id in self._ids.tolist()), dtype=np.float64,
+                            count=len(self._variables))
+        rows = np.flatnonzero(found)
+        return rows, found[rows]
+
+    def values(self, solution):
+        result = np.zeros(self.shape)
+        rows, values = self._solution_values(solution)
+        result[tuple(self._positions[rows].T)] = values
+        return result
+
+    def nonzero(self, solution, tol=1e-6):
+        rows, values = self._solution_values(solution)
+        rows = rows[np.abs(values) > tol]
+        return tuple(self._positions[rows].T)
+
+
 class LinearConstraint(object):
     def __init__(self, lhs, sense, rhs):
         self.lhs = lhs - rhs
@@ -302,119 +539,1539 @@ class LinearConstraint(object):
         return variable_set
 
 
-class Solver(object):
-    def _export_to_mps(self, is_minimize, objective, constraints):
-        self.variables = VariableSet()
+def _to_linear_expression(expression):
+    if isinstance(expression, LinearExpression):
+        return expression
+    elif isinstance(expression, Variable):
+        return expression._to_linear_expression()
+    return LinearExpression(constant=expression)
+
+
+LP_SENSES = {b'L': '<=', b'G': '>=', b'E': '='}
+
+
+class Model(object):
+    EPS = 1e-7
+    SENSES = {'<': b'L', '<=': b'L', '>': b'G', '>=': b'G', '=': b'E'}
+
+    def __init__(self):
+        self.variables = []
+        self._columns = dict()
+        self._rows = array('i')
+        self._cols = array('i')
+        self._coefficients = array('d')
+        self._senses = bytearray()
+        self._rhs = array('d')
+        self._bounds = dict()
+        self._families = []
+
+    def __len__(self):
+        return len(self._rhs)
+
+    @property
+    def num_rows(self):
+        return len(self._rhs)
+
+    @property
+    def num_columns(self):
+        return len(self.variables)
+
+    @property
+    def num_nonzeros(self):
+        return len(self._coefficients)
+
+    def column(self, variable):
+        col = self._columns.get(variable.id)
+        if col is None:
+            col = len(self.variables)
+            self._columns[variable.id] = col
+            self.variables.append(variable)
+        return col
+
+    def columns(self, variables):
+        return np.fromiter((self.column(v) for v in variables), dtype=np.int32)
+
+    def add_constraint(self, constraint):
+        row = len(self._rhs)
+        columns = self._columns
+        variables = constraint.lhs.variable_terms._variables
+        for id, coeff in constraint.lhs.variable_terms._dict.items():
+            if abs(coeff) <= Model.EPS:
+                continue
+            col = columns.get(id)
+            if col is None:
+                col = self.column(variables[id])
+            self._rows.append(row)
+            self._cols.append(col)
+            self._coefficients.append(coeff)
+        self._senses += Model.SENSES[constraint.sense]
+        self._rhs.append(constraint.rhs)
+        return row
+
+    def add_constraints(self, constraints):
         for c in constraints:
-            for v in c.variables():
-                self.variables.add(v)
-        subprocess.call('rm -f {0}'.format(self.filename), shell=True)
+            self.add_constraint(c)
+
+    def add_constraint_block(self, rows, columns, coefficients, senses, rhs):
+        rhs = np.asarray(rhs, dtype=np.float64).ravel()
+        rows = np.asarray(rows, dtype=np.int32).ravel()
+        columns = np.asarray(columns, dtype=np.int32).ravel()
+        coefficients = np.broadcast_to(np.asarray(coefficients, dtype=np.float64),
+                                       rows.shape)
+        if rows.shape != columns.shape:
+            raise ValueError('rows and columns must have the same length')
+        if len(rows) and (rows.min() < 0 or rows.max() >= len(rhs)):
+            raise ValueError('row index out of range')
+        if len(columns) and (columns.min() < 0 or columns.max() >= len(self.variables)):
+            raise ValueError('column index out of range')
+        if isinstance(senses, str):
+            senses = Model.SENSES[senses] * len(rhs)
+        else:
+            senses = b''.join(Model.SENSES[sense] for sense in senses)
+            if len(senses) != len(rhs):
+                raise ValueError('senses and rhs must have the same length')
+        offset = len(self._rhs)
+        mask = np.abs(coefficients) > Model.EPS
+        self._rows.frombytes((rows[mask] + offset).astype(np.int32).tobytes())
+        self._cols.frombytes(columns[mask].tobytes())
+        self._coefficients.frombytes(coefficients[mask].tobytes())
+        self._senses += senses
+        self._rhs.frombytes(rhs.tobytes())
+        return np.arange(offset, offset + len(rhs))
+
+    @contextlib.contextmanager
+    def family(self, name):
+        # with の中で追加した制約を制約族 name として記録する (family_statistics 用)
+        begin = len(self._rhs)
+        yield
+        if len(self._rhs) > begin:
+            self._families.append((name, begin, len(self._rhs)))
+
+    def family_statistics(self):
+        # 制約族ごとの制約・非零要素・変数の数 (族を付けずに追加した制約は None にまとめる)
+        names = sorted(set(name for name, _, _ in self._families))
+        family = np.full(self.num_rows, len(names), dtype=np.int64)
+        for name, begin, end in self._families:
+            family[begin:end] = names.index(name)
+        rows, cols, _ = self.coo()
+        statistics = {}
+        for k, name in enumerate(names + [None]):
+            entries = family[rows] == k
+            count = int(np.count_nonzero(family == k))
+            if count:
+                statistics[name] = {'rows': count, 'nonzeros': int(np.count_nonzero(entries)),
+                                    'columns': len(np.unique(cols[entries]))}
+        return statistics
+
+    def add_model(self, other):
+        columns = self.columns(other.variables)
+        rows, cols, coefficients = other.coo()
+        offset = len(self._rhs)
+        self._families.extend((name, begin + offset, end + offset) for name, begin, end in other._families)
+        self._rows.frombytes((rows + offset).astype(np.int32).tobytes())
+        self._cols.frombytes(columns[cols].tobytes())
+        self._coefficients.frombytes(coefficients.tobytes())
+        self._senses += other._senses
+        self._rhs.extend(other._rhs)
+        for col, bounds in other._bounds.items():
+            self._bounds[int(columns[col])] = bounds
+        return np.arange(offset, offset + other.num_rows)
+
+    def coo(self):
+        return (np.frombuffer(self._rows, dtype=np.int32).copy(),
+                np.frombuffer(self._cols, dtype=np.int32).copy(),
+                np.frombuffer(self._coefficients, dtype=np.float64).copy())
+
+    def _compress(self, major, minor, size):
+        order = np.argsort(major, kind='stable')
+        indptr = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(major, minlength=size), out=indptr[1:])
+        return indptr, minor[order], np.frombuffer(self._coefficients, dtype=np.float64)[order]
+
+    def csr(self):
+        rows, cols, _ = self.coo()
+        return self._compress(rows, cols, self.num_rows)
+
+    def csc(self):
+        rows, cols, _ = self.coo()
+        return self._compress(cols, rows, self.num_columns)
+
+    @property
+    def senses(self):
+        return np.frombuffer(bytes(self._senses), dtype='S1')
+
+    @property
+    def rhs(self):
+        return np.frombuffer(self._rhs, dtype=np.float64).copy()
+
+    def fingerprint(self, objective, constant, is_minimize):
+        import hashlib
+        names = [v.name for v in self.variables]
+        order = sorted(range(self.num_columns), key=names.__getitem__)
+        rank = np.empty(self.num_columns, dtype=np.int64)
+        rank[order] = np.arange(self.num_columns)
+        digest = hashlib.sha256()
+        digest.update('{0} {1!r}\n'.format('min' if is_minimize else 'max',
+                                           float(constant)).encode('utf-8'))
+        lower, upper = self.bounds()
+        for col in order:
+            v = self.variables[col]
+            digest.update('{0} {1} {2!r} {3!r} {4!r}\n'.format(
+                type(v).__name__, v.name, float(objective[col]),
+                float(lower[col]), float(upper[col])).encode('utf-8'))
+        rows, cols, data = self.coo()
+        ranks = rank[cols]
+        entries = np.lexsort((ranks, rows))
+        ranks, data = ranks[entries], data[entries]
+        indptr = np.zeros(self.num_rows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=self.num_rows), out=indptr[1:])
+        senses = bytes(self._senses)
+        rhs = self.rhs
+        row_digests = []
+        for i in range(self.num_rows):
+            row = hashlib.sha1(senses[i:i + 1])
+            row.update(rhs[i:i + 1].tobytes())
+            row.update(ranks[indptr[i]:indptr[i + 1]].tobytes())
+            row.update(data[indptr[i]:indptr[i + 1]].tobytes())
+            row_digests.append(row.digest())
+        row_digests.sort()
+        digest.update(b''.join(row_digests))
+        return digest.hexdigest()
+
+    def set_bounds(self, variable, lower, upper):
+        self._bounds[self.column(variable)] = (lower, upper)
+
+    def bounds(self):
+        lower = np.zeros(self.num_columns)
+        upper = np.array([1.0 if isinstance(v, BinaryVariable) else np.inf
+                          for v in self.variables])
+        for col, (lo, up) in self._bounds.items():
+            lower[col] = lo
+            upper[col] = up
+        return lower, upper
+
+    def objective_vector(self, objective):
+        objective = _to_linear_expression(objective)
+        variables = objective.variable_terms._variables
+        cols = [self.column(variables[id]) for id in objective.variable_terms._dict]
+        vector = np.zeros(self.num_columns)
+        np.add.at(vector, cols, list(objective.variable_terms._dict.values()))
+        return vector, objective.constant
+
+
+class PresolvedModel(object):
+    def __init__(self, model, objective, constant, fixed, infeasible=False):
+        self.model = model
+        self.objective = objective
+        self.constant = constant
+        self.fixed = fixed
+        self.infeasible = infeasible
+
+    def postsolve(self, solution):
+        for v, value in self.fixed:
+            solution[v] = value
+        return solution
+
+
+def presolve(model, objective, constant, is_minimize):
+    TOL = 1e-9
+    m, n = model.num_rows, model.num_columns
+    rows, cols, data = model.coo()
+    senses = model.senses
+    rhs = model.rhs
+    lower, upper = model.bounds()
+    integer = np.array([isinstance(v, (IntegerVariable, BinaryVariable))
+                        for v in model.variables], dtype=bool)
+    is_le = senses == b'L'
+    is_ge = senses == b'G'
+    is_eq = senses == b'E'
+    row_active = np.ones(m, dtype=bool)
+    col_active = np.ones(n, dtype=bool)
+    fixed_values = np.zeros(n)
+    cost = objective if is_minimize else -objective
+
+    def infeasible():
+        return PresolvedModel(None, None, None, [], infeasible=True)
+
+    changed = True
+    while changed:
+        changed = False
+        live = row_active[rows] & col_active[cols]
+        count = np.bincount(rows[live], minlength=m)
+
+        # 変数1つだけの制約は上下限に置き換える
+        singleton = row_active & (count == 1)
+        if singleton.any():
+            entries = np.flatnonzero(live & singleton[rows])
+            r, j, a = rows[entries], cols[entries], data[entries]
+            bound = rhs[r] / a
+            upper_side = is_eq[r] | (is_le[r] & (a > 0)) | (is_ge[r] & (a < 0))
+            lower_side = is_eq[r] | (is_le[r] & (a < 0)) | (is_ge[r] & (a > 0))
+            np.minimum.at(upper, j[upper_side], bound[upper_side])
+            np.maximum.at(lower, j[lower_side], bound[lower_side])
+            upper[integer] = np.floor(upper[integer] + 1e-6)
+            lower[integer] = np.ceil(lower[integer] - 1e-6)
+            row_active[singleton] = False
+            changed = True
+        if (lower > upper + 1e-6).any():
+            return infeasible()
+
+        # 固定された変数は代入して消す
+        fixed = col_active & (upper - lower <= TOL)
+        if fixed.any():
+            fixed_values[fixed] = lower[fixed]
+            upper[fixed] = lower[fixed]
+            entries = np.flatnonzero(fixed[cols] & row_active[rows])
+            np.subtract.at(rhs, rows[entries], data[entries] * fixed_values[cols[entries]])
+            constant += objective[fixed].dot(fixed_values[fixed])
+            col_active[fixed] = False
+            changed = True
+            live = row_active[rows] & col_active[cols]
+            count = np.bincount(rows[live], minlength=m)
+
+        # 空の制約と，上下限から常に満たされる制約を消す
+        a = np.where(live, data, 0.0)
+        with np.errstate(invalid='ignore'):
+            low = np.where(a > 0, a * lower[cols], np.where(a < 0, a * upper[cols], 0.0))
+            high = np.where(a > 0, a * upper[cols], np.where(a < 0, a * lower[cols], 0.0))
+        min_activity = np.bincount(rows, weights=low, minlength=m)
+        max_activity = np.bincount(rows, weights=high, minlength=m)
+        scale = 1e-9 * (1.0 + np.abs(rhs))
+        if (row_active & (is_le | is_eq) & (min_activity > rhs + scale)).any() or \
+           (row_active & (is_ge | is_eq) & (max_activity < rhs - scale)).any():
+            return infeasible()
+        redundant = row_active & (
+            (is_le & (max_activity <= rhs + scale)) |
+            (is_ge & (min_activity >= rhs - scale)) |
+            (is_eq & (count == 0)))
+        if redundant.any():
+            row_active[redundant] = False
+            changed = True
+
+        # どの制約にも現れない変数は目的関数だけで値が決まる
+        used = np.zeros(n, dtype=bool)
+        used[cols[row_active[rows] & col_active[cols]]] = True
+        free = col_active & ~used & ((cost >= 0) | np.isfinite(upper))
+        if free.any():
+            lower[free] = np.where(cost[free] >= 0, lower[free], upper[free])
+            upper[free] = lower[free]
+            changed = True
+
+    reduced = Model()
+    kept = np.flatnonzero(col_active)
+    for col in kept.tolist():
+        reduced.column(model.variables[col])
+    new_col = np.full(n, -1, dtype=np.int64)
+    new_col[kept] = np.arange(len(kept))
+    kept_rows = np.flatnonzero(row_active)
+    new_row = np.full(m, -1, dtype=np.int64)
+    new_row[kept_rows] = np.arange(len(kept_rows))
+    entries = row_active[rows] & col_active[cols]
+    reduced._rows.frombytes(new_row[rows[entries]].astype(np.int32).tobytes())
+    reduced._cols.frombytes(new_col[cols[entries]].astype(np.int32).tobytes())
+    reduced._coefficients.frombytes(data[entries].tobytes())
+    reduced._senses += senses[kept_rows].tobytes()
+    reduced._rhs.frombytes(rhs[kept_rows].tobytes())
+    default_lower, default_upper = reduced.bounds()
+    for i, col in enumerate(kept.tolist()):
+        if lower[col] != default_lower[i] or upper[col] != default_upper[i]:
+            reduced._bounds[i] = (lower[col], upper[col])
+    fixed = [(model.variables[col], fixed_values[col]) for col in np.flatnonzero(~col_active).tolist()]
+    return PresolvedModel(reduced, objective[kept], constant, fixed)
+
+
+def _workspace_root():
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm'
+    return None
+
+
+class Solver(object):
+    FORMATS = ('lp', 'mps', 'mps.gz')
+    MAX_INCUMBENTS = 32
+    pipe = False
+    presolve = False
+    time_limit = None
+    gap = None
+    status = None
+    _names = None
+
+    def _check_format(self, format):
+        if format not in Solver.FORMATS:
+            raise ValueError('unknown model file format: {0}'.format(format))
+        return format
+
+    @contextlib.contextmanager
+    def _open_model_file(self, raw):
+        if self.format.endswith('.gz'):
+            import gzip
+            with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) as compressed:
+                with io.TextIOWrapper(compressed, encoding='utf-8') as f:
+                    yield f
+        else:
+            with io.TextIOWrapper(raw, encoding='utf-8') as f:
+                yield f
+
+    def _build_model(self, objective, constraints):
+        if isinstance(constraints, Model):
+            model = constraints
+        else:
+            model = Model()
+            model.add_constraints(constraints)
+        objective, constant = model.objective_vector(objective)
+        self.model = model
+        self.variables = model.variables
         # if not self.quiet:
-        print('variables:{0}, constraints: {1}'.format(len(self.variables), len(constraints)),
+        print('variables:{0}, constraints: {1}'.format(model.num_columns, model.num_rows),
                file=sys.stderr)
-        with open(self.filename, 'w') as f:
-            print('min' if is_minimize else 'max', file=f)
-            print(' + \n'.join(
-                '  {0}'.format(str(objective)).split(' + ')),
-                file=f)
-            print('subject to', file=f)
-            for i, c in enumerate(constraints):
-                print('  c{0}: {1}'.format(i, c), file=f)
-            if any(isinstance(v, IntegerVariable) for v in self.variables):
-                print('general', file=f)
-                for v in self.variables:
-                    if isinstance(v, IntegerVariable):
-                        print('  {0}'.format(str(v)), file=f)
-            if any(isinstance(v, BinaryVariable) for v in self.variables):
-                print('binary', file=f)
-                for v in self.variables:
-                    if isinstance(v, BinaryVariable):
-                        print('  {0}'.format(str(v)), file=f)
-            print('end', file=f)
-
-    def minimize(self, objective, constraints):
-        self._export_to_mps(True, objective, constraints)
-        self._optimize()
-        return self._read_solution()
+        return model, objective, constant
+
+    def _prepare(self, is_minimize, built):
+        ## 解が無いときに，実行不能 ('infeasible') か制限で止まったのかを self.status で区別する
+        self.status = None
+        model, objective, constant = built
+        self.model = model
+        self.variables = model.variables
+        self.presolved = None
+        if not self.presolve:
+            return model, objective, constant
+        self.presolved = presolve(model, objective, constant, is_minimize)
+        if self.presolved.infeasible:
+            self.status = 'infeasible'
+            if not self.quiet:
+                print('presolve: infeasible', file=sys.stderr)
+            return None
+        reduced = self.presolved.model
+        self.variables = reduced.variables
+        if not self.quiet:
+            print('presolve: variables:{0}, constraints: {1}'.format(
+                reduced.num_columns, reduced.num_rows), file=sys.stderr)
+        return reduced, self.presolved.objective, self.presolved.constant
+
+    def _postsolve(self, solution):
+        if solution is not None and self.presolved is not None:
+            self.presolved.postsolve(solution)
+        return solution
 
-    def maximize(self, objective, constraints):
-        self._export_to_mps(False, objective, constraints)
-        self._optimize()
-        return self._read_solution()
+    def _read_result(self, filename):
+        # ソルバが最後に書いた解を読む (解が無ければ解のファイルの状態だけを self.status に残す)
+        result = self._read_solution(filename)
+        self.status = result.status if result is not None else self._read_status(filename)
+        return self._postsolve(result)
+
+    def _read_status(self, filename):
+        return None
+
+    def _export(self, filename, is_minimize, objective, constraints):
+        model, objective, constant = self._build_model(objective, constraints)
+        with open(filename, 'wb') as raw:
+            self._write_model(raw, is_minimize, objective, constant, model)
+
+    def _write_model(self, raw, is_minimize, objective, constant, model):
+        with self._open_model_file(raw) as f:
+            if self.format == 'lp':
+                self._write_lp(f, is_minimize, objective, constant, model)
+            else:
+                self._write_mps(f, is_minimize, objective, constant, model)
+
+    def _stream_to_fifo(self, filename, process, is_minimize, objective, constant, model):
+        while True:
+            try:
+                fd = os.open(filename, os.O_WRONLY | os.O_NONBLOCK)
+                break
+            except OSError as e:
+                if e.errno != errno.ENXIO:
+                    raise
+                if process.poll() is not None:
+                    return
+                time.sleep(0.01)
+        os.set_blocking(fd, True)
+        try:
+            with os.fdopen(fd, 'wb') as raw:
+                self._write_model(raw, is_minimize, objective, constant, model)
+        except BrokenPipeError:
+            pass
+
+    @contextlib.contextmanager
+    def _workspace(self):
+        if self.filename is not None:
+            for path in (self.filename, '{0}.sol'.format(self.filename)):
+                if os.path.lexists(path):
+                    os.remove(path)
+            yield self.filename
+            return
+        directory = tempfile.mkdtemp(prefix='milp-', dir=_workspace_root())
+        try:
+            yield os.path.join(directory, 'model.{0}'.format(self.format))
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    @contextlib.contextmanager
+    def _fifo(self):
+        # モデルを流すパイプは filename を指定していても非公開の一時ディレクトリに作る
+        ## ソルバが読み終えれば不要なので，書き込みに失敗しても必ず消す
+        directory = tempfile.mkdtemp(prefix='milp-', dir=_workspace_root())
+        fifo = os.path.join(directory, 'model.{0}'.format(self.format))
+        try:
+            os.mkfifo(fifo, 0o600)
+            yield fifo
+        finally:
+            if os.path.lexists(fifo):
+                os.unlink(fifo)
+            os.rmdir(directory)
+
+    def _start_values(self, model, start):
+        values = []
+        for v in model.variables:
+            value = start.get(v)
+            if value is not None:
+                values.append((v, float(value)))
+        return values
+
+    def _variable_names(self):
+        # 解のファイルの変数名からモデルの変数を引く表 (暫定解を何度読んでも1度だけ作る)
+        if self._names is None or self._names[0] is not self.variables or \
+           len(self._names[1]) != len(self.variables):
+            self._names = (self.variables, dict((v.name, v) for v in self.variables))
+        return self._names[1]
+
+    def _improves(self, solution, best, is_minimize):
+        if solution is None or solution.objective_value is None:
+            return False
+        if best is None:
+            return True
+        if is_minimize:
+            return solution.objective_value < best.objective_value - 1e-9
+        return solution.objective_value > best.objective_value + 1e-9
+
+    def _solve(self, is_minimize, objective, constraints, start=None, callback=None):
+        return self._solve_model(is_minimize, self._build_model(objective, constraints), start, callback)
+
+    def _solve_model(self, is_minimize, built, start=None, callback=None):
+        # _build_model で作った (モデル, 目的関数の係数, 定数項) を解く
+        prepared = self._prepare(is_minimize, built)
+        if prepared is None:
+            return None
+        model, objective, constant = prepared
+        incumbents = self.MAX_INCUMBENTS if callback is not None else 0
+        with self._workspace() as filename:
+            solution = '{0}.sol'.format(filename)
+            start_file = None
+            if start is not None:
+                start_file = '{0}.start{1}'.format(filename, self.START_SUFFIX)
+                self._write_start(start_file, self._start_values(model, start))
+            if self.pipe:
+                with self._fifo() as fifo:
+                    process = self._start(fifo, solution, start_file, incumbents)
+                    try:
+                        self._stream_to_fifo(fifo, process, is_minimize, objective, constant, model)
+                    except BaseException:
+                        process.kill()
+                        process.wait()
+                        raise
+            else:
+                with open(filename, 'wb') as raw:
+                    self._write_model(raw, is_minimize, objective, constant, model)
+                process = self._start(filename, solution, start_file, incumbents)
+            if callback is None:
+                process.wait()
+                return self._read_result(solution)
+            best = None
+            k = 1
+            while True:
+                finished = process.poll() is not None
+                while k <= incumbents and os.path.exists('{0}.{1}.done'.format(solution, k)):
+                    incumbent = self._read_solution('{0}.{1}'.format(solution, k))
+                    if self._improves(incumbent, best, is_minimize):
+                        best = self._postsolve(incumbent)
+                        callback(best)
+                    k += 1
+                if finished:
+                    break
+                time.sleep(0.05)
+            result = self._read_result(solution)
+            if self._improves(result, best, is_minimize):
+                callback(result)
+            return result
+
+    def _start(self, filename, solution, start=None, incumbents=0):
+        output = subprocess.DEVNULL if self.quiet else None
+        return subprocess.Popen(self._command(filename, solution, start, incumbents),
+                                stdout=output, stderr=output)
+
+    def _write_lp(self, f, is_minimize, objective, constant, model):
+        names = [v.name for v in model.variables]
+        write = f.write
+
+        def write_terms(cols, coeffs):
+            n = 0
+            for col, coeff in zip(cols, coeffs):
+                write(' + ' if coeff >= 0 else ' - ')
+                if abs(abs(coeff) - 1) > Model.EPS:
+                    write(repr(abs(coeff)))
+                    write(' ')
+                write(names[col])
+                n += 1
+                if n % 8 == 0:
+                    write('\n ')
+            if n == 0 and names:
+                write(' 0 {0}'.format(names[0]))
+
+        write('min\n' if is_minimize else 'max\n')
+        write(' obj:')
+        nonzero = np.flatnonzero(np.abs(objective) > Model.EPS)
+        write_terms(nonzero.tolist(), objective[nonzero].tolist())
+        if abs(constant) > Model.EPS:
+            write(' + ' if constant >= 0 else ' - ')
+            write(repr(float(abs(constant))))
+        write('\nsubject to\n')
+        indptr, indices, data = model.csr()
+        indptr = indptr.tolist()
+        indices = indices.tolist()
+        data = data.tolist()
+        senses = [LP_SENSES[sense] for sense in model.senses.tolist()]
+        for i, rhs in enumerate(model.rhs.tolist()):
+            write(' c{0}:'.format(i))
+            write_terms(indices[indptr[i]:indptr[i + 1]], data[indptr[i]:indptr[i + 1]])
+            write(' {0} {1!r}\n'.format(senses[i], rhs + 0.0))
+        if model._bounds:
+            write('bounds\n')
+            for col, (lo, up) in sorted(model._bounds.items()):
+                if np.isfinite(up):
+                    write(' {0!r} <= {1} <= {2!r}\n'.format(float(lo), names[col], float(up)))
+                else:
+                    write(' {0} >= {1!r}\n'.format(names[col], float(lo)))
+        self._write_lp_types(f, model, IntegerVariable, 'general')
+        self._write_lp_types(f, model, BinaryVariable, 'binary')
+        write('end\n')
+
+    def _write_lp_types(self, f, model, variable_type, section):
+        names = [v.name for v in model.variables if isinstance(v, variable_type)]
+        if names:
+            f.write('{0}\n'.format(section))
+            for name in names:
+                f.write(' {0}\n'.format(name))
+
+    def _write_mps(self, f, is_minimize, objective, constant, model):
+        write = f.write
+
+        write('NAME model\n')
+        write('OBJSENSE\n    {0}\n'.format('MIN' if is_minimize else 'MAX'))
+        write('ROWS\n N obj\n')
+        for i, sense in enumerate(model.senses.tolist()):
+            write(' {0} c{1}\n'.format(sense.decode(), i))
+
+        write('COLUMNS\n')
+        indptr, indices, data = model.csc()
+        indptr = indptr.tolist()
+        indices = indices.tolist()
+        data = data.tolist()
+        objective = objective.tolist()
+        integer = False
+        for col, v in enumerate(model.variables):
+            is_integer = isinstance(v, (IntegerVariable, BinaryVariable))
+            if is_integer != integer:
+                write("    MARKER 'MARKER' '{0}'\n".format('INTORG' if is_integer else 'INTEND'))
+                integer = is_integer
+            name = v.name
+            if abs(objective[col]) > Model.EPS or indptr[col] == indptr[col + 1]:
+                write('    {0} obj {1!r}\n'.format(name, objective[col]))
+            for k in range(indptr[col], indptr[col + 1]):
+                write('    {0} c{1} {2!r}\n'.format(name, indices[k], data[k]))
+        if integer:
+            write("    MARKER 'MARKER' 'INTEND'\n")
+
+        write('RHS\n')
+        if abs(constant) > Model.EPS:
+            write('    RHS obj {0!r}\n'.format(-float(constant)))
+        for i, rhs in enumerate(model.rhs.tolist()):
+            if rhs:
+                write('    RHS c{0} {1!r}\n'.format(i, rhs))
+
+        write('BOUNDS\n')
+        for col, v in enumerate(model.variables):
+            if col in model._bounds:
+                lo, up = model._bounds[col]
+                write(' LO BND {0} {1!r}\n'.format(v.name, float(lo)))
+                if np.isfinite(up):
+                    write(' UP BND {0} {1!r}\n'.format(v.name, float(up)))
+                else:
+                    write(' PL BND {0}\n'.format(v.name))
+            elif isinstance(v, BinaryVariable):
+                write(' BV BND {0}\n'.format(v.name))
+            elif isinstance(v, IntegerVariable):
+                write(' PL BND {0}\n'.format(v.name))
+        write('ENDATA\n')
+
+    def minimize(self, objective, constraints, start=None, callback=None):
+        return self._solve(True, objective, constraints, start, callback)
+
+    def maximize(self, objective, constraints, start=None, callback=None):
+        return self._solve(False, objective, constraints, start, callback)
+
+    def _iterate(self, is_minimize, objective, constraints, start):
+        import queue
+        import threading
+        results = queue.Queue()
+        finished = object()
+        errors = []
+
+        def run():
+            try:
+                self._solve(is_minimize, objective, constraints, start, results.put)
+            except BaseException as e:
+                errors.append(e)
+            finally:
+                results.put(finished)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        while True:
+            solution = results.get()
+            if solution is finished:
+                break
+            yield solution
+        thread.join()
+        if errors:
+            raise errors[0]
+
+    def iter_minimize(self, objective, constraints, start=None):
+        return self._iterate(True, objective, constraints, start)
+
+    def iter_maximize(self, objective, constraints, start=None):
+        return self._iterate(False, objective, constraints, start)
 
 
 class CPLEX(Solver):
-    def __init__(self, filename='cplex-input.lp', quiet=False):
+    def __init__(self, filename=None, quiet=False, format='lp', path='cplex', presolve=True,
+                 time_limit=None, gap=None):
         self.filename = filename
+        self.format = self._check_format(format)
         self.quiet = quiet
-
-    def _optimize(self):
-        subprocess.call('rm -f {0}.sol'.format(self.filename), shell=True)
-        commands = 'cplex -c' \
-                   ' "read {0}"' \
-                   ' "optimize"' \
-                   ' "write {0}.sol"' \
-                   ' "q"'.format(self.filename)
-        if self.quiet:
-            commands += ' >&/dev/null'
-        os.system(commands)
-
-    def _read_solution(self):
+        self.path = path
+        self.presolve = presolve
+        self.time_limit = time_limit
+        self.gap = gap
+
+    START_SUFFIX = '.mst'
+
+    def _write_start(self, filename, values):
+        from xml.sax.saxutils import quoteattr
+        with open(filename, 'w', encoding='utf-8') as f:
+            print('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>', file=f)
+            print('<CPLEXSolutions version="1.2">', file=f)
+            print(' <CPLEXSolution version="1.2">', file=f)
+            print('  <header problemName="model" solutionName="m1" solutionIndex="0"/>', file=f)
+            print('  <variables>', file=f)
+            for v, value in values:
+                print('   <variable name={0} value="{1!r}"/>'.format(quoteattr(v.name), value),
+                      file=f)
+            print('  </variables>', file=f)
+            print(' </CPLEXSolution>', file=f)
+            print('</CPLEXSolutions>', file=f)
+
+    def _command(self, filename, solution, start=None, incumbents=0):
+        limits = []
+        if self.time_limit is not None:
+            limits.append('set timelimit {0}'.format(self.time_limit))
+        if self.gap is not None:
+            limits.append('set mip tolerances mipgap {0}'.format(self.gap))
+        return [self.path, '-c', 'read {0}'.format(filename)] + \
+            (['read {0}'.format(start)] if start else []) + limits + [
+                'optimize',
+                'write {0}'.format(solution),
+                'q']
+
+    def _read_solution(self, filename):
         solution = Solution()
-
-        variable_dict = {}
-        for v in self.variables:
-            variable_dict[str(v)] = v
-            solution[v] = 0.0
-
+        names = self._variable_names()
         try:
             import xml.etree.ElementTree as ET
-            root = ET.parse('{0}.sol'.format(self.filename)).getroot()
-            solution.objective_value = float(root.find('header').get('objectiveValue'))
-            for v in root.findall('variables/variable'):
-                if v.get('name') in variable_dict:
-                    value = float(v.get('value'))
-                    if abs(value) < 1e-7:
-                        value = 0
-                    solution[variable_dict[v.get('name')]] = value
+            for _, element in ET.iterparse(filename):
+                if element.tag == 'variable':
+                    v = names.get(element.get('name'))
+                    value = float(element.get('value'))
+                    if v is not None and abs(value) >= 1e-7:
+                        solution[v] = value
+                elif element.tag == 'header':
+                    self._read_header(solution, element)
+                else:
+                    continue
+                element.clear()
         except:
             return None
+        if solution.objective_value is None:
+            return None
         return solution
 
+    def _read_header(self, solution, header):
+        solution.objective_value = float(header.get('objectiveValue'))
+        ## 101: integer optimal, 102: integer optimal, tolerance (相対誤差の許容内で最適)
+        if header.get('solutionStatusValue') in ('101', '102'):
+            solution.status = 'optimal'
+            solution.gap = 0.0
+        else:
+            solution.status = header.get('solutionStatusString')
+        if header.get('MIPRelativeGap') is not None:
+            solution.gap = float(header.get('MIPRelativeGap'))
+        for key, attribute in (('nodes', 'MIPNodes'), ('lp_iterations', 'MIPIterations')):
+            if header.get(attribute) is not None:
+                solution.statistics[key] = int(header.get(attribute))
+
 
 class SCIP(Solver):
-    def __init__(self, filename='scip-input.lp', quiet=False, path='scip'):
+    def __init__(self, filename=None, quiet=False, path='scip', format='lp', pipe=False,
+                 settings=(), presolve=True, time_limit=None, gap=None):
         self.filename = filename
+        self.format = self._check_format(format)
         self.quiet = quiet
         self.path = path
+        self.pipe = pipe
+        self.settings = list(settings)
+        self.presolve = presolve
+        self.time_limit = time_limit
+        self.gap = gap
+
+    START_SUFFIX = '.sol'
+
+    def _write_start(self, filename, values):
+        with open(filename, 'w', encoding='utf-8') as f:
+            for v, value in values:
+                print('{0} {1!r}'.format(v.name, value), file=f)
+
+    def _command(self, filename, solution, start=None, incumbents=0):
+        commands = ['read {0}'.format(filename)] + \
+            (['read {0}'.format(start)] if start else []) + self.settings
+        if self.time_limit is not None:
+            commands.append('set limits time {0}'.format(self.time_limit))
+        if self.gap is not None:
+            commands.append('set limits gap {0}'.format(self.gap))
+        for k in range(1, incumbents + 1):
+            commands += ['set limits bestsol {0}'.format(k),
+                         'optimize',
+                         'write solution {0}.{1}'.format(solution, k),
+                         'set diffsave {0}.{1}.done'.format(solution, k)]
+        if incumbents:
+            commands.append('set limits bestsol -1')
+        commands += [
+            'optimize',
+            'write solution {0}'.format(solution),
+            'write statistics {0}.stats'.format(solution),
+            'q']
+        arguments = [self.path] + (['-q'] if self.quiet else [])
+        for command in commands:
+            arguments += ['-c', command]
+        return arguments
+
+    def _read_solution(self, filename):
+        solution = Solution()
+        if not os.path.exists(filename):
+            return None
+        names = self._variable_names()
+        with open(filename) as f:
+            line = f.readline().strip()
+            if not line.startswith('solution status:'):
+                return None
+            status = line.split(':', 1)[1].strip()
+            line = f.readline().strip()
+            if not line.startswith('objective value:'):
+                return None
+            solution.objective_value = float(line.split()[-1])
+            for line in f:
+                fields = line.split(None, 2)
+                if len(fields) < 2:
+                    continue
+                v = names.get(fields[0])
+                if v is not None:
+                    solution[v] = float(fields[1])
+        solution.statistics = self._read_statistics('{0}.stats'.format(filename))
+        if status == 'optimal solution found':
+            solution.status = 'optimal'
+            solution.gap = 0.0
+        elif status == 'solution improvement limit reached':
+            solution.status = 'feasible'
+        else:
+            solution.status = status
+            solution.gap = solution.statistics.get('gap')
+        return solution
 
-    def _optimize(self):
-        subprocess.call('rm -f {0}.sol'.format(self.filename), shell=True)
-        commands = '{2} {1}' \
-                   ' -c "read {0}"' \
-                   ' -c "optimize"' \
-                   ' -c "write solution {0}.sol"' \
-                   ' -c "q"'.format(self.filename, '-q' if self.quiet else '', self.path)
-        # subprocess.call(commands, shell=True)
-        os.system(commands)
+    def _read_status(self, filename):
+        if not os.path.exists(filename):
+            return None
+        with open(filename) as f:
+            line = f.readline().strip()
+        if not line.startswith('solution status:'):
+            return None
+        ## 'infeasible', 'time limit reached' など
+        return line.split(':', 1)[1].strip()
 
-    def _read_solution(self):
+    LP_STATISTICS = ('primal LP', 'dual LP', 'lex dual LP', 'barrier LP')
+
+    def _read_statistics(self, filename):
+        statistics = {}
+        if not os.path.exists(filename):
+            return statistics
+        section = None
+        with open(filename) as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                values = value.split()
+                if not line.startswith(' '):
+                    section = key.strip()
+                    if section == 'Total Time' and values:
+                        statistics['time'] = float(values[0])
+                    continue
+                key = key.strip()
+                if not values:
+                    continue
+                if section == 'B&B Tree' and key in ('nodes', 'nodes (total)'):
+                    statistics['nodes'] = int(values[0])
+                elif section == 'LP' and key in self.LP_STATISTICS and len(values) > 2 and values[2] != '-':
+                    statistics['lp_iterations'] = statistics.get('lp_iterations', 0) + int(values[2])
+                elif section == 'Solution' and key == 'Gap':
+                    statistics['gap'] = float('inf') if values[0] == 'infinite' else float(values[0]) / 100.0
+        return statistics
+
+
+class PortfolioSolver(Solver):
+    def __init__(self, solvers, filename=None, quiet=False, format='lp', presolve=True,
+                 time_limit=None, gap=None):
+        self.solvers = solvers
+        self.filename = filename
+        self.format = self._check_format(format)
+        self.quiet = quiet
+        self.presolve = presolve
+        self.time_limit = time_limit
+        self.gap = gap
+        for solver in solvers:
+            if time_limit is not None:
+                solver.time_limit = time_limit
+            if gap is not None:
+                solver.gap = gap
+
+    def _solve_model(self, is_minimize, built, start=None, callback=None):
+        self.winner = None
+        prepared = self._prepare(is_minimize, built)
+        if prepared is None:
+            return None
+        model, objective, constant = prepared
+        with self._workspace() as filename:
+            with open(filename, 'wb') as raw:
+                self._write_model(raw, is_minimize, objective, constant, model)
+            running = {}
+            for i, solver in enumerate(self.solvers):
+                solver.variables = model.variables
+                solution = '{0}.{1}.sol'.format(filename, i)
+                start_file = None
+                if start is not None:
+                    start_file = '{0}.{1}.start{2}'.format(filename, i, solver.START_SUFFIX)
+                    solver._write_start(start_file, self._start_values(model, start))
+                running[i] = (solver._start(filename, solution, start_file), solution)
+            best = None
+            statuses = []
+            try:
+                while running:
+                    for i, (process, solution) in list(running.items()):
+                        if process.poll() is None:
+                            continue
+                        del running[i]
+                        result = self.solvers[i]._read_solution(solution)
+                        statuses.append(result.status if result is not None
+                                        else self.solvers[i]._read_status(solution))
+                        if not self._improves(result, best, is_minimize) and \
+                           (result is None or result.status != 'optimal'):
+                            continue
+                        best = self._postsolve(result)
+                        self.winner = self.solvers[i]
+                        if callback is not None:
+                            callback(best)
+                        if result.status == 'optimal':
+                            if not self.quiet:
+                                print('portfolio: solver {0} finished first'.format(i),
+                                      file=sys.stderr)
+                            self.status = 'optimal'
+                            return best
+                    time.sleep(0.05)
+            finally:
+                for process, _ in running.values():
+                    process.kill()
+                    process.wait()
+        if best is not None:
+            self.status = best.status
+        elif 'infeasible' in statuses:
+            self.status = 'infeasible'
+        return best
+
+
+def scip_portfolio(workers, path='scip', format='lp', quiet=True, time_limit=None, gap=None):
+    emphases = [[], ['set emphasis feasibility'], ['set emphasis optimality']]
+    solvers = []
+    if workers > 1 and shutil.which('cplex'):
+        solvers.append(CPLEX(quiet=quiet))
+    for i in range(workers - len(solvers)):
+        settings = emphases[i % len(emphases)] + \
+            ['set randomization randomseedshift {0}'.format(i // len(emphases))]
+        solvers.append(SCIP(quiet=quiet, path=path, settings=settings))
+    return PortfolioSolver(solvers, format=format, time_limit=time_limit, gap=gap)
+
+
+class SolutionCache(object):
+    def __init__(self, directory, max_size=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, '{0}.json'.format(key))
+
+    def get(self, key, variables):
+        import json
+        path = self._path(key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        os.utime(path)
+        self.hits += 1
+        values = entry['values']
         solution = Solution()
+        names = dict((v.name, v) for v in variables)
+        for name, value in values.items():
+            v = names.get(name)
+            if v is not None:
+                solution[v] = value
+        solution.objective_value = entry['objective_value']
+        solution.status = 'optimal'
+        solution.gap = 0.0
+        return solution
 
-        variable_dict = {}
-        for v in self.variables:
-            variable_dict[str(v)] = v
-            solution[v] = 0.0
+    def put(self, key, solution, variables):
+        import json
+        values = dict((v.name, value) for v, value in solution.items())
+        path = self._path(key)
+        temporary = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump({'objective_value': solution.objective_value, 'values': values}, f)
+        os.replace(temporary, path)
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
+
+
+class CachedSolver(Solver):
+    def __init__(self, solver, cache, quiet=False):
+        self.solver = solver
+        self.cache = cache
+        self.quiet = quiet
+
+    def _solve_model(self, is_minimize, built, start=None, callback=None):
+        ## 作ったモデルをそのまま中のソルバに渡す (モデルを2度作らない)
+        model, vector, constant = built
+        key = model.fingerprint(vector, constant, is_minimize)
+        solution = self.cache.get(key, model.variables)
+        hit = solution is not None
+        if hit:
+            if callback is not None:
+                callback(solution)
+        else:
+            solution = self.solver._solve_model(is_minimize, built, start, callback)
+            if solution is not None and solution.status == 'optimal':
+                self.cache.put(key, solution, model.variables)
+        self.status = solution.status if solution is not None else self.solver.status
+        if not self.quiet:
+            print('cache: {0} (hits: {1}, misses: {2})'.format(
+                'hit' if hit else 'miss', self.cache.hits, self.cache.misses), file=sys.stderr)
+        return solution
 
-        if not os.path.exists(self.filename):
+
+class _Simplex(object):
+    # 上下限付きの改訂単体法 (制約行列は疎なまま持つ)
+    ## 基底の逆行列は，基底のうちスラック変数・人工変数 (単位列) を除いた部分の小さな密行列の逆行列と，
+    ## その後のピボットの eta ベクトルで表し，REFACTOR_INTERVAL 回ごとに作り直す
+    PIVOT_TOL = 1e-9
+    FEASIBILITY_TOL = 1e-7
+    OPTIMALITY_TOL = 1e-9
+    REFACTOR_INTERVAL = 100
+
+    def __init__(self, model, cost, iteration_limit=100000):
+        self.m, self.n = model.num_rows, model.num_columns
+        self.rows, self.cols, self.data = model.coo()
+        self.indptr, self.indices, self.values = model.csc()
+        senses = model.senses
+        self.b = model.rhs
+        self.cost = cost
+        self.slack_lower = np.where(senses == b'G', -np.inf, 0.0)
+        self.slack_upper = np.where(senses == b'L', np.inf, 0.0)
+        self.iteration_limit = iteration_limit
+        self.iterations = 0
+        self.deadline = None
+        self.basis = None
+
+    def multiply(self, x):
+        return np.bincount(self.rows, weights=self.data * x[self.cols], minlength=self.m)
+
+    def solve(self, lower, upper):
+        try:
+            if self.basis is not None:
+                self.limit = self.iterations + self.iteration_limit
+                status = self._warm_start(lower, upper)
+                if status is not None:
+                    return status
+            self.limit = self.iterations + self.iteration_limit
+            return self._cold_start(lower, upper)
+        except np.linalg.LinAlgError:
+            self.basis = None
+            return 'numerical error'
+
+    def _cold_start(self, lower, upper):
+        m, n = self.m, self.n
+        x = np.where(np.isfinite(lower), lower, np.where(np.isfinite(upper), upper, 0.0))
+        s = self.b - self.multiply(x)
+        clipped = np.clip(s, self.slack_lower, self.slack_upper)
+        residual = s - clipped
+        self.art_rows = np.flatnonzero(np.abs(residual) > _Simplex.FEASIBILITY_TOL)
+        self.art_signs = np.where(residual[self.art_rows] >= 0, 1.0, -1.0)
+        k = len(self.art_rows)
+
+        self.basis = n + np.arange(m)
+        self.basis[self.art_rows] = n + m + np.arange(k)
+        self.is_basic = np.zeros(n + m + k, dtype=bool)
+        self.is_basic[self.basis] = True
+        self.lower = np.concatenate([lower, self.slack_lower, np.zeros(k)])
+        self.upper = np.concatenate([upper, self.slack_upper, np.full(k, np.inf)])
+        self.x = np.concatenate([x, clipped, np.abs(residual[self.art_rows])])
+        self.x[n:n + m] = np.where(self.is_basic[n:n + m], s, self.x[n:n + m])
+        self.at_upper = np.zeros(n + m + k, dtype=bool)
+        self.at_upper[:n] = ~np.isfinite(lower) & np.isfinite(upper)
+        self.at_upper[n:n + m] = ~self.is_basic[n:n + m] & (s > self.slack_upper)
+        self._refactor()
+
+        if k:
+            phase1 = np.zeros(n + m + k)
+            phase1[n + m:] = 1.0
+            status = self._primal(phase1)
+            if status != 'optimal':
+                self.basis = None
+                return status
+            if self.x[n + m:].sum() > _Simplex.FEASIBILITY_TOL * max(1.0, np.abs(self.b).max()):
+                self.basis = None
+                return 'infeasible'
+            self.upper[n + m:] = 0.0
+            self.x[n + m:] = 0.0
+            self.at_upper[n + m:] = False
+        self.full_cost = np.concatenate([self.cost, np.zeros(m + k)])
+        return self._primal(self.full_cost)
+
+    def _warm_start(self, lower, upper):
+        n = self.n
+        d = self._reduced_costs(self.full_cost)
+        nonbasic = ~self.is_basic[:n]
+        want_lower = nonbasic & (d[:n] > _Simplex.OPTIMALITY_TOL)
+        want_upper = nonbasic & (d[:n] < -_Simplex.OPTIMALITY_TOL)
+        if (want_lower & ~np.isfinite(lower)).any() or (want_upper & ~np.isfinite(upper)).any():
             return None
-        with open('{0}.sol'.format(self.filename)) as f:
-            line = f.readline().strip()
-            if line != 'solution status: optimal solution found':
-                return None
-            solution.objective_value = float(f.readline().strip().split()[-1])
-            for line in f:
-                line = line.strip().split()
-                s, v = line[0], float(line[1])
-                solution[variable_dict[s]] = v
+        self.lower[:n] = lower
+        self.upper[:n] = upper
+        at_upper = want_upper | (nonbasic & ~want_lower & ~np.isfinite(lower))
+        self.at_upper[:n] = at_upper
+        self.x[:n] = np.where(nonbasic, np.where(at_upper, upper, lower), self.x[:n])
+        self._update_basic_values()
+        status = self._dual(d)
+        if status == 'optimal':
+            return self._primal(self.full_cost)
+        elif status in ('infeasible', 'time limit'):
+            return status
+        return None
+
+    def _column(self, q):
+        # 列 q (構造変数・スラック変数・人工変数) を密なベクトルにする
+        n, m = self.n, self.m
+        a = np.zeros(m)
+        if q < n:
+            begin, end = self.indptr[q], self.indptr[q + 1]
+            a[self.indices[begin:end]] = self.values[begin:end]
+        elif q < n + m:
+            a[q - n] = 1.0
+        else:
+            a[self.art_rows[q - n - m]] = self.art_signs[q - n - m]
+        return a
+
+    def _row(self, y):
+        # y^T [A I E] (E は人工変数の列)
+        return np.concatenate([np.bincount(self.cols, weights=self.data * y[self.rows], minlength=self.n),
+                               y, self.art_signs * y[self.art_rows]])
+
+    def _refactor(self):
+        n, m = self.n, self.m
+        basis = self.basis
+        unit = basis >= n
+        self.unit_positions = np.flatnonzero(unit)
+        units = basis[unit]
+        self.unit_rows = units - n
+        self.unit_signs = np.ones(len(units))
+        artificial = units >= n + m
+        self.unit_rows[artificial] = self.art_rows[units[artificial] - n - m]
+        self.unit_signs[artificial] = self.art_signs[units[artificial] - n - m]
+        ## 残りの列と，単位列で覆われない行からなる正方行列を逆行列にする
+        self.kernel_positions = np.flatnonzero(~unit)
+        covered = np.zeros(m, dtype=bool)
+        covered[self.unit_rows] = True
+        self.kernel_rows = np.flatnonzero(~covered)
+        k = len(self.kernel_positions)
+        column_index = np.full(n, -1, dtype=np.int64)
+        column_index[basis[~unit]] = np.arange(k)
+        row_index = np.full(m, -1, dtype=np.int64)
+        row_index[self.kernel_rows] = np.arange(k)
+        entries = column_index[self.cols] >= 0
+        rows, cols, data = self.rows[entries], column_index[self.cols[entries]], self.data[entries]
+        inside = row_index[rows] >= 0
+        kernel = np.zeros((k, k))
+        np.add.at(kernel, (row_index[rows[inside]], cols[inside]), data[inside])
+        self.inverse = np.linalg.inv(kernel)
+        self.outside = (rows[~inside], cols[~inside], data[~inside])
+        self.etas = []
+
+    def _ftran(self, a):
+        # B^{-1} a (基底の位置ごとの値)
+        x = np.empty(self.m)
+        kernel = self.inverse.dot(a[self.kernel_rows])
+        x[self.kernel_positions] = kernel
+        rows, cols, data = self.outside
+        rest = a - np.bincount(rows, weights=data * kernel[cols], minlength=self.m)
+        x[self.unit_positions] = rest[self.unit_rows] * self.unit_signs
+        for r, index, alpha, pivot in self.etas:
+            x[r] /= pivot
+            x[index] -= alpha * x[r]
+        return x
+
+    def _btran(self, c):
+        # B^{-T} c (行ごとの値)
+        c = c.copy()
+        for r, index, alpha, pivot in reversed(self.etas):
+            c[r] = (c[r] - alpha.dot(c[index])) / pivot
+        y = np.zeros(self.m)
+        y[self.unit_rows] = c[self.unit_positions] * self.unit_signs
+        rows, cols, data = self.outside
+        kernel = c[self.kernel_positions] - np.bincount(cols, weights=data * y[rows],
+                                                        minlength=len(self.kernel_positions))
+        y[self.kernel_rows] = self.inverse.T.dot(kernel)
+        return y
+
+    def _reduced_costs(self, cost):
+        d = cost - self._row(self._btran(cost[self.basis]))
+        d[self.basis] = 0.0
+        return d
+
+    def _update_basic_values(self):
+        m, n = self.m, self.n
+        x = np.where(self.is_basic, 0.0, self.x)
+        activity = self.multiply(x[:n]) + x[n:n + m]
+        activity[self.art_rows] += self.art_signs * x[n + m:]
+        self.x[self.basis] = self._ftran(self.b - activity)
+
+    def _tableau_row(self, r):
+        e = np.zeros(self.m)
+        e[r] = 1.0
+        return self._row(self._btran(e))
+
+    def _pivot(self, r, q, alpha, row, d):
+        # 位置 r の基底変数と q を入れ替える (alpha = B^{-1} a_q, row = 単体表の r 行目)
+        d -= d[q] / row[q] * row
+        d[q] = 0.0
+        index = np.flatnonzero(alpha)
+        index = index[index != r]
+        self.etas.append((r, index, alpha[index], alpha[r]))
+        self.is_basic[self.basis[r]] = False
+        self.is_basic[q] = True
+        self.basis[r] = q
+        self.iterations += 1
+
+    def _check_refactor(self, cost, d):
+        if len(self.etas) < _Simplex.REFACTOR_INTERVAL:
+            return d
+        self._refactor()
+        self._update_basic_values()
+        return self._reduced_costs(cost)
+
+    def _primal(self, cost):
+        x, lower, upper, at_upper = self.x, self.lower, self.upper, self.at_upper
+        d = self._reduced_costs(cost)
+        degenerate = 0
+        while True:
+            if self.iterations >= self.limit:
+                return 'iteration limit'
+            if self.deadline is not None and self.iterations % 32 == 0 and time.time() > self.deadline:
+                return 'time limit'
+            d = self._check_refactor(cost, d)
+            movable = ~self.is_basic & (lower < upper)
+            improving = movable & np.where(at_upper, d > _Simplex.OPTIMALITY_TOL,
+                                           d < -_Simplex.OPTIMALITY_TOL)
+            candidates = np.flatnonzero(improving)
+            if not len(candidates):
+                self.objective = self.cost.dot(x[:self.n])
+                return 'optimal'
+            if degenerate > 50:
+                q = candidates[0]
+            else:
+                q = candidates[np.argmax(np.abs(d[candidates]))]
+            direction = -1.0 if at_upper[q] else 1.0
+            column = self._ftran(self._column(q))
+            alpha = column * direction
+            basis = self.basis
+            xB = x[basis]
+            ratios = np.full(self.m, np.inf)
+            pos = alpha > _Simplex.PIVOT_TOL
+            neg = alpha < -_Simplex.PIVOT_TOL
+            ratios[pos] = (xB[pos] - lower[basis][pos]) / alpha[pos]
+            ratios[neg] = (upper[basis][neg] - xB[neg]) / -alpha[neg]
+            np.maximum(ratios, 0.0, out=ratios)
+            t = ratios.min() if self.m else np.inf
+            flip = upper[q] - lower[q]
+            if flip <= t:
+                if not np.isfinite(flip):
+                    return 'unbounded'
+                x[basis] = xB - flip * alpha
+                at_upper[q] = direction > 0
+                x[q] = upper[q] if at_upper[q] else lower[q]
+                self.iterations += 1
+                continue
+            ties = np.flatnonzero(ratios <= t + 1e-12)
+            if degenerate > 50:
+                r = ties[np.argmin(basis[ties])]
+            else:
+                r = ties[np.argmax(np.abs(alpha[ties]))]
+            x[basis] = xB - t * alpha
+            x[q] += direction * t
+            leaving = basis[r]
+            at_upper[leaving] = alpha[r] < 0
+            x[leaving] = upper[leaving] if at_upper[leaving] else lower[leaving]
+            self._pivot(r, q, column, self._tableau_row(r), d)
+            degenerate = degenerate + 1 if t <= 1e-12 else 0
+
+    def _dual(self, d):
+        x, lower, upper, at_upper = self.x, self.lower, self.upper, self.at_upper
+        while True:
+            if self.iterations >= self.limit:
+                return 'iteration limit'
+            if self.deadline is not None and self.iterations % 32 == 0 and time.time() > self.deadline:
+                return 'time limit'
+            d = self._check_refactor(self.full_cost, d)
+            basis = self.basis
+            xB = x[basis]
+            below = lower[basis] - xB
+            above = xB - upper[basis]
+            violation = np.maximum(below, above)
+            r = np.argmax(violation)
+            if violation[r] <= _Simplex.FEASIBILITY_TOL:
+                return 'optimal'
+            row = self._tableau_row(r)
+            movable = ~self.is_basic & (lower < upper)
+            increase = below[r] > above[r]
+            if increase:
+                target = lower[basis[r]]
+                eligible = np.where(at_upper, row > _Simplex.PIVOT_TOL, row < -_Simplex.PIVOT_TOL)
+            else:
+                target = upper[basis[r]]
+                eligible = np.where(at_upper, row < -_Simplex.PIVOT_TOL, row > _Simplex.PIVOT_TOL)
+            candidates = np.flatnonzero(movable & eligible)
+            if not len(candidates):
+                return 'infeasible'
+            ratios = np.abs(d[candidates]) / np.abs(row[candidates])
+            ties = candidates[ratios <= ratios.min() + 1e-12]
+            q = ties[np.argmax(np.abs(row[ties]))]
+            column = self._ftran(self._column(q))
+            delta = (xB[r] - target) / column[r]
+            x[basis] = xB - column * delta
+            x[q] += delta
+            leaving = basis[r]
+            x[leaving] = target
+            at_upper[leaving] = not increase
+            self._pivot(r, q, column, row, d)
+
+
+class BranchAndBound(Solver):
+    INTEGRALITY_TOL = 1e-6
+
+    def __init__(self, quiet=False, node_limit=100000, time_limit=None, presolve=True, gap=None):
+        self.quiet = quiet
+        self.node_limit = node_limit
+        self.time_limit = time_limit
+        self.presolve = presolve
+        self.gap = gap
+
+    def _solve_model(self, is_minimize, built, start=None, callback=None):
+        self.status = 'infeasible'
+        self.values = None
+        self.final_gap = None
+        self.nodes = 0
+        self.lp_iterations = 0
+        self.callback = callback
+        prepared = self._prepare(is_minimize, built)
+        if prepared is None:
+            return None
+        self.model, self.objective, self.constant = prepared
+        self.is_minimize = is_minimize
+        self.start = None
+        if start is not None:
+            self.start = np.array([float(start.get(v) or 0.0) for v in self.model.variables])
+        self._optimize()
+        return self._postsolve(self._read_solution())
+
+    def _report(self, values):
+        self.values = values
+        if self.callback is not None:
+            solution = self._postsolve(self._read_solution())
+            solution.status = 'feasible'
+            self.callback(solution)
+
+    def _is_feasible(self, lp, senses, b, x):
+        activity = lp.multiply(x)
+        tol = 1e-6 * (1.0 + np.abs(b))
+        return not (((senses == b'L') & (activity > b + tol)).any() or
+                    ((senses == b'G') & (activity < b - tol)).any() or
+                    ((senses == b'E') & (np.abs(activity - b) > tol)).any())
+
+    def _optimize(self):
+        import heapq
+        started = time.time()
+        model = self.model
+        n = model.num_columns
+        senses = model.senses
+        b = model.rhs
+        cost = self.objective if self.is_minimize else -self.objective
+        integer = np.array([isinstance(v, (IntegerVariable, BinaryVariable))
+                            for v in model.variables], dtype=bool)
+        root_lower, root_upper = model.bounds()
+        lp = _Simplex(model, cost)
+        if self.time_limit is not None:
+            lp.deadline = started + self.time_limit
+
+        self.status = 'infeasible'
+        self.values = None
+        incumbent = np.inf
+        complete = True
+        self.nodes = 0
+        counter = 0
+        heap = [(-np.inf, counter, -np.inf, ())]
+        start = self.start
+        if start is not None and np.all(start >= root_lower) and np.all(start <= root_upper) and \
+           np.all(np.where(integer, start == np.round(start), True)) and \
+           self._is_feasible(lp, senses, b, start):
+            incumbent = cost.dot(start)
+            self._report(start)
+            if not self.quiet:
+                print('start solution accepted (objective: {0})'.format(
+                    self.objective.dot(start) + self.constant), file=sys.stderr)
+        while heap:
+            if self.nodes >= self.node_limit:
+                self.status = 'node limit'
+                break
+            if self.time_limit is not None and time.time() - started > self.time_limit:
+                self.status = 'time limit'
+                break
+            if self.gap is not None and self.values is not None and \
+               self._relative_gap(incumbent, heap[0][0]) <= self.gap:
+                self.status = 'gap limit'
+                break
+            _, _, bound, changes = heapq.heappop(heap)
+            if bound >= incumbent - 1e-9:
+                continue
+            self.nodes += 1
+            lower = root_lower.copy()
+            upper = root_upper.copy()
+            for j, lo, up in changes:
+                lower[j] = lo
+                upper[j] = up
+            status = lp.solve(lower, upper)
+            if status == 'unbounded' and not changes:
+                self.status = status
+                return
+            if status == 'time limit':
+                self.status = status
+                heapq.heappush(heap, (bound, 0, bound, changes))
+                break
+            if status in ('iteration limit', 'numerical error'):
+                complete = False
+            if status != 'optimal' or lp.objective >= incumbent - 1e-9:
+                continue
+            x = lp.x[:n]
+            fractionality = np.where(integer, np.abs(x - np.round(x)), 0.0)
+            if fractionality.max(initial=0.0) <= BranchAndBound.INTEGRALITY_TOL:
+                values = np.where(integer, np.round(x), x)
+            else:
+                values = np.where(integer, np.round(x), x)
+                if not (np.all(values >= lower) and np.all(values <= upper) and
+                        self._is_feasible(lp, senses, b, values)):
+                    values = None
+            if values is not None:
+                objective = cost.dot(values)
+                if objective < incumbent:
+                    first = self.values is None
+                    incumbent = objective
+                    self._report(values)
+                    if first:
+                        heap = [(node[2],) + node[1:] for node in heap]
+                        heapq.heapify(heap)
+                if fractionality.max(initial=0.0) <= BranchAndBound.INTEGRALITY_TOL:
+                    continue
+            j = np.argmax(fractionality)
+            down = changes + ((j, lower[j], np.floor(x[j])),)
+            up = changes + ((j, np.ceil(x[j]), upper[j]),)
+            children = [down, up] if x[j] - np.floor(x[j]) > 0.5 else [up, down]
+            for child in children:
+                counter += 1
+                key = lp.objective if self.values is not None else -len(child)
+                heapq.heappush(heap, (key, -counter, lp.objective, child))
+        else:
+            if not complete:
+                self.status = 'iteration limit'
+            elif self.values is not None:
+                self.status = 'optimal'
+        self.lp_iterations = lp.iterations
+        if self.status == 'optimal':
+            self.final_gap = 0.0
+        elif self.values is not None and complete:
+            self.final_gap = self._relative_gap(incumbent, min([node[2] for node in heap] + [incumbent]))
+        if not self.quiet:
+            print('status: {0}, nodes: {1}, simplex iterations: {2}{3}'.format(
+                self.status, self.nodes, lp.iterations,
+                '' if self.final_gap is None else ', gap: {0:.4%}'.format(self.final_gap)), file=sys.stderr)
+
+    def _relative_gap(self, incumbent, bound):
+        objective_value = self.objective.dot(self.values) + self.constant
+        return (incumbent - bound) / max(abs(objective_value), 1e-10)
+
+    def _read_solution(self):
+        if self.values is None:
+            return None
+        solution = Solution()
+        for col in np.flatnonzero(self.values).tolist():
+            solution[self.variables[col]] = float(self.values[col])
+        objective_value = self.objective.dot(self.values) + self.constant
+        solution.objective_value = objective_value
+        solution.status = self.status
+        solution.gap = self.final_gap
+        solution.statistics = {'nodes': self.nodes, 'lp_iterations': self.lp_iterations}
         return solution
@@ -0,0 +1,86 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import time
+import contextlib
+import tracemalloc
+
+
+class Profiler(object):
+    # フェーズごとの経過時間と (tracemalloc で測った) Python のメモリ使用量のピーク
+    ## フェーズは入れ子にでき，time には内側のフェーズの時間を含めない
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.phases = {}
+        self.stack = []
+        self.patched = []
+
+    def start(self):
+        self.tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if self.tracing:
+            tracemalloc.start()
+        return self
+
+    def stop(self):
+        self.restore()
+        if self.tracing:
+            tracemalloc.stop()
+            self.tracing = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def _peak(self):
+        if not self.trace_memory or not tracemalloc.is_tracing():
+            return 0
+        return tracemalloc.get_traced_memory()[1]
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        if self.stack:
+            self.stack[-1]['peak'] = max(self.stack[-1]['peak'], self._peak())
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        frame = {'children': 0.0, 'peak': 0}
+        self.stack.append(frame)
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - begin
+            self.stack.pop()
+            peak = max(frame['peak'], self._peak())
+            entry = self.phases.setdefault(name, {'time': 0.0, 'calls': 0, 'peak_memory': 0})
+            entry['time'] += elapsed - frame['children']
+            entry['calls'] += 1
+            entry['peak_memory'] = max(entry['peak_memory'], peak)
+            if self.stack:
+                self.stack[-1]['children'] += elapsed
+                self.stack[-1]['peak'] = max(self.stack[-1]['peak'], peak)
+
+    def instrument(self, target, method, name):
+        # target.method の呼び出しを name のフェーズとして数える (restore で元に戻す)
+        if target is None or not hasattr(target, method):
+            return
+        original = getattr(target, method)
+
+        def profiled(*args, **kwargs):
+            with self.phase(name):
+                return original(*args, **kwargs)
+        setattr(target, method, profiled)
+        self.patched.append((target, method))
+
+    def instrument_solver(self, solver, export='export', read='read_solution'):
+        # ソルバ (と CachedSolver・PortfolioSolver の中のソルバ) のモデルの書き出しと解の読み込み
+        for target in [solver, getattr(solver, 'solver', None)] + list(getattr(solver, 'solvers', [])):
+            self.instrument(target, '_write_model', export)
+            self.instrument(target, '_read_solution', read)
+
+    def restore(self):
+        for target, method in reversed(self.patched):
+            target.__dict__.pop(method, None)
+        self.patched = []
@@ -0,0 +1,128 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+
+class Scorer(object):
+    # 時間割 (講座 -> timeslot 番号の配列) をまとめて NumPy で評価する
+    ## timeslot の番号は time_table.InstanceIndex の timeslots と同じ順番
+    def __init__(self, input, chunk=256):
+        self.chunk = chunk
+        courses = input['courses']
+        sessions = input['sessions']
+        self.names = [(course['name'], course['title']) for course in courses]
+        self.lengths = [int(t) for t in input['time_slots'].keys()]
+        self.required = np.array([input['time_slots'][str(t)] for t in self.lengths])
+        self.timeslots = [(t, sid, j) for t in self.lengths
+                          for sid, session in enumerate(sessions)
+                          for j in range(session['time'] // t)]
+        self.slot_ids = dict((slot, n) for n, slot in enumerate(self.timeslots))
+        T, C = len(self.timeslots), len(courses)
+        session_of = np.array([slot[1] for slot in self.timeslots], dtype=np.int64)
+        length_of = np.array([self.lengths.index(slot[0]) for slot in self.timeslots], dtype=np.int64)
+        self.rooms = np.array([sessions[sid]['rooms'] for sid in session_of], dtype=np.int64)
+        ## timeslot -> (セッション, 講座時間) / 講座時間
+        self.session_length = np.zeros((T, len(sessions) * len(self.lengths)))
+        self.session_length[np.arange(T), session_of * len(self.lengths) + length_of] = 1.0
+        self.length = np.zeros((T, len(self.lengths)))
+        self.length[np.arange(T), length_of] = 1.0
+        ## 参加者のいるセッション
+        session_ids = dict((session['name'], sid) for sid, session in enumerate(sessions))
+        ranges = dict((name, (session_ids[p['first']], session_ids[p['last']]))
+                      for name, p in input['participants'].items())
+        self.applicants = []
+        for course in courses:
+            for applicant in course['applicants']:
+                if applicant not in self.applicants:
+                    self.applicants.append(applicant)
+        A = len(self.applicants)
+        self.wishes = np.zeros((A, C), dtype=bool)
+        self.lectures = np.zeros((A, C), dtype=bool)
+        for a, applicant in enumerate(self.applicants):
+            for cid, course in enumerate(courses):
+                self.wishes[a, cid] = applicant in course['applicants']
+                self.lectures[a, cid] = course['name'] == applicant
+        self.weights = 1.0 / self.wishes.sum(axis=1)
+        self.watchable = (self.wishes & ~self.lectures).astype(np.float32)
+        self.teaching = self.lectures.astype(np.float32)
+        self.present = np.array([[ranges[applicant][0] <= sid <= ranges[applicant][1] for sid in session_of]
+                                 for applicant in self.applicants], dtype=bool).reshape(A, T)
+        ## 講座を行える timeslot と講座担当者
+        lecturers = sorted(set(course['name'] for course in courses))
+        self.lecturer = np.array([lecturers.index(course['name']) for course in courses], dtype=np.int64)
+        self.num_lecturers = len(lecturers)
+        self.allowed = np.zeros((C, T), dtype=bool)
+        for cid, course in enumerate(courses):
+            first, last = ranges[course['name']]
+            for n, (t, sid, _) in enumerate(self.timeslots):
+                self.allowed[cid, n] = first <= sid <= last and (not course['times'] or t in course['times'])
+
+    def encode(self, time_table):
+        # time_table (find_best_time_table の戻り値) を講座 -> timeslot 番号の配列にする (置かれていなければ -1)
+        course_ids = {}
+        for cid, key in enumerate(self.names):
+            course_ids.setdefault(key, []).append(cid)
+        assignment = np.full(len(self.lecturer), -1, dtype=np.int64)
+        for sid, session in enumerate(time_table):
+            if 'slot' not in session:
+                continue
+            for i, courses in enumerate(session['courses']):
+                for name, title in courses:
+                    if course_ids.get((name, title)):
+                        assignment[course_ids[(name, title)].pop(0)] = self.slot_ids[(session['slot'], sid, i)]
+        return assignment
+
+    def _chunks(self, candidates):
+        candidates = np.atleast_2d(np.asarray(candidates, dtype=np.int64))
+        for begin in range(0, len(candidates), self.chunk):
+            yield candidates[begin:begin + self.chunk]
+
+    def _placement(self, candidates):
+        n, C = candidates.shape
+        X = np.zeros((n, len(self.timeslots), C), dtype=np.float32)
+        rows, cids = np.nonzero(candidates >= 0)
+        X[rows, candidates[rows, cids], cids] = 1.0
+        return X
+
+    def attendance(self, candidates):
+        # 各候補 × 各参加者について見れる講座の数 (1つの枠では1つまで)
+        result = []
+        for block in self._chunks(candidates):
+            X = self._placement(block)
+            held = X @ self.watchable.T
+            teaching = X @ self.teaching.T
+            ok = (held > 0) & (teaching == 0) & self.present.T[np.newaxis]
+            result.append(ok.sum(axis=1))
+        return np.concatenate(result)
+
+    def score(self, candidates):
+        # 各候補の目的関数値
+        return self.attendance(candidates) @ self.weights
+
+    def violations(self, candidates):
+        # 各候補が破っている制約の数 (0 なら find_best_time_table の制約を全て満たす)
+        result = []
+        T = len(self.timeslots)
+        for block in self._chunks(candidates):
+            n, C = block.shape
+            placed = block >= 0
+            slots = np.where(placed, block, 0)
+            count = (~placed).sum(axis=1)
+            ## 講座担当者の出席と希望時間
+            count += (placed & ~self.allowed[np.arange(C), slots]).sum(axis=1)
+            offset = np.arange(n)[:, np.newaxis]
+            occupied = np.bincount((offset * T + slots)[placed], minlength=n * T).reshape(n, T)
+            ## 部屋数
+            count += (occupied > self.rooms).sum(axis=1)
+            ## セッション内の講座時間は1つ
+            used = ((occupied @ self.session_length) > 0).reshape(n, -1, len(self.lengths))
+            count += (used.sum(axis=2) > 1).sum(axis=1)
+            ## time_slots のコマ数
+            count += ((occupied @ self.length) != self.required).sum(axis=1)
+            ## 講座担当者の重複
+            keys = (offset * self.num_lecturers + self.lecturer) * T + slots
+            booked = np.bincount(keys[placed], minlength=n * self.num_lecturers * T)
+            count += (booked.reshape(n, -1) > 1).sum(axis=1)
+            result.append(count)
+        return np.concatenate(result)
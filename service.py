@@ -0,0 +1,411 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import signal
+import hashlib
+import threading
+import socketserver
+import multiprocessing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+from batch import run_scenario
+
+## クライアントが上書きできるオプション (ソルバのパスなどはサーバ側で決める)
+JOB_OPTIONS = {'solver': ('scip', 'cplex', 'bnb', 'heuristic'), 'formulation': ('slot', 'compact'),
+               'format': ('lp', 'mps', 'mps.gz'), 'time_limit': float, 'node_limit': int}
+
+
+class _Terminated(BaseException):
+    pass
+
+
+def _terminate(signum, frame):
+    raise _Terminated()
+
+
+def _run_job(connection, name, input, options):
+    # 子プロセスで1つのジョブを解き，暫定解と結果をパイプで親に送る
+    ## SIGTERM でも finally を通して作業ディレクトリを消し，ソルバのプロセスごと止められるように
+    ## 自分のプロセスグループを作る
+    signal.signal(signal.SIGTERM, _terminate)
+    os.setpgrp()
+
+    def incumbent(objective_value, time_table):
+        connection.send(('incumbent', {'objective': objective_value, 'time_table': time_table}))
+    try:
+        connection.send(('result', run_scenario(name, input, options, incumbent)))
+    except _Terminated:
+        pass
+    except Exception as e:
+        connection.send(('result', {'scenario': name, 'status': 'error: {0}'.format(e)}))
+    finally:
+        connection.close()
+
+
+class Job(object):
+    # ジョブの状態とイベント列 (queued, started, incumbent, done / failed / timeout / cancelled)
+    FINISHED = ('done', 'failed', 'timeout', 'cancelled')
+
+    def __init__(self, key, input, options):
+        self.id = uuid.uuid4().hex[:12]
+        self.key = key
+        self.input = input
+        self.options = options
+        self.status = 'queued'
+        self.result = None
+        self.events = []
+        self.submitted = time.time()
+        self.condition = threading.Condition()
+        self.process = None
+        self.emit('queued')
+
+    def emit(self, event, **data):
+        with self.condition:
+            entry = {'event': event, 'job': self.id, 'time': time.time() - self.submitted}
+            entry.update(data)
+            self.events.append(entry)
+            if event in Job.FINISHED:
+                self.status = event
+            elif event == 'started':
+                self.status = 'running'
+            self.condition.notify_all()
+
+    @property
+    def finished(self):
+        return self.status in Job.FINISHED
+
+    def stream(self, timeout=None):
+        # 今までのイベントを返し，終わるまで新しいイベントを待って返す
+        n = 0
+        while True:
+            with self.condition:
+                while n == len(self.events) and not self.finished:
+                    if not self.condition.wait(timeout):
+                        return
+                events = self.events[n:]
+                n = len(self.events)
+                finished = self.finished
+            for event in events:
+                yield event
+            if finished:
+                return
+
+    def summary(self):
+        summary = {'id': self.id, 'status': self.status, 'submitted': self.submitted}
+        if self.result is not None:
+            summary['result'] = self.result
+        return summary
+
+
+class SolveService(object):
+    # ジョブのキューと，ジョブを子プロセスで解く workers 個のスレッド
+    ## 同じ入力とオプションのジョブが待っているか実行中なら，新しく作らずにそのジョブを返す
+    KILL_WAIT = 5.0
+
+    def __init__(self, options, workers=None, timeout=60.0, grace=5.0, max_queue=64, keep=256):
+        self.options = options
+        self.timeout = timeout
+        self.grace = grace
+        self.max_queue = max_queue
+        self.keep = keep
+        self.jobs = {}
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        ## スレッドを持つサーバからは fork しない
+        ## forkserver ならモジュールを読み込んだプロセスから fork するので，ジョブごとの起動は軽いまま
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            self.context = multiprocessing.get_context('forkserver')
+            self.context.set_forkserver_preload(['batch'])
+        else:
+            self.context = multiprocessing.get_context('spawn')
+        self.workers = [threading.Thread(target=self._work, daemon=True)
+                        for _ in range(workers or os.cpu_count())]
+        for worker in self.workers:
+            worker.start()
+
+    def job_options(self, overrides):
+        options = dict(self.options)
+        for key, value in (overrides or {}).items():
+            allowed = JOB_OPTIONS.get(key)
+            if allowed is None:
+                raise ValueError('unknown option: {0}'.format(key))
+            if isinstance(allowed, tuple):
+                if value not in allowed:
+                    raise ValueError('{0} must be one of {1}'.format(key, ', '.join(allowed)))
+                options[key] = value
+            else:
+                options[key] = allowed(value)
+        ## ソルバの時間制限はジョブの制限時間を超えないようにする (時間切れでも暫定解が返る)
+        ## 焼きなましは指定がなければ batch.py と同じ既定の時間で止める
+        if options.get('time_limit') is None:
+            if options.get('solver') != 'heuristic':
+                options['time_limit'] = self.timeout
+        elif options['time_limit'] > self.timeout:
+            options['time_limit'] = self.timeout
+        return options
+
+    def submit(self, input, overrides=None):
+        options = self.job_options(overrides)
+        key = hashlib.sha256(json.dumps([input, options], sort_keys=True).encode('utf-8')).hexdigest()
+        with self.lock:
+            job = self.in_flight.get(key)
+            if job is not None and not job.finished:
+                return job, True
+            if self.queue.qsize() >= self.max_queue:
+                raise OverflowError('too many queued jobs')
+            job = Job(key, input, options)
+            self.jobs[job.id] = job
+            self.in_flight[key] = job
+            self._forget()
+        self.queue.put(job)
+        return job, False
+
+    def _forget(self):
+        finished = [job for job in self.jobs.values() if job.finished]
+        for job in sorted(finished, key=lambda job: job.submitted)[:max(0, len(self.jobs) - self.keep)]:
+            del self.jobs[job.id]
+
+    def cancel(self, job):
+        with self.lock:
+            if job.finished:
+                return False
+            self.in_flight.pop(job.key, None)
+            process = job.process
+            job.emit('cancelled')
+        if process is not None:
+            self._kill(process)
+        return True
+
+    def _kill(self, process):
+        # 子プロセスのグループ (SCIP などのソルバを含む) に SIGTERM を送り，
+        # 作業ディレクトリを消すのを待ってから残ったプロセスを SIGKILL で止める
+        for sig, wait in ((signal.SIGTERM, self.KILL_WAIT), (signal.SIGKILL, None)):
+            try:
+                os.killpg(process.pid, sig)
+            except ProcessLookupError:
+                ## まだ自分のグループを作っていないか，もう全部終わっている
+                if process.is_alive():
+                    os.kill(process.pid, sig)
+            process.join(wait)
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            try:
+                if not job.finished:
+                    self._run(job)
+            finally:
+                with self.lock:
+                    if self.in_flight.get(job.key) is job:
+                        del self.in_flight[job.key]
+
+    def _run(self, job):
+        receiver, sender = self.context.Pipe(duplex=False)
+        process = self.context.Process(target=_run_job, args=(sender, job.id, job.input, job.options),
+                                       daemon=True)
+        with self.lock:
+            if job.finished:
+                return
+        process.start()
+        sender.close()
+        with self.lock:
+            job.process = process
+            cancelled = job.finished
+        if cancelled:
+            receiver.close()
+            self._kill(process)
+            return
+        job.emit('started')
+        deadline = time.time() + self.timeout + self.grace
+        best = None
+        try:
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self._kill(process)
+                    job.result = {'status': 'timeout', 'incumbent': best}
+                    job.emit('timeout', result=job.result)
+                    return
+                if not receiver.poll(min(remaining, 0.5)):
+                    if not process.is_alive() and not receiver.poll():
+                        if not job.finished:
+                            job.result = {'status': 'failed', 'exitcode': process.exitcode}
+                            job.emit('failed', result=job.result)
+                        return
+                    continue
+                kind, data = receiver.recv()
+                if kind == 'incumbent':
+                    best = data
+                    job.emit('incumbent', **data)
+                else:
+                    job.result = data
+                    job.emit('done' if data['status'] in ('solved', 'no solution') else 'failed', result=data)
+                    return
+        except EOFError:
+            if not job.finished:
+                job.result = {'status': 'failed', 'exitcode': process.exitcode}
+                job.emit('failed', result=job.result)
+        finally:
+            receiver.close()
+            process.join(1.0)
+
+    def shutdown(self):
+        for job in list(self.jobs.values()):
+            self.cancel(job)
+        for _ in self.workers:
+            self.queue.put(None)
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    # POST /jobs                 入力 ({"input": ..., "options": ...} または入力そのもの) を投入
+    # GET  /jobs                 ジョブの一覧
+    # GET  /jobs/ID              ジョブの状態と結果 (?wait=1 なら終わるまで待つ)
+    # GET  /jobs/ID/events       イベントを1行1つの JSON で終わるまで流す
+    # DELETE /jobs/ID            ジョブを取り消す
+    protocol_version = 'HTTP/1.1'
+
+    def address_string(self):
+        ## Unix ソケットでは client_address が空
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def _send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _job(self, parts):
+        job = self.server.service.jobs.get(parts[1]) if len(parts) > 1 else None
+        if job is None:
+            self._send_json(404, {'error': 'no such job'})
+        return job
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path.rstrip('/') != '/jobs':
+            return self._send_json(404, {'error': 'not found'})
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+            input = body.get('input', body)
+            job, duplicate = self.server.service.submit(input, body.get('options') if 'input' in body else None)
+        except OverflowError as e:
+            return self._send_json(503, {'error': str(e)})
+        except (ValueError, TypeError, AttributeError) as e:
+            return self._send_json(400, {'error': str(e)})
+        self._send_json(200 if duplicate else 202, dict(job.summary(), duplicate=duplicate))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = url.path.strip('/').split('/')
+        if parts == ['jobs']:
+            return self._send_json(200, [dict(id=job.id, status=job.status)
+                                         for job in list(self.server.service.jobs.values())])
+        if parts[0] != 'jobs' or len(parts) not in (2, 3) or (len(parts) == 3 and parts[2] != 'events'):
+            return self._send_json(404, {'error': 'not found'})
+        job = self._job(parts)
+        if job is None:
+            return
+        if len(parts) == 2:
+            if 'wait=1' in url.query:
+                for _ in job.stream():
+                    pass
+            return self._send_json(200, job.summary())
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson; charset=utf-8')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for event in job.stream():
+                self.wfile.write((json.dumps(event, ensure_ascii=False) + '\n').encode('utf-8'))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def do_DELETE(self):
+        parts = urlparse(self.path).path.strip('/').split('/')
+        if parts[0] != 'jobs' or len(parts) != 2:
+            return self._send_json(404, {'error': 'not found'})
+        job = self._job(parts)
+        if job is not None:
+            self._send_json(200, dict(job.summary(), cancelled=self.server.service.cancel(job)))
+
+
+class ServiceServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service, quiet=False):
+        self.service = service
+        self.quiet = quiet
+        ThreadingHTTPServer.__init__(self, address, ServiceHandler)
+
+
+class UnixServiceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, service, quiet=False):
+        self.service = service
+        self.quiet = quiet
+        if os.path.exists(path):
+            os.remove(path)
+        socketserver.UnixStreamServer.__init__(self, path, ServiceHandler)
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    parser = OptionParser(usage='python3 service.py [options]')
+    parser.add_option("--host", dest="host", default="127.0.0.1", help="address to listen on (default: %default)")
+    parser.add_option("--port", dest="port", type="int", default=8080, help="port to listen on (default: %default)")
+    parser.add_option("--unix", dest="unix", metavar="PATH", help="listen on a Unix socket instead of TCP")
+    parser.add_option("--workers", dest="workers", type="int",
+                      help="number of jobs solved at once (default: number of CPUs)", metavar="N")
+    parser.add_option("--timeout", dest="timeout", type="float", default=60.0,
+                      help="time limit per job in seconds; the solver returns its best time table by then "
+                      "(default: %default)", metavar="SECONDS")
+    parser.add_option("--max-queue", dest="max_queue", type="int", default=64,
+                      help="maximum number of queued jobs (default: %default)", metavar="N")
+    parser.add_option("--solver", dest="solver", choices=["scip", "cplex", "bnb", "heuristic"],
+                      help="default solver (scip, cplex, bnb, heuristic)")
+    parser.add_option("--scip", dest="scip", help="path to a SCIP solver", metavar="PATH")
+    parser.add_option("--format", dest="format", default="lp", choices=["lp", "mps", "mps.gz"],
+                      help="model file format (lp, mps, mps.gz)")
+    parser.add_option("--formulation", dest="formulation", default="slot", choices=["slot", "compact"],
+                      help="default model formulation (slot, compact)")
+    parser.add_option("--node-limit", dest="node_limit", type="int", default=100000,
+                      help="branch-and-bound node limit (bnb)", metavar="N")
+    parser.add_option("--quiet", dest="quiet", action="store_true", default=False,
+                      help="do not log requests")
+    options, args = parser.parse_args()
+
+    settings = {'solver': options.solver, 'scip': options.scip, 'format': options.format,
+                'formulation': options.formulation, 'time_limit': None, 'node_limit': options.node_limit,
+                'log': False}
+    service = SolveService(settings, options.workers, options.timeout, max_queue=options.max_queue)
+    if options.unix:
+        server = UnixServiceServer(options.unix, service, options.quiet)
+        print('listening on {0}'.format(options.unix), file=sys.stderr)
+    else:
+        server = ServiceServer((options.host, options.port), service, options.quiet)
+        print('listening on http://{0}:{1}/'.format(*server.server_address[:2]), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.shutdown()
+        server.server_close()
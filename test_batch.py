@@ -0,0 +1,64 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from batch import load_scenarios, run_scenario, run_batch
+from test_time_table import SMALL_INPUT
+from unittest import TestCase, main
+import contextlib
+import tempfile
+import json
+import io
+import os
+
+
+OPTIONS = {'solver': 'heuristic', 'scip': None, 'format': 'lp', 'formulation': 'slot',
+           'time_limit': 0.2, 'node_limit': 100000}
+
+
+class LoadScenariosTest(TestCase):
+    def test_directory(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for name in ('b', 'a'):
+                with open(os.path.join(directory, name + '.json'), 'w') as f:
+                    json.dump(SMALL_INPUT, f)
+            scenarios = load_scenarios(directory)
+        self.assertEqual([name for name, _ in scenarios], ['a', 'b'])
+        self.assertEqual(scenarios[0][1], SMALL_INPUT)
+
+    def test_jsonl(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'scenarios.jsonl')
+            with open(filename, 'w') as f:
+                print(json.dumps({'name': 'plain', 'input': SMALL_INPUT}), file=f)
+                print(json.dumps(SMALL_INPUT), file=f)
+                print(json.dumps({'name': 'rooms', 'patch': {'sessions': {'day2': {'rooms': 2}}}}), file=f)
+            scenarios = load_scenarios(filename, SMALL_INPUT)
+        self.assertEqual([name for name, _ in scenarios], ['plain', 'line 2', 'rooms'])
+        self.assertEqual(scenarios[2][1]['sessions'][1]['rooms'], 2)
+        self.assertEqual(SMALL_INPUT['sessions'][1]['rooms'], 1)
+
+
+class RunScenarioTest(TestCase):
+    def test_solved(self):
+        result = run_scenario('small', SMALL_INPUT, OPTIONS)
+        self.assertEqual(result['status'], 'solved')
+        self.assertAlmostEqual(result['objective'], 3.0)
+        self.assertEqual(result['requests'], 11)
+        self.assertEqual(result['unmet'], 3)
+
+    def test_invalid(self):
+        input = dict(SMALL_INPUT, time_slots={'60': 1, '90': 2})
+        result = run_scenario('invalid', input, OPTIONS)
+        self.assertEqual(result['status'], 'invalid')
+        self.assertNotIn('objective', result)
+
+    def test_run_batch(self):
+        scenarios = [('first', SMALL_INPUT), ('second', dict(SMALL_INPUT, time_slots={'60': 1, '90': 2}))]
+        with contextlib.redirect_stderr(io.StringIO()):
+            results = run_batch(scenarios, OPTIONS, workers=2)
+        self.assertEqual([r['scenario'] for r in results], ['first', 'second'])
+        self.assertEqual([r['status'] for r in results], ['solved', 'invalid'])
+
+
+if __name__ == '__main__':
+    main(verbosity=2)
@@ -0,0 +1,44 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from benchmark import PHASES, synthetic_input, run_phases
+from milp import BranchAndBound
+from time_table import check_input
+from unittest import TestCase, main
+import json
+
+
+class SyntheticInputTest(TestCase):
+    def test_sizes(self):
+        input = synthetic_input(30, 4, rooms=3, seed=1, courses=20, density=0.2)
+        check_input(input)
+        self.assertEqual(len(input['participants']), 30)
+        self.assertEqual(len(input['sessions']), 4)
+        self.assertEqual(len(input['courses']), 20)
+        self.assertTrue(all(session['rooms'] == 3 for session in input['sessions']))
+        applications = sum(len(course['applicants']) for course in input['courses'])
+        self.assertGreater(applications, 30 * 20 * 0.1)
+        self.assertEqual(input, synthetic_input(30, 4, rooms=3, seed=1, courses=20, density=0.2))
+
+
+class RunPhasesTest(TestCase):
+    def test_build_only(self):
+        result = run_phases('small', synthetic_input(8, 2, seed=1))
+        self.assertEqual(sorted(result['time']), sorted(['validate', 'build', 'export']))
+        self.assertGreater(result['columns'], 0)
+        self.assertGreater(result['file_size'], 0)
+        self.assertNotIn('objective', result)
+
+    def test_solve(self):
+        input = synthetic_input(8, 2, seed=1)
+        result = run_phases('small', input, lambda: BranchAndBound(quiet=True), 'compact', 'mps',
+                            trace_memory=False)
+        self.assertEqual(sorted(result['time']), sorted(PHASES))
+        self.assertEqual(result['status'], 'optimal')
+        self.assertGreater(result['objective'], 0)
+        self.assertNotIn('peak_memory', result)
+        json.dumps(result)
+
+
+if __name__ == '__main__':
+    main()
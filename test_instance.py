@@ -0,0 +1,69 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from instance import Instance, compile_input_file
+from benchmark import synthetic_input
+from time_table import read_input_file
+from test_time_table import SMALL_INPUT
+from unittest import TestCase, main
+import io
+import os
+import copy
+import json
+import tempfile
+import contextlib
+
+
+class InstanceTest(TestCase):
+    def test_round_trip(self):
+        input = copy.deepcopy(SMALL_INPUT)
+        input['description'] = 'small'
+        input['courses'][0]['note'] = {'room': 'A'}
+        input['sessions'][1]['place'] = 'hall'
+        input['participants'][next(iter(input['participants']))]['memo'] = 'late'
+        input['courses'][0]['times'] = [60, 120]
+        input['courses'][1]['applicants'].append('nobody')
+        with contextlib.redirect_stderr(io.StringIO()):
+            instance = Instance.compile(input)
+        self.assertEqual(instance.to_input(), input)
+        self.assertEqual(instance.slots.shape[1], 3)
+        nobody = instance.participant_names.index('nobody')
+        self.assertFalse(instance.registered[nobody])
+        self.assertFalse(instance.present(range(len(input['sessions'])))[nobody].any())
+        self.assertIn(nobody, instance.applicants(1).tolist())
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'instance.npz')
+            instance.save(filename)
+            self.assertEqual(Instance.load(filename).to_input(), input)
+
+    def test_cache(self):
+        input = synthetic_input(1000, 8, seed=3, density=0.1)
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'input.json')
+            cache = os.path.join(directory, 'cache')
+            with open(filename, 'w', encoding='utf-8') as f:
+                json.dump(input, f)
+            self.assertEqual(read_input_file(filename, cache), input)
+            cached = os.listdir(cache)
+            self.assertEqual(len(cached), 1)
+            with open(os.path.join(cache, cached[0]), 'wb') as f:
+                f.write(b'broken')
+            self.assertEqual(compile_input_file(filename, cache).to_input(), input)
+            self.assertEqual(Instance.load(os.path.join(cache, cached[0])).to_input(), input)
+            ## 入力が変われば読み直す
+            input['courses'][0]['title'] = 'changed'
+            input['courses'][0]['note'] = 'new'
+            with open(filename, 'w', encoding='utf-8') as f:
+                json.dump(input, f)
+            self.assertEqual(read_input_file(filename, cache), input)
+            self.assertEqual(len(os.listdir(cache)), 2)
+            ## 小さい入力はキャッシュしない
+            small = os.path.join(directory, 'small.json')
+            with open(small, 'w', encoding='utf-8') as f:
+                json.dump(SMALL_INPUT, f)
+            self.assertEqual(read_input_file(small, cache), SMALL_INPUT)
+            self.assertEqual(len(os.listdir(cache)), 2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,18 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
-from milp import Variable, BinaryVariable, IntegerVariable, VariableSet, VariableDict
-from milp import LinearExpression, CPLEX, SCIP
+from milp import Variable, BinaryVariable, IntegerVariable, VariableSet, VariableDict, Solution
+from milp import LinearExpression, Model, VariableArray, Solver, CPLEX, SCIP, BranchAndBound, quicksum
+from milp import PortfolioSolver, scip_portfolio, SolutionCache, CachedSolver, presolve
 from unittest import TestCase, main
 import unittest
 import os
+import sys
+import numpy as np
+import gzip
+import tempfile
+import io
+import contextlib
 
 class TestBinaryVariable(TestCase):
     def setUp(self):
@@ -40,6 +47,26 @@ class TestBinaryVariable(TestCase):
         self.assertEqual(d[self.x], 10)
         self.assertEqual(d[self.y], 100)
 
+    def test_id(self):
+        self.assertNotEqual(self.x.id, self.y.id)
+        self.assertNotEqual(self.b1.id, self.b2.id)
+        self.assertEqual(BinaryVariable('x').id, self.x.id)
+        d = VariableDict()
+        d[self.x] = 10
+        self.assertEqual(d[BinaryVariable('x')], 10)
+
+    def test_id_released(self):
+        import gc
+        import milp
+        d = VariableDict()
+        d[BinaryVariable('released')] = 1
+        gc.collect()
+        self.assertIn('released', milp._variable_ids)
+        self.assertEqual(d[BinaryVariable('released')], 1)
+        del d
+        gc.collect()
+        self.assertNotIn('released', milp._variable_ids)
+
 
 class TestLinearExpression(TestCase):
     def assertLinearConstraintEqual(self, constraint, lhs_terms, sense, rhs_constant):
@@ -121,6 +148,22 @@ class TestLinearExpression(TestLinearExpression):
         self.assertEqual(str(5 + sum([self.x, self.y, self.z, 10.0])), 'x + y + z + 15.0')
         self.assertEqual(str(self.x - self.x + self.y), 'y')
 
+    def test_iadd(self):
+        e = LinearExpression()
+        e += self.x
+        e += 2.0 * self.y
+        e += 3
+        self.assertEqual(str(e), 'x + 2.0 y + 3.0')
+        f = e + 1
+        e -= self.x_p_y
+        self.assertEqual(str(e), 'y + 3.0')
+        self.assertEqual(str(f), 'x + 2.0 y + 4.0')
+
+    def test_quicksum(self):
+        self.assertEqual(str(quicksum([self.x, self.y, self.z, 10.0])), 'x + y + z + 10.0')
+        self.assertEqual(str(quicksum(v * 2.0 for v in [self.x, self.y, self.x])), '4.0 x + 2.0 y')
+        self.assertEqual(str(quicksum([])), '')
+
     def test_constraint(self):
         self.assertEqual(str(self.x_p_y < 10.0), 'x + y < 10.0')
         self.assertEqual(str(self.x_m_y <= -self.x + 10.0), '2.0 x - y <= 10.0')
@@ -129,6 +172,295 @@ class TestLinearExpression(TestLinearExpression):
         self.assertEqual(str(self.x_p_x == self.x + 1.0), 'x = 1.0')
 
 
+class SolutionTest(TestCase):
+    def setUp(self):
+        self.x = BinaryVariable('sparse_x')
+        self.y = BinaryVariable('sparse_y')
+
+    def test_sparse(self):
+        solution = Solution()
+        solution[self.x] = 1.0
+        solution[self.y] = 0.0
+        self.assertEqual(len(solution), 1)
+        self.assertEqual(solution[self.y], 0.0)
+        self.assertEqual(solution.get(self.y), 0.0)
+        self.assertEqual(list(solution.items()), [(self.x, 1.0)])
+        solution[self.x] = 0
+        self.assertEqual(len(solution), 0)
+        solution[self.y] = 1.0
+        solution.objective_value = 1.0
+        copied = solution.copy()
+        self.assertIsInstance(copied, Solution)
+        self.assertEqual(copied.objective_value, 1.0)
+        self.assertEqual(copied[self.y], 1.0)
+
+    def test_read_cplex(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'model.lp.sol')
+            with open(filename, 'w') as f:
+                f.write('<?xml version = "1.0" encoding="UTF-8" standalone="yes"?>\n'
+                        '<CPLEXSolution version="1.2">\n'
+                        ' <header objectiveValue="1" solutionStatusValue="102"'
+                        ' solutionStatusString="integer optimal, tolerance" MIPNodes="7"'
+                        ' MIPIterations="21" MIPRelativeGap="0.001"/>\n'
+                        ' <variables>\n'
+                        '  <variable name="sparse_x" index="0" value="1"/>\n'
+                        '  <variable name="sparse_y" index="1" value="1e-12"/>\n'
+                        '  <variable name="unknown" index="2" value="1"/>\n'
+                        ' </variables>\n'
+                        '</CPLEXSolution>\n')
+            solver = CPLEX()
+            solver.variables = [self.x, self.y]
+            solution = solver._read_solution(filename)
+        self.assertEqual(solution.objective_value, 1.0)
+        self.assertEqual(solution.status, 'optimal')
+        self.assertAlmostEqual(solution.gap, 0.001)
+        self.assertEqual(solution.statistics, {'nodes': 7, 'lp_iterations': 21})
+        self.assertEqual(list(solution.items()), [(self.x, 1.0)])
+        self.assertEqual(solution[self.y], 0.0)
+        for value, string, status, gap in (('101', 'integer optimal solution', 'optimal', 0.0),
+                                           ('107', 'time limit exceeded', 'time limit exceeded', 0.2)):
+            solution = Solution()
+            header = {'objectiveValue': '1', 'solutionStatusValue': value, 'solutionStatusString': string}
+            if value == '107':
+                header['MIPRelativeGap'] = '0.2'
+            solver._read_header(solution, header)
+            self.assertEqual(solution.status, status)
+            self.assertAlmostEqual(solution.gap, gap)
+
+
+class VariableArrayTest(TestCase):
+    def setUp(self):
+        mask = np.array([[True, True, False], [False, True, True]])
+        self.x = VariableArray('va_{0}_{1}', [['a', 'b'], [1, 2, 3]], mask)
+
+    def test_index(self):
+        self.assertEqual(len(self.x), 4)
+        self.assertEqual(self.x['a', 1].name, 'va_a_1')
+        self.assertIn(('b', 3), self.x)
+        self.assertNotIn(('a', 3), self.x)
+        self.assertRaises(KeyError, lambda: self.x['a', 3])
+        keyed = VariableArray('va_{0}_{1}', [['a', 'b'], [1, 2, 3]], [('a', 1), ('b', 3)])
+        self.assertEqual([key for key, _ in keyed], [('a', 1), ('b', 3)])
+        self.assertEqual(keyed['b', 3].id, self.x['b', 3].id)
+
+    def test_slice(self):
+        column = self.x[:, 2]
+        self.assertEqual(column.index_sets, [['a', 'b']])
+        self.assertEqual([v.name for _, v in column], ['va_a_2', 'va_b_2'])
+        rows = self.x[['b'], 1:]
+        self.assertEqual(rows.shape, (1, 2))
+        self.assertEqual([key for key, _ in rows], [('b', 2), ('b', 3)])
+
+    def test_index_of(self):
+        self.assertEqual(self.x.index_of('b'), 1)
+        self.assertEqual(self.x.index_of(3, axis=1), 2)
+        self.assertIsNone(self.x.index_of('c'))
+        self.assertEqual(self.x[:, 2].index_of('b'), 1)
+
+    def test_sum(self):
+        self.assertEqual(str(self.x.sum()), 'va_a_1 + va_a_2 + va_b_2 + va_b_3')
+        by_column = self.x.sum(axis=0)
+        self.assertEqual(by_column.shape, (3,))
+        self.assertEqual([str(e) for e in by_column], ['va_a_1', 'va_a_2 + va_b_2', 'va_b_3'])
+        constraint = self.x.sum(axis=1)[0] <= 1
+        self.assertEqual(str(constraint), 'va_a_1 + va_a_2 <= 1.0')
+
+    def test_values(self):
+        solution = Solution()
+        solution[self.x['b', 3]] = 1.0
+        solution[self.x['a', 2]] = 1.0
+        np.testing.assert_array_equal(self.x.values(solution), [[0, 1, 0], [0, 0, 1]])
+        rows, columns = self.x.nonzero(solution)
+        self.assertEqual((rows.tolist(), columns.tolist()), ([0, 1], [1, 2]))
+        dense = VariableDict((v, 1.0 if key == ('b', 2) else 0.0) for key, v in self.x)
+        np.testing.assert_array_equal(self.x.values(dense), [[0, 0, 0], [0, 1, 0]])
+
+
+class ModelTest(TestCase):
+    def setUp(self):
+        self.x = BinaryVariable('x')
+        self.y = BinaryVariable('y')
+        self.z = BinaryVariable('z')
+
+    def test_add_constraint(self):
+        model = Model()
+        model.add_constraint(self.x + 2 * self.y <= 1)
+        model.add_constraint(self.z - self.x + 3 == self.x)
+        self.assertEqual(model.num_rows, 2)
+        self.assertEqual(model.num_columns, 3)
+        self.assertEqual(model.num_nonzeros, 4)
+        x, y, z = model.columns([self.x, self.y, self.z]).tolist()
+        indptr, indices, data = model.csr()
+        self.assertEqual(indptr.tolist(), [0, 2, 4])
+        self.assertEqual(sorted(zip(indices[:2].tolist(), data[:2].tolist())),
+                         sorted([(x, 1.0), (y, 2.0)]))
+        self.assertEqual(sorted(zip(indices[2:].tolist(), data[2:].tolist())),
+                         sorted([(x, -2.0), (z, 1.0)]))
+        self.assertEqual(model.senses.tolist(), [b'L', b'E'])
+        self.assertEqual(model.rhs.tolist(), [1.0, -3.0])
+
+    def test_family_statistics(self):
+        model = Model()
+        with model.family('pairs'):
+            model.add_constraint(self.x + self.y <= 1)
+        model.add_constraint(self.z <= 1)
+        other = Model()
+        with other.family('pairs'):
+            other.add_constraint(self.y + self.z <= 1)
+        with other.family('empty'):
+            pass
+        model.add_model(other)
+        self.assertEqual(model.family_statistics(),
+                         {'pairs': {'rows': 2, 'nonzeros': 4, 'columns': 3},
+                          None: {'rows': 1, 'nonzeros': 1, 'columns': 1}})
+
+    def test_add_model(self):
+        model = Model()
+        model.add_constraint(self.x + self.y <= 1)
+        other = Model()
+        other.add_constraint(self.z - self.y >= 0)
+        other.set_bounds(self.z, 0, 0)
+        self.assertEqual(model.add_model(other).tolist(), [1])
+        self.assertEqual(model.num_rows, 2)
+        self.assertEqual(model.num_columns, 3)
+        y, z = model.columns([self.y, self.z]).tolist()
+        indptr, indices, data = model.csr()
+        self.assertEqual(sorted(zip(indices[2:].tolist(), data[2:].tolist())),
+                         sorted([(y, -1.0), (z, 1.0)]))
+        self.assertEqual(model.senses.tolist(), [b'L', b'G'])
+        self.assertEqual(model.bounds()[1][z], 0)
+
+    def test_add_constraint_block(self):
+        model = Model()
+        model.add_constraint(self.x >= 0)
+        cols = model.columns([self.x, self.y, self.z])
+        self.assertEqual(cols.tolist(), [0, 1, 2])
+        rows = model.add_constraint_block([0, 0, 1, 1], cols[[0, 1, 1, 2]], [1.0, -1.0, 1.0, -1.0],
+                                          '<=', np.zeros(2))
+        self.assertEqual(rows.tolist(), [1, 2])
+        indptr, indices, data = model.csc()
+        self.assertEqual(indptr.tolist(), [0, 2, 4, 5])
+        self.assertEqual(indices.tolist(), [0, 1, 1, 2, 2])
+        self.assertEqual(data.tolist(), [1.0, 1.0, -1.0, 1.0, -1.0])
+        self.assertEqual(model.senses.tolist(), [b'G', b'L', b'L'])
+        self.assertRaises(ValueError, model.add_constraint_block, [0], [3], 1.0, '<=', [0])
+        self.assertRaises(ValueError, model.add_constraint_block, [1], [0], 1.0, '<=', [0])
+
+
+class PresolveTest(TestCase):
+    def setUp(self):
+        self.x = BinaryVariable('px')
+        self.y = BinaryVariable('py')
+        self.z = BinaryVariable('pz')
+        self.n = IntegerVariable('pn')
+
+    def presolve(self, objective, constraints, is_minimize=False):
+        model = Model()
+        model.add_constraints(constraints)
+        vector, constant = model.objective_vector(objective)
+        return presolve(model, vector, constant, is_minimize)
+
+    def test_fixed_variables(self):
+        result = self.presolve(self.x + self.y + self.z + 2 * self.n, [
+            self.x == 0,
+            self.x + self.y + self.z <= 1,
+            self.n - self.y <= 3,
+            self.n <= 10,
+            3 * self.n >= 2,
+        ])
+        self.assertFalse(result.infeasible)
+        model = result.model
+        self.assertEqual(sorted(v.name for v in model.variables), ['pn', 'py', 'pz'])
+        self.assertEqual(model.num_rows, 2)
+        lower, upper = model.bounds()
+        self.assertEqual(lower[model.column(self.n)], 1.0)
+        self.assertEqual(upper[model.column(self.n)], 10.0)
+        solution = result.postsolve(VariableDict())
+        self.assertEqual(solution[self.x], 0.0)
+
+    def test_substitution(self):
+        result = self.presolve(self.x + self.y + 5, [
+            self.z == 1,
+            self.x + self.y + self.z <= 2,
+            self.z + self.n <= 3,
+        ])
+        model = result.model
+        self.assertEqual(sorted(v.name for v in model.variables), ['px', 'py'])
+        self.assertEqual(model.rhs.tolist(), [1.0])
+        self.assertAlmostEqual(result.constant, 5.0)
+        solution = result.postsolve(VariableDict())
+        self.assertEqual(solution[self.z], 1.0)
+        self.assertEqual(solution[self.n], 0.0)
+
+    def test_infeasible(self):
+        self.assertTrue(self.presolve(self.x, [self.x + self.y >= 3]).infeasible)
+        self.assertTrue(self.presolve(self.x, [2 * self.n == 3]).infeasible)
+        self.assertIsNone(BranchAndBound(quiet=True).maximize(self.x, [self.x - self.y == 2]))
+
+    def test_export_bounds(self):
+        directory = tempfile.TemporaryDirectory()
+        filename = os.path.join(directory.name, 'model.lp')
+        model = Model()
+        model.add_constraint(self.x + self.n <= 4)
+        model.set_bounds(self.n, 1, 3)
+        SCIP(filename=filename)._export(filename, False, self.x + self.n, model)
+        with open(filename) as f:
+            lines = f.read().split('\n')
+        self.assertEqual(lines[lines.index('bounds') + 1], ' 1.0 <= pn <= 3.0')
+        directory.cleanup()
+
+
+class ExportTest(TestCase):
+    def setUp(self):
+        self.x1 = IntegerVariable('x1')
+        self.x2 = IntegerVariable('x2')
+        self.b = BinaryVariable('b')
+        self.constraints = [
+            3 * self.x1 + 2 * self.x2 <= 6,
+            -3 * self.x1 + 2 * self.x2 <= 0,
+            self.x1 + self.b >= 1,
+        ]
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def export(self, format):
+        filename = os.path.join(self.directory.name, 'model.' + format)
+        solver = SCIP(filename=filename, format=format)
+        solver._export(filename, False, self.x2 + 2 * self.b, self.constraints)
+        opener = gzip.open if format.endswith('.gz') else open
+        with opener(filename, 'rt') as f:
+            return f.read().split('\n')
+
+    def test_lp(self):
+        lines = self.export('lp')
+        self.assertEqual(lines[0], 'max')
+        self.assertIn(' c0: + 3.0 x1 + 2.0 x2 <= 6.0', lines)
+        self.assertIn(' c1: - 3.0 x1 + 2.0 x2 <= 0.0', lines)
+        self.assertIn(' c2: + x1 + b >= 1.0', lines)
+        self.assertEqual(lines[lines.index('binary') + 1], ' b')
+
+    def test_mps(self):
+        for format in ['mps', 'mps.gz']:
+            lines = self.export(format)
+            self.assertIn(' L c0', lines)
+            self.assertIn(' G c2', lines)
+            self.assertIn('    x1 c1 -3.0', lines)
+            self.assertIn('    b obj 2.0', lines)
+            self.assertIn('    RHS c0 6.0', lines)
+            self.assertIn(' BV BND b', lines)
+            self.assertEqual(lines[-2], 'ENDATA')
+            markers = [line for line in lines if 'MARKER' in line]
+            self.assertEqual(markers, ["    MARKER 'MARKER' 'INTORG'", "    MARKER 'MARKER' 'INTEND'"])
+            self.assertLess(lines.index(markers[0]), lines.index('    x1 c1 -3.0'))
+            self.assertGreater(lines.index(markers[1]), lines.index('    b obj 2.0'))
+
+    def test_unknown_format(self):
+        self.assertRaises(ValueError, SCIP, format='xml')
+
+
 class CPLEXTest(TestCase):
     @unittest.skipIf(os.system('which cplex >/dev/null'), 'cplex not found')
     def test_milp_problem(self):
@@ -145,6 +477,220 @@ class CPLEXTest(TestCase):
         self.assertAlmostEqual(solution[x2], 1.0)
 
 
+FAKE_SCIP = """#!{python}
+import gzip, sys, time
+commands = [sys.argv[i + 1] for i, arg in enumerate(sys.argv) if arg == '-c']
+model = [c for c in commands if c.startswith('read ')][0].split(' ', 1)[1]
+opener = gzip.open if model.endswith('.gz') else open
+with opener(model, 'rt') as f:
+    text = f.read()
+found = [0] if 'set fake incumbents' in commands else []
+found.append(1)
+bestsol, status, count = -1, None, 0
+for command in commands:
+    if command.startswith('set limits bestsol '):
+        bestsol = int(command.split()[-1])
+    elif command == 'optimize':
+        if 'set fake slow' in commands:
+            time.sleep(30)
+        count = len(found) if bestsol < 0 else min(bestsol, len(found))
+        if 'set fake infeasible' in commands:
+            status = 'infeasible'
+        elif count == len(found):
+            status = 'optimal solution found'
+        else:
+            status = 'solution improvement limit reached'
+    elif command.startswith('write solution '):
+        with open(command.split(' ', 2)[2], 'w') as f:
+            print('solution status: {{0}}'.format(status), file=f)
+            if status == 'infeasible':
+                continue
+            print('objective value: {{0}}'.format(found[count - 1]), file=f)
+            for name in ['x1', 'x2']:
+                if name in text:
+                    print(name, found[count - 1], file=f)
+    elif command.startswith('set diffsave '):
+        open(command.split(' ', 2)[2], 'w').close()
+"""
+
+
+class FakeSCIPTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'scip')
+        with open(self.path, 'w') as f:
+            f.write(FAKE_SCIP.format(python=sys.executable))
+        os.chmod(self.path, 0o755)
+        self.x1 = IntegerVariable('x1')
+        self.x2 = IntegerVariable('x2')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def solve(self, start=None, **options):
+        solver = SCIP(quiet=True, path=self.path, **options)
+        return solver.maximize(self.x2, [
+            3 * self.x1 + 2 * self.x2 <= 6,
+            -3 * self.x1 + 2 * self.x2 <= 0,
+        ], start=start)
+
+    def assertSolved(self, solution):
+        self.assertIsNotNone(solution)
+        self.assertAlmostEqual(solution.objective_value, 1.0)
+        self.assertAlmostEqual(solution[self.x1], 1.0)
+        self.assertAlmostEqual(solution[self.x2], 1.0)
+
+
+class SCIPWorkspaceTest(FakeSCIPTestCase):
+    def test_private_workspace(self):
+        self.assertSolved(self.solve())
+        self.assertSolved(self.solve(format='mps.gz'))
+
+    def test_explicit_filename(self):
+        filename = os.path.join(self.directory.name, 'model.lp')
+        self.assertSolved(self.solve(filename=filename))
+        self.assertTrue(os.path.exists(filename + '.sol'))
+
+    def test_pipe(self):
+        for format in Solver.FORMATS:
+            self.assertSolved(self.solve(pipe=True, format=format))
+
+    def test_pipe_fifo_removed(self):
+        filename = os.path.join(self.directory.name, 'model.lp')
+        self.assertSolved(self.solve(filename=filename, pipe=True))
+        self.assertFalse(os.path.lexists(filename))
+        self.assertTrue(os.path.exists(filename + '.sol'))
+        ## 書き込みに失敗してもパイプは残らない
+        solver = SCIP(quiet=True, path=self.path, pipe=True, filename=filename)
+        fifos = []
+        def fail(fifo, *args):
+            fifos.append(fifo)
+            raise IOError('write failed')
+        solver._stream_to_fifo = fail
+        with self.assertRaises(IOError):
+            solver.maximize(self.x2, [self.x1 + self.x2 <= 1])
+        self.assertEqual(len(fifos), 1)
+        self.assertNotEqual(os.path.dirname(fifos[0]), self.directory.name)
+        self.assertFalse(os.path.lexists(os.path.dirname(fifos[0])))
+
+    def test_start_files(self):
+        start = VariableDict([(self.x1, 1), (self.x2, 0)])
+        model = Model()
+        model.add_constraint(self.x1 + self.x2 <= 1)
+        scip = SCIP(path=self.path)
+        filename = os.path.join(self.directory.name, 'start.sol')
+        scip._write_start(filename, scip._start_values(model, start))
+        with open(filename) as f:
+            self.assertEqual(f.read().split('\n'), ['x1 1.0', 'x2 0.0', ''])
+        self.assertIn('read {0}'.format(filename), scip._command('model.lp', 'model.lp.sol', filename))
+        cplex = CPLEX()
+        filename = os.path.join(self.directory.name, 'start.mst')
+        cplex._write_start(filename, cplex._start_values(model, start))
+        import xml.etree.ElementTree as ET
+        variables = ET.parse(filename).getroot().findall('CPLEXSolution/variables/variable')
+        self.assertEqual([(v.get('name'), v.get('value')) for v in variables],
+                         [('x1', '1.0'), ('x2', '0.0')])
+        self.assertSolved(self.solve(start=start))
+
+    def test_concurrent(self):
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(4) as executor:
+            solutions = list(executor.map(lambda _: self.solve(pipe=True), range(8)))
+        for solution in solutions:
+            self.assertSolved(solution)
+
+
+class PortfolioSolverTest(FakeSCIPTestCase):
+    def test_first_optimal(self):
+        import time
+        solvers = [SCIP(quiet=True, path=self.path, settings=settings) for settings in [
+            ['set fake slow'], ['set fake infeasible'], [], ['set fake slow']]]
+        portfolio = PortfolioSolver(solvers, quiet=True)
+        started = time.time()
+        solution = portfolio.maximize(self.x2, [
+            3 * self.x1 + 2 * self.x2 <= 6,
+            -3 * self.x1 + 2 * self.x2 <= 0,
+        ])
+        self.assertLess(time.time() - started, 20)
+        self.assertSolved(solution)
+        self.assertIs(portfolio.winner, solvers[2])
+
+    def test_no_solution(self):
+        solvers = [SCIP(quiet=True, path=self.path, settings=['set fake infeasible'])] * 2
+        portfolio = PortfolioSolver(solvers, quiet=True)
+        self.assertIsNone(portfolio.maximize(self.x2, [self.x1 + self.x2 <= 1]))
+        self.assertIsNone(portfolio.winner)
+        self.assertEqual(portfolio.status, 'infeasible')
+        self.assertIsNone(solvers[0].maximize(self.x2, [self.x1 + self.x2 <= 1]))
+        self.assertEqual(solvers[0].status, 'infeasible')
+
+    def test_scip_portfolio(self):
+        portfolio = scip_portfolio(4, path=self.path)
+        scips = [s for s in portfolio.solvers if isinstance(s, SCIP)]
+        self.assertEqual(len(portfolio.solvers), 4)
+        self.assertEqual(len(set(tuple(s.settings) for s in scips)), len(scips))
+
+    def test_limits(self):
+        portfolio = scip_portfolio(3, path=self.path, time_limit=5, gap=0.01)
+        self.assertEqual([(s.time_limit, s.gap) for s in portfolio.solvers], [(5, 0.01)] * 3)
+        command = portfolio.solvers[0]._command('model.lp', 'model.lp.sol')
+        self.assertIn('set limits time 5', command)
+        self.assertIn('set limits gap 0.01', command)
+
+
+class AnytimeTest(FakeSCIPTestCase):
+    def test_limits(self):
+        command = SCIP(path=self.path, time_limit=10, gap=0.01)._command('model.lp', 'model.lp.sol')
+        self.assertIn('set limits time 10', command)
+        self.assertIn('set limits gap 0.01', command)
+        command = CPLEX(time_limit=10, gap=0.01)._command('model.lp', 'model.lp.sol')
+        self.assertIn('set timelimit 10', command)
+        self.assertIn('set mip tolerances mipgap 0.01', command)
+
+    def test_callback(self):
+        incumbents = []
+        solver = SCIP(quiet=True, path=self.path, settings=['set fake incumbents'])
+        solution = solver.maximize(self.x2, [
+            3 * self.x1 + 2 * self.x2 <= 6,
+            -3 * self.x1 + 2 * self.x2 <= 0,
+        ], callback=incumbents.append)
+        self.assertSolved(solution)
+        self.assertEqual(solution.status, 'optimal')
+        self.assertEqual([s.objective_value for s in incumbents], [0.0, 1.0])
+        self.assertEqual(incumbents[0].status, 'feasible')
+
+    def test_iterate(self):
+        solver = SCIP(quiet=True, path=self.path, settings=['set fake incumbents'])
+        incumbents = list(solver.iter_maximize(self.x2, [
+            3 * self.x1 + 2 * self.x2 <= 6,
+            -3 * self.x1 + 2 * self.x2 <= 0,
+        ]))
+        self.assertEqual([s.objective_value for s in incumbents], [0.0, 1.0])
+        self.assertSolved(incumbents[-1])
+
+    def test_read_time_limit(self):
+        filename = os.path.join(self.directory.name, 'model.lp.sol')
+        with open(filename, 'w') as f:
+            f.write('solution status: time limit reached\nobjective value: 1\nx1 1\nx2 1\n')
+        with open(filename + '.stats', 'w') as f:
+            f.write('Total Time         :       1.50\n'
+                    'B&B Tree           :\n  number of runs   :          1\n'
+                    '  nodes            :         12 (5 internal, 7 leaves)\n'
+                    'LP                 :       Time      Calls Iterations  Iter/call\n'
+                    '  primal LP        :       0.00          1          4       4.00\n'
+                    '  dual LP          :       0.01         10         30       3.00\n'
+                    'Solution           :\n  Gap              :       2.50 %\n')
+        solver = SCIP(path=self.path)
+        solver.variables = [self.x1, self.x2]
+        solution = solver._read_solution(filename)
+        self.assertSolved(solution)
+        self.assertEqual(solution.status, 'time limit reached')
+        self.assertAlmostEqual(solution.gap, 0.025)
+        self.assertEqual(solution.statistics['nodes'], 12)
+        self.assertEqual(solution.statistics['lp_iterations'], 34)
+        self.assertAlmostEqual(solution.statistics['time'], 1.5)
+
+
 class SCIPTest(TestCase):
     @unittest.skipIf(os.system('which scip >/dev/null'), 'cplex not found')
     def test_milp_problem(self):
@@ -161,5 +707,174 @@ class SCIPTest(TestCase):
         self.assertAlmostEqual(solution[x2], 1.0)
 
 
+class BranchAndBoundTest(TestCase):
+    def test_milp_problem(self):
+        x1 = IntegerVariable('x1')
+        x2 = IntegerVariable('x2')
+        solver = BranchAndBound(quiet=True)
+        solution = solver.maximize(x2, [
+            3 * x1 + 2 * x2 <= 6,
+            -3 * x1 + 2 * x2 <= 0,
+        ])
+        self.assertIsNotNone(solution)
+        self.assertEqual(solver.status, 'optimal')
+        self.assertAlmostEqual(solution.objective_value, 1.0)
+        self.assertAlmostEqual(solution[x1], 1.0)
+        self.assertAlmostEqual(solution[x2], 1.0)
+
+    def test_knapsack(self):
+        xs = [BinaryVariable('k{0}'.format(i)) for i in range(6)]
+        values = [10, 13, 7, 8, 9, 4]
+        weights = [5, 7, 3, 4, 5, 2]
+        solver = BranchAndBound(quiet=True)
+        solution = solver.maximize(quicksum(v * x for v, x in zip(values, xs)), [
+            quicksum(w * x for w, x in zip(weights, xs)) <= 12,
+            xs[0] + xs[1] >= 1,
+        ])
+        self.assertAlmostEqual(solution.objective_value, 25.0)
+        self.assertEqual([solution[x] for x in xs], [1.0, 0.0, 1.0, 1.0, 0.0, 0.0])
+
+    def test_same_name_in_another_model(self):
+        BinaryVariable('q')
+        q = IntegerVariable('q')
+        y = IntegerVariable('q_y')
+        model = Model()
+        model.add_constraint(q + y <= 5)
+        self.assertEqual(model.variables, [q, y])
+        solution = BranchAndBound(quiet=True).maximize(q, model)
+        self.assertAlmostEqual(solution.objective_value, 5.0)
+        self.assertIs(list(solution)[0], q)
+
+    def test_minimize(self):
+        x = IntegerVariable('m1')
+        y = IntegerVariable('m2')
+        solver = BranchAndBound(quiet=True)
+        solution = solver.minimize(2 * x + 3 * y + 1, [
+            x + y >= 3.5,
+            x - y == 1,
+        ])
+        self.assertAlmostEqual(solution.objective_value, 13.0)
+        self.assertAlmostEqual(solution[x], 3.0)
+        self.assertAlmostEqual(solution[y], 2.0)
+
+    def test_infeasible(self):
+        x = BinaryVariable('i1')
+        y = BinaryVariable('i2')
+        solver = BranchAndBound(quiet=True)
+        self.assertIsNone(solver.maximize(x + y, [x + y >= 1.5, x - y == 0.5]))
+        self.assertEqual(solver.status, 'infeasible')
+
+    def test_start(self):
+        xs = [BinaryVariable('s{0}'.format(i)) for i in range(6)]
+        start = VariableDict([(xs[0], 1), (xs[1], 1), (xs[2], 1)])
+        solver = BranchAndBound(quiet=True, node_limit=0)
+        solution = solver.maximize(quicksum(xs), [quicksum(2 * x for x in xs) <= 7], start=start)
+        self.assertAlmostEqual(solution.objective_value, 3.0)
+        infeasible = VariableDict([(x, 1) for x in xs])
+        solution = solver.maximize(quicksum(xs), [quicksum(2 * x for x in xs) <= 7], start=infeasible)
+        self.assertIsNone(solution)
+
+    def test_poor_start_with_gap(self):
+        xs = [BinaryVariable('ps{0}'.format(i)) for i in range(8)]
+        values = [9, 7, 8, 6, 5, 7, 4, 3]
+        weights = [6, 5, 6, 4, 3, 5, 2, 2]
+        solver = BranchAndBound(quiet=True, gap=0.01)
+        solution = solver.maximize(quicksum(v * x for v, x in zip(values, xs)),
+                                   [quicksum(w * x for w, x in zip(weights, xs)) <= 15],
+                                   start=VariableDict([(xs[7], 1)]))
+        self.assertAlmostEqual(solution.objective_value, 24.0)
+        self.assertGreater(solver.nodes, 0)
+        self.assertLessEqual(solution.gap, 0.01)
+
+    def test_node_limit(self):
+        xs = [BinaryVariable('n{0}'.format(i)) for i in range(8)]
+        solver = BranchAndBound(quiet=True, node_limit=1)
+        solver.maximize(quicksum(xs), [quicksum(2 * x for x in xs) <= 7])
+        self.assertEqual(solver.status, 'node limit')
+
+    def test_anytime(self):
+        xs = [BinaryVariable('a{0}'.format(i)) for i in range(8)]
+        values = [9, 7, 8, 6, 5, 7, 4, 3]
+        weights = [6, 5, 6, 4, 3, 5, 2, 2]
+        objective = quicksum(v * x for v, x in zip(values, xs))
+        constraints = [quicksum(w * x for w, x in zip(weights, xs)) <= 15]
+        incumbents = []
+        solution = BranchAndBound(quiet=True).maximize(objective, constraints, callback=incumbents.append)
+        self.assertEqual(solution.status, 'optimal')
+        self.assertEqual(solution.gap, 0.0)
+        self.assertTrue(incumbents)
+        self.assertAlmostEqual(incumbents[-1].objective_value, solution.objective_value)
+        self.assertEqual(sorted(s.objective_value for s in incumbents),
+                         [s.objective_value for s in incumbents])
+        iterated = list(BranchAndBound(quiet=True).iter_maximize(objective, constraints))
+        self.assertEqual([s.objective_value for s in iterated], [s.objective_value for s in incumbents])
+        solver = BranchAndBound(quiet=True, gap=1.0)
+        solution = solver.maximize(objective, constraints)
+        self.assertIn(solver.status, ('gap limit', 'optimal'))
+        self.assertIsNotNone(solution.gap)
+        self.assertLessEqual(solution.gap, 1.0)
+
+
+class CachedSolverTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.x1 = IntegerVariable('x1')
+        self.x2 = IntegerVariable('x2')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def fingerprint(self, objective, constraints):
+        model = Model()
+        model.add_constraints(constraints)
+        vector, constant = model.objective_vector(objective)
+        return model.fingerprint(vector, constant, False)
+
+    def test_fingerprint(self):
+        a = self.fingerprint(self.x2, [3 * self.x1 + 2 * self.x2 <= 6, -3 * self.x1 + 2 * self.x2 <= 0])
+        b = self.fingerprint(self.x2, [2 * self.x2 - 3 * self.x1 <= 0, 2 * self.x2 + 3 * self.x1 <= 6])
+        c = self.fingerprint(self.x2, [3 * self.x1 + 2 * self.x2 <= 7, -3 * self.x1 + 2 * self.x2 <= 0])
+        d = self.fingerprint(self.x1, [3 * self.x1 + 2 * self.x2 <= 6, -3 * self.x1 + 2 * self.x2 <= 0])
+        self.assertEqual(a, b)
+        self.assertNotEqual(a, c)
+        self.assertNotEqual(a, d)
+
+    def test_hit(self):
+        cache = SolutionCache(self.directory.name)
+        solver = CachedSolver(BranchAndBound(quiet=True), cache, quiet=True)
+        for constraints in [[3 * self.x1 + 2 * self.x2 <= 6, -3 * self.x1 + 2 * self.x2 <= 0],
+                            [-3 * self.x1 + 2 * self.x2 <= 0, 3 * self.x1 + 2 * self.x2 <= 6]]:
+            log = io.StringIO()
+            with contextlib.redirect_stderr(log):
+                solution = solver.maximize(self.x2, constraints)
+            ## 中のソルバはモデルを作り直さない
+            self.assertEqual(log.getvalue().count('variables:'), 1)
+            self.assertAlmostEqual(solution.objective_value, 1.0)
+            self.assertAlmostEqual(solution[self.x1], 1.0)
+            self.assertAlmostEqual(solution[self.x2], 1.0)
+            solver.solver = None
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_bounds(self):
+        cache = SolutionCache(self.directory.name)
+        solver = CachedSolver(BranchAndBound(quiet=True), cache, quiet=True)
+        for upper in (2, 7):
+            model = Model()
+            model.add_constraint(self.x1 + self.x2 <= 10)
+            model.set_bounds(self.x1, 0, upper)
+            solution = solver.maximize(self.x1, model)
+            self.assertAlmostEqual(solution.objective_value, upper)
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+
+    def test_eviction(self):
+        cache = SolutionCache(self.directory.name, max_size=150)
+        solver = CachedSolver(BranchAndBound(quiet=True), cache, quiet=True)
+        for rhs in range(1, 6):
+            solver.maximize(self.x1 + self.x2, [self.x1 + self.x2 <= rhs])
+        files = os.listdir(self.directory.name)
+        self.assertLess(len(files), 5)
+        self.assertGreater(len(files), 0)
+
+
 if __name__ == '__main__':
     main(verbosity=2)
@@ -0,0 +1,53 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from profiling import Profiler
+from milp import BranchAndBound
+from time_table import TimeTableModel
+from test_time_table import SMALL_INPUT
+from unittest import TestCase, main
+import io
+import time
+import contextlib
+
+
+class ProfilerTest(TestCase):
+    def test_nested_phases(self):
+        with Profiler() as profiler:
+            with profiler.phase('outer'):
+                time.sleep(0.02)
+                with profiler.phase('inner'):
+                    data = [0] * 100000
+                    time.sleep(0.05)
+                del data
+            with profiler.phase('inner'):
+                pass
+        self.assertEqual(profiler.phases['inner']['calls'], 2)
+        self.assertLess(profiler.phases['outer']['time'], 0.045)
+        self.assertGreaterEqual(profiler.phases['inner']['time'], 0.05)
+        self.assertGreaterEqual(profiler.phases['inner']['peak_memory'], 800000)
+        self.assertGreaterEqual(profiler.phases['outer']['peak_memory'], profiler.phases['inner']['peak_memory'])
+
+    def test_instrument_solver(self):
+        solver = BranchAndBound(quiet=True)
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            with Profiler(trace_memory=False) as profiler:
+                model = TimeTableModel(SMALL_INPUT)
+                profiler.instrument_solver(solver)
+                profiler.instrument(model, 'time_table', 'extract')
+                with profiler.phase('solve'):
+                    model.solve(solver)
+        self.assertEqual(sorted(profiler.phases), ['extract', 'read_solution', 'solve'])
+        self.assertNotIn('_read_solution', solver.__dict__)
+        self.assertEqual(model.status, 'optimal')
+        self.assertGreater(model.solution.statistics['nodes'], 0)
+        families = model.statistics()
+        self.assertIn('rooms', families)
+        self.assertIn('watch_when_held', families)
+        self.assertNotIn(None, families)
+        self.assertEqual(sum(f['rows'] for f in families.values()), model.model.num_rows)
+        self.assertEqual(sum(f['nonzeros'] for f in families.values()), model.model.num_nonzeros)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from milp import BranchAndBound
+from scoring import Scorer
+from time_table import InstanceIndex
+from test_time_table import SMALL_INPUT, solve
+from unittest import TestCase, main
+import numpy as np
+
+
+class ScorerTest(TestCase):
+    def setUp(self):
+        self.scorer = Scorer(SMALL_INPUT)
+        self.time_table = solve(SMALL_INPUT, BranchAndBound(quiet=True))
+
+    def test_timeslots(self):
+        self.assertEqual(self.scorer.timeslots, InstanceIndex(SMALL_INPUT).timeslots)
+
+    def test_score(self):
+        assignment = self.scorer.encode(self.time_table)
+        self.assertTrue(np.all(assignment >= 0))
+        self.assertAlmostEqual(self.scorer.score(assignment)[0], 3.0)
+        self.assertEqual(self.scorer.violations(assignment)[0], 0)
+
+    def test_attendance(self):
+        assignment = self.scorer.encode(self.time_table)
+        attendance = self.scorer.attendance(assignment)[0]
+        self.assertEqual(len(attendance), len(self.scorer.applicants))
+        self.assertAlmostEqual(attendance.dot(self.scorer.weights), 3.0)
+
+    def test_batch(self):
+        assignment = self.scorer.encode(self.time_table)
+        candidates = np.tile(assignment, (600, 1))
+        rng = np.random.RandomState(0)
+        for candidate in candidates[1:]:
+            i, j = rng.randint(len(assignment), size=2)
+            candidate[[i, j]] = candidate[[j, i]]
+        scores = self.scorer.score(candidates)
+        violations = self.scorer.violations(candidates)
+        self.assertEqual(scores.shape, (600,))
+        for n in range(0, 600, 37):
+            self.assertAlmostEqual(scores[n], self.scorer.score(candidates[n])[0])
+            self.assertEqual(violations[n], self.scorer.violations(candidates[n])[0])
+        self.assertTrue(np.all(scores[violations == 0] <= 3.0 + 1e-9))
+
+    def test_violations(self):
+        assignment = self.scorer.encode(self.time_table)
+        unplaced = assignment.copy()
+        unplaced[0] = -1
+        self.assertGreater(self.scorer.violations(unplaced)[0], 0)
+        ## 講座を全て同じ枠に置くと部屋数，講座担当者の重複，コマ数を破る
+        crowded = np.zeros_like(assignment)
+        self.assertGreaterEqual(self.scorer.violations(crowded)[0], 3)
+
+
+if __name__ == '__main__':
+    main(verbosity=2)
@@ -0,0 +1,146 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from service import SolveService, ServiceServer, UnixServiceServer
+from test_time_table import SMALL_INPUT
+from unittest import TestCase, main
+import os
+import json
+import time
+import tempfile
+import threading
+import http.client
+
+
+class ServiceTest(TestCase):
+    OPTIONS = {'solver': 'bnb', 'scip': None, 'format': 'lp', 'formulation': 'slot',
+               'time_limit': None, 'node_limit': 100000, 'log': False}
+
+    def setUp(self):
+        self.service = SolveService(self.OPTIONS, workers=2, timeout=10.0)
+        self.server = ServiceServer(('127.0.0.1', 0), self.service, quiet=True)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.service.shutdown()
+
+    def request(self, method, path, body=None):
+        connection = http.client.HTTPConnection(*self.server.server_address[:2], timeout=30)
+        connection.request(method, path, json.dumps(body) if body is not None else None)
+        response = connection.getresponse()
+        data = response.read().decode('utf-8')
+        connection.close()
+        return response.status, data
+
+    def test_submit_and_stream(self):
+        status, body = self.request('POST', '/jobs', {'input': SMALL_INPUT, 'options': {'formulation': 'compact'}})
+        self.assertEqual(status, 202)
+        job = json.loads(body)
+        status, duplicate = self.request('POST', '/jobs', {'input': SMALL_INPUT, 'options': {'formulation': 'compact'}})
+        self.assertEqual(json.loads(duplicate)['id'], job['id'])
+        self.assertTrue(json.loads(duplicate)['duplicate'])
+        status, body = self.request('GET', '/jobs/{0}/events'.format(job['id']))
+        events = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(events[0]['event'], 'queued')
+        self.assertIn('started', [e['event'] for e in events])
+        self.assertIn('incumbent', [e['event'] for e in events])
+        self.assertEqual(events[-1]['event'], 'done')
+        self.assertAlmostEqual(events[-1]['result']['objective'], 3.0)
+        status, body = self.request('GET', '/jobs/{0}'.format(job['id']))
+        self.assertEqual(json.loads(body)['status'], 'done')
+        status, body = self.request('POST', '/jobs', {'input': SMALL_INPUT, 'options': {'formulation': 'compact'}})
+        self.assertEqual(status, 202)
+        self.assertNotEqual(json.loads(body)['id'], job['id'])
+
+    def test_errors(self):
+        self.assertEqual(self.request('POST', '/jobs', {'input': SMALL_INPUT, 'options': {'scip': '/bin/sh'}})[0], 400)
+        self.assertEqual(self.request('GET', '/jobs/unknown')[0], 404)
+        invalid = dict(SMALL_INPUT, time_slots={'60': 1})
+        status, body = self.request('POST', '/jobs', invalid)
+        status, body = self.request('GET', '/jobs/{0}?wait=1'.format(json.loads(body)['id']))
+        self.assertEqual(json.loads(body)['status'], 'failed')
+        self.assertEqual(json.loads(body)['result']['status'], 'invalid')
+
+    def test_timeout_and_cancel(self):
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), '2013.json'), encoding='utf-8') as f:
+            large = json.load(f)
+        service = SolveService(self.OPTIONS, workers=1, timeout=0.5, grace=0.0)
+        try:
+            started = time.time()
+            running, _ = service.submit(large)
+            queued, _ = service.submit(large, {'formulation': 'compact'})
+            self.assertTrue(service.cancel(queued))
+            events = list(running.stream(timeout=30))
+            self.assertLess(time.time() - started, 20)
+            self.assertIn(events[-1]['event'], ('timeout', 'done'))
+            self.assertEqual(queued.status, 'cancelled')
+        finally:
+            service.shutdown()
+
+    def test_cancel_stops_solver(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'scip')
+            started = os.path.join(directory, 'started')
+            with open(path, 'w') as f:
+                f.write('#!/bin/sh\necho $$ "$2" > {0}.tmp\nmv {0}.tmp {0}\nexec sleep 30\n'.format(started))
+            os.chmod(path, 0o755)
+            service = SolveService(dict(self.OPTIONS, solver='scip', scip=path), workers=1, timeout=30.0)
+            try:
+                job, _ = service.submit(SMALL_INPUT)
+                deadline = time.time() + 30
+                while not os.path.exists(started) and time.time() < deadline:
+                    time.sleep(0.05)
+                with open(started) as f:
+                    pid, command = f.read().split(None, 1)
+                self.assertTrue(service.cancel(job))
+                self.assertEqual(job.status, 'cancelled')
+                ## ソルバのプロセスも止まり，作業ディレクトリも消えている
+                self.assertFalse(os.path.exists(os.path.dirname(command.split()[-1])))
+                deadline = time.time() + 10
+                while self._running(int(pid)) and time.time() < deadline:
+                    time.sleep(0.05)
+                self.assertFalse(self._running(int(pid)))
+            finally:
+                service.shutdown()
+
+    def _running(self, pid):
+        try:
+            with open('/proc/{0}/stat'.format(pid)) as f:
+                return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+        except FileNotFoundError:
+            return False
+
+    def test_job_options(self):
+        self.assertEqual(self.service.job_options({})['time_limit'], 10.0)
+        self.assertEqual(self.service.job_options({'time_limit': 60})['time_limit'], 10.0)
+        self.assertIsNone(self.service.job_options({'solver': 'heuristic'})['time_limit'])
+        self.assertEqual(self.service.job_options({'solver': 'heuristic', 'time_limit': 2})['time_limit'], 2.0)
+
+    def test_unix_socket(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'service.sock')
+            server = UnixServiceServer(path, self.service, quiet=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            try:
+                import socket
+                client = socket.socket(socket.AF_UNIX)
+                client.connect(path)
+                client.sendall(b'GET /jobs HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n')
+                response = b''
+                while True:
+                    data = client.recv(4096)
+                    if not data:
+                        break
+                    response += data
+                client.close()
+                self.assertTrue(response.startswith(b'HTTP/1.1 200'))
+                self.assertTrue(response.endswith(b'[]'))
+            finally:
+                server.shutdown()
+                server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from milp import BranchAndBound
+from time_table import find_best_time_table, score_time_table, decompose_time_table
+from time_table import TimeTableModel, TimeTableSession, apply_patch
+from benchmark import synthetic_input
+from heuristic import heuristic_time_table
+from unittest import TestCase, main
+import contextlib
+import io
+
+
+SMALL_INPUT = {
+    'time_slots': {'60': 3, '90': 2},
+    'sessions': [
+        {'name': 'day1', 'rooms': 2, 'time': 180},
+        {'name': 'day2', 'rooms': 1, 'time': 180},
+    ],
+    'participants': {
+        'alice': {'first': 'day1', 'last': 'day2'},
+        'bob': {'first': 'day1', 'last': 'day1'},
+        'carol': {'first': 'day2', 'last': 'day2'},
+        'dave': {'first': 'day1', 'last': 'day2'},
+    },
+    'courses': [
+        {'name': 'alice', 'title': 'A1', 'applicants': ['bob', 'carol'], 'times': []},
+        {'name': 'alice', 'title': 'A2', 'applicants': ['bob', 'dave'], 'times': [90]},
+        {'name': 'bob', 'title': 'B', 'applicants': ['alice', 'carol', 'dave'], 'times': []},
+        {'name': 'carol', 'title': 'C', 'applicants': ['alice', 'bob'], 'times': [60]},
+        {'name': 'dave', 'title': 'D', 'applicants': ['alice', 'carol'], 'times': []},
+    ],
+}
+
+
+def solve(input, solver, previous=None, formulation='slot'):
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        return find_best_time_table(input, solver, previous, formulation)
+
+
+class FindBestTimeTableTest(TestCase):
+    def assertValidTimeTable(self, input, time_table):
+        courses = dict(((c['name'], c['title']), c) for c in input['courses'])
+        scheduled = []
+        sessions = [s['name'] for s in input['sessions']]
+        for sid, session in enumerate(time_table):
+            self.assertIn(str(session['slot']), input['time_slots'])
+            self.assertEqual(len(session['courses']), session['time'] // session['slot'])
+            for slot in session['courses']:
+                self.assertLessEqual(len(slot), session['rooms'])
+                self.assertEqual(len(set(name for name, _ in slot)), len(slot))
+                for key in slot:
+                    course = courses[key]
+                    if course['times']:
+                        self.assertIn(session['slot'], course['times'])
+                    presence = input['participants'][course['name']]
+                    self.assertLessEqual(sessions.index(presence['first']), sid)
+                    self.assertLessEqual(sid, sessions.index(presence['last']))
+                    scheduled.append(key)
+        self.assertEqual(sorted(scheduled), sorted(courses))
+
+    def test_branch_and_bound(self):
+        solver = BranchAndBound(quiet=True)
+        time_table = solve(SMALL_INPUT, solver)
+        self.assertEqual(solver.status, 'optimal')
+        self.assertValidTimeTable(SMALL_INPUT, time_table)
+        self.assertAlmostEqual(solver.objective.dot(solver.values) + solver.constant, 3.0)
+        self.assertAlmostEqual(score_time_table(SMALL_INPUT, time_table), 3.0)
+
+    def test_compact_formulation(self):
+        solver = BranchAndBound(quiet=True)
+        time_table = solve(SMALL_INPUT, solver, formulation='compact')
+        self.assertEqual(solver.status, 'optimal')
+        self.assertValidTimeTable(SMALL_INPUT, time_table)
+        self.assertAlmostEqual(solver.objective.dot(solver.values) + solver.constant, 3.0)
+        self.assertAlmostEqual(score_time_table(SMALL_INPUT, time_table), 3.0)
+
+    def test_formulations_agree(self):
+        input = synthetic_input(8, 2, seed=1)
+        scores = []
+        for formulation in ('slot', 'compact'):
+            time_table = solve(input, BranchAndBound(quiet=True), formulation=formulation)
+            self.assertValidTimeTable(input, time_table)
+            scores.append(score_time_table(input, time_table))
+        self.assertAlmostEqual(scores[0], scores[1])
+
+    def test_decompose(self):
+        input = synthetic_input(8, 2, seed=1)
+        expected = score_time_table(input, solve(input, BranchAndBound(quiet=True)))
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            time_table = decompose_time_table(input, BranchAndBound(quiet=True), workers=2)
+        self.assertValidTimeTable(input, time_table)
+        self.assertAlmostEqual(score_time_table(input, time_table), expected)
+        ## 制限で止まった組み合わせは実行不能ではなく未解決
+        log = io.StringIO()
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(log):
+            self.assertIsNone(decompose_time_table(input, BranchAndBound(quiet=True, node_limit=0), workers=2))
+        self.assertIn('no solution (node limit), open', log.getvalue())
+        self.assertNotIn('objective: infeasible', log.getvalue())
+
+    def test_decompose_truncated(self):
+        ## 組み合わせを減らすときは上界の大きいものを残す
+        input = synthetic_input(10, 4, seed=1)
+        log = io.StringIO()
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(log):
+            decompose_time_table(input, BranchAndBound(quiet=True, node_limit=0), workers=1, max_patterns=2)
+        lines = log.getvalue().splitlines()
+        self.assertIn('patterns: 4, truncated to the 2 ', lines[0])
+        dropped = float(lines[0].rsplit(': ', 1)[1].rstrip(')'))
+        kept = [float(line.split('bound: ')[1].split(',')[0]) for line in lines if line.startswith('pattern ')]
+        self.assertEqual(len(kept), 2)
+        self.assertGreaterEqual(min(kept), dropped)
+
+    def test_heuristic(self):
+        for input in (SMALL_INPUT, synthetic_input(50, 6, seed=2)):
+            with contextlib.redirect_stdout(io.StringIO()):
+                time_table = heuristic_time_table(input, time_limit=0.2, quiet=True)
+            self.assertValidTimeTable(input, time_table)
+            if input is SMALL_INPUT:
+                self.assertAlmostEqual(score_time_table(input, time_table), 3.0)
+
+    def test_heuristic_start(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            previous = heuristic_time_table(SMALL_INPUT, time_limit=0.2, quiet=True)
+        solver = BranchAndBound(quiet=True, node_limit=0)
+        time_table = solve(SMALL_INPUT, solver, previous)
+        self.assertEqual(solver.status, 'node limit')
+        self.assertAlmostEqual(score_time_table(SMALL_INPUT, time_table), 3.0)
+
+    def test_warm_start(self):
+        previous = solve(SMALL_INPUT, BranchAndBound(quiet=True))
+        solver = BranchAndBound(quiet=True, node_limit=0)
+        time_table = solve(SMALL_INPUT, solver, previous)
+        self.assertEqual(solver.status, 'node limit')
+        self.assertEqual(time_table, previous)
+
+    def test_incumbents(self):
+        incumbents = []
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            time_table = find_best_time_table(SMALL_INPUT, BranchAndBound(quiet=True),
+                                              callback=lambda value, t: incumbents.append((value, t)))
+        self.assertTrue(incumbents)
+        self.assertAlmostEqual(incumbents[-1][0], 3.0)
+        self.assertEqual(incumbents[-1][1], time_table)
+        for _, incumbent in incumbents:
+            self.assertValidTimeTable(SMALL_INPUT, incumbent)
+
+
+class TimeTableSessionTest(TestCase):
+    def quietly(self, f, *args):
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            return f(*args)
+
+    def test_apply_patch(self):
+        patch = {'participants': {'bob': {'first': 'day1', 'last': 'day2'}},
+                 'add_applicants': [['carol', 'C', 'dave']],
+                 'remove_applicants': [['bob', 'B', 'alice']]}
+        input = apply_patch(SMALL_INPUT, patch)
+        self.assertEqual(input['participants']['bob']['last'], 'day2')
+        self.assertEqual(input['courses'][3]['applicants'], ['alice', 'bob', 'dave'])
+        self.assertEqual(input['courses'][2]['applicants'], ['carol', 'dave'])
+        self.assertEqual(SMALL_INPUT['participants']['bob']['last'], 'day1')
+
+    def test_update_rebuilds_affected_fragments(self):
+        model = self.quietly(TimeTableModel, SMALL_INPUT)
+        input = apply_patch(SMALL_INPUT, {'add_applicants': [['carol', 'C', 'dave']]})
+        self.assertEqual(self.quietly(model.update, input), 1)
+        fresh = self.quietly(TimeTableModel, input)
+        self.assertEqual(model.model.num_rows, fresh.model.num_rows)
+        self.assertEqual(model.model.num_nonzeros, fresh.model.num_nonzeros)
+        self.assertEqual(self.quietly(model.update, input), 0)
+
+    def test_resolve(self):
+        session = TimeTableSession(SMALL_INPUT, BranchAndBound(quiet=True))
+        self.assertAlmostEqual(score_time_table(SMALL_INPUT, self.quietly(session.solve)), 3.0)
+        patch = {'participants': {'bob': {'first': 'day1', 'last': 'day2'}}}
+        time_table = self.quietly(session.apply, patch)
+        input = apply_patch(SMALL_INPUT, patch)
+        expected = score_time_table(input, solve(input, BranchAndBound(quiet=True)))
+        self.assertAlmostEqual(score_time_table(input, time_table), expected)
+
+
+if __name__ == '__main__':
+    main(verbosity=2)
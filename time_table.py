@@ -1,207 +1,683 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
+import io
+import os
 import sys
+import copy
 import json
-from milp import SCIP, CPLEX, BinaryVariable
+import heapq
+import contextlib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from milp import SCIP, CPLEX, BranchAndBound, scip_portfolio, SolutionCache, CachedSolver
+from milp import LinearExpression, Model, VariableArray, VariableDict, quicksum
+from scoring import Scorer
 
-import sys
-sys.stdin = open(sys.stdin.fileno(), 'r', encoding='utf-8')
-sys.stdout = open(sys.stdout.fileno(), 'w', encoding='utf-8')
-sys.stderr = open(sys.stderr.fileno(), 'w', encoding='utf-8')
-
-def read_input_file(filename):
+def read_input_file(filename, cache=None):
+    # cache があれば検査済みの入力を instance.Instance として保存しておき，次からは読むだけにする
+    ## 小さい入力は JSON をそのまま読む
+    if cache is not None:
+        from instance import CACHE_MIN_SIZE, compile_input_file
+        if os.path.getsize(filename) >= CACHE_MIN_SIZE:
+            return compile_input_file(filename, cache).to_input()
     with open(filename, encoding='utf8') as f:
-        input = json.loads(f.read())
-        # 講座数は正しい？
-        all_time_slots_num = sum(input['time_slots'].values())
-        if len(input['courses']) != all_time_slots_num:
-            print('Error: 講座数({0})と枠数({1})が一致しません'.format(len(input['courses']),
-                                                                       all_time_slots_num),
-                  file=sys.stderr)
-            exit(-1)
-        # 時間は足りているか？
-        total_times = 0
-        for session in input['sessions']:
-            total_times += session['time'] * session['rooms']
-        necessary_time = sum(int(slot) * num for slot, num in input['time_slots'].items())
-        if necessary_time > total_times:
-            print('Error: 講座が多すぎます ({0} > {1})'.format(necessary_time, total_times),
+        return check_input(json.loads(f.read()))
+
+
+def check_input(input):
+    # 講座数は正しい？
+    all_time_slots_num = sum(input['time_slots'].values())
+    if len(input['courses']) != all_time_slots_num:
+        print('Error: 講座数({0})と枠数({1})が一致しません'.format(len(input['courses']),
+                                                                   all_time_slots_num),
+              file=sys.stderr)
+        exit(-1)
+    # 時間は足りているか？
+    total_times = 0
+    for session in input['sessions']:
+        total_times += session['time'] * session['rooms']
+    necessary_time = sum(int(slot) * num for slot, num in input['time_slots'].items())
+    if necessary_time > total_times:
+        print('Error: 講座が多すぎます ({0} > {1})'.format(necessary_time, total_times),
+              file=sys.stderr)
+        exit(-1)
+    # 講座担当者は出欠を書いているか
+    for course in input['courses']:
+        if course['name'] not in input['participants']:
+            print('Error: 講座担当者 {0} さんが出欠を書いていません'.format(course['name']),
                   file=sys.stderr)
             exit(-1)
-        # 講座担当者は出欠を書いているか
-        for course in input['courses']:
-            if course['name'] not in input['participants']:
-                print('Error: 講座担当者 {0} さんが出欠を書いていません'.format(course['name']),
+    # 見たい人に名前を書いている人は出欠を書いているか
+    participants = input['participants']
+    for applicant in set(a for course in input['courses'] for a in course['applicants']):
+        if applicant not in participants:
+            print('Warning: 講座見たい人 {0} さんが出欠を書いていません'.format(applicant), file=sys.stderr)
+    # セッションの時間は講座枠の倍数にしておいて下さい
+    times = set(session['time'] for session in input['sessions'])
+    for time in input['time_slots'].keys():
+        for stime in sorted(times):
+            if stime % int(time):
+                print('セッション({0})の時間は講座時間({1})の倍数にして下さい'.format(stime, time),
                       file=sys.stderr)
                 exit(-1)
-        # 見たい人に名前を書いている人は出欠を書いているか
-        for applicant in set.union(*[set(course['applicants']) for course in input['courses']]):
-            if applicant not in input['participants']:
-                print('Warning: 講座見たい人 {0} さんが出欠を書いていません'.format(applicant), file=sys.stderr)
-        # セッションの時間は講座枠の倍数にしておいて下さい
-        for session in input['sessions']:
-            for time in input['time_slots'].keys():
-                if session['time'] % int(time):
-                    print('セッション({0})の時間は講座時間({1})の倍数にして下さい'.format(session['time'], time),
-                          file=sys.stderr)
-                    exit(-1)
-        return input
-
-
-def find_best_time_table(input, solver):
-    # timeslots 列挙
-    timeslots = []
-    for time in map(int, input['time_slots'].keys()):
-        for i, session in enumerate(input['sessions']):
-            for j in range(session['time'] // time):
-                timeslots.append((time, i, j))
-    # 変数作成 (全てバイナリ変数)
-    ## Xがidの講座を時間Tに見れるかどうか
-    w = {}
-    for applicant in set.union(*[set(course['applicants']) for course in input['courses']]):
-        w[applicant] = {}
-        for cid, course in enumerate(input['courses']):
-            if applicant not in course['applicants']:
-                continue
-            w[applicant][cid] = {}
-            for slot in timeslots:
-                v = BinaryVariable('w_{{{0},{1},{2}}}'.format(applicant, cid, slot))
-                w[applicant][cid][slot] = v
-    ## 誰がどの時間に講座をするか
-    c = {}
+    return input
+
+
+def warm_start_values(input, previous, w, c, s):
+    start = VariableDict()
+    session_names = [session['name'] for session in input['sessions']]
+    course_ids = {}
     for cid, course in enumerate(input['courses']):
-        c[cid] = {}
-        for slot in timeslots:
-            v = BinaryVariable('c_{{{0},{1}}}'.format(cid, slot))
-            c[cid][slot] = v
-    ## セッション内の講座時間
-    s = {}
-    for sid, session in enumerate(input['sessions']):
-        s[sid] = {}
-        for time in input['time_slots'].keys():
-            time = int(time)
-            s[sid][int(time)] = BinaryVariable('s_{{{0},{1}}}'.format(sid, time))
-    # 目的関数
-    objective = 0
+        course_ids.setdefault((course['name'], course['title']), []).append(cid)
+    ## 前回の時間割から各講座の枠を復元
+    course_slots = {}
+    for session in previous:
+        if session['name'] not in session_names:
+            continue
+        sid = session_names.index(session['name'])
+        t = session.get('slot')
+        if t not in s[sid]:
+            continue
+        for time in s[sid]:
+            start[s[sid][time]] = 1.0 if time == t else 0.0
+        for i, courses in enumerate(session['courses']):
+            for name, title in courses:
+                if course_ids.get((name, title)):
+                    course_slots[course_ids[(name, title)].pop(0)] = (t, sid, i)
+    for cid in c:
+        for slot, v in c[cid].items():
+            start[v] = 1.0 if course_slots.get(cid) == slot else 0.0
+    ## 見れる講座は各枠で1つだけ見ることにする
     for applicant in w:
+        presence = input['participants'].get(applicant)
+        if presence is None:
+            continue
+        first_sid = session_names.index(presence['first'])
+        last_sid = session_names.index(presence['last'])
+        busy = set(slot for cid, slot in course_slots.items()
+                   if input['courses'][cid]['name'] == applicant)
         for cid in w[applicant]:
-            objective += (1.0 / len(w[applicant].keys())) * sum(w[applicant][cid].values())
-    # 制約
-    constraints = []
-    ## 講座の時間は各セッション内では全て同じ
-    for sid in s:
-        constraints.append(sum(s[sid].values()) <= 1)
-    ## n分講座があればそのセッション内の講座は全てn分
-    for cid in c:
-        for cslot in c[cid]:
-            for sid in s:
-                if sid != cslot[1]:
+            if not isinstance(w[applicant][cid], dict):
+                ## compact: 時間によらない変数
+                slot = course_slots.get(cid)
+                watch = (slot is not None and slot not in busy and
+                         first_sid <= slot[1] <= last_sid)
+                if watch:
+                    busy.add(slot)
+                start[w[applicant][cid]] = 1.0 if watch else 0.0
+                continue
+            for slot, v in w[applicant][cid].items():
+                watch = (course_slots.get(cid) == slot and slot not in busy and
+                         first_sid <= slot[1] <= last_sid)
+                if watch:
+                    busy.add(slot)
+                start[v] = 1.0 if watch else 0.0
+    return start
+
+
+class InstanceIndex(object):
+    # 入力から一度だけ作る索引 (制約生成で線形時間に引けるように)
+    def __init__(self, input, lengths=None):
+        ## timeslots 列挙 (lengths があればセッションごとの講座時間を固定)
+        self.timeslots = []
+        self.slots_by_session = {}
+        self.slots_by_length = {}
+        for time in map(int, input['time_slots'].keys()):
+            self.slots_by_length[time] = []
+            for i, session in enumerate(input['sessions']):
+                if lengths is not None and lengths[i] != time:
                     continue
-                constraints.append(c[cid][cslot] <= s[sid][cslot[0]])
-    ## 部屋数より多い講座は無理
-    for slot in timeslots:
-        session_id = slot[1]
-        rooms = input['sessions'][session_id]['rooms']
-        constraints.append(sum(c[n][slot] for n in c) <= rooms)
-    ## 1人の講座は1回だけ
-    for cid in c:
-        constraints.append(sum(c[cid].values()) == 1)
+                for j in range(session['time'] // time):
+                    slot = (time, i, j)
+                    self.timeslots.append(slot)
+                    self.slots_by_session.setdefault(i, []).append(slot)
+                    self.slots_by_length[time].append(slot)
+        ## 参加者がいつ花背にいるのか (セッション番号の範囲)
+        self.session_names = [session['name'] for session in input['sessions']]
+        session_ids = {name: sid for sid, name in enumerate(self.session_names)}
+        self.first_sid = {}
+        self.last_sid = {}
+        for name, p in input['participants'].items():
+            self.first_sid[name] = session_ids[p['first']]
+            self.last_sid[name] = session_ids[p['last']]
+        ## 講座担当者ごとの講座
+        self.courses_by_lecturer = {}
+        for cid, course in enumerate(input['courses']):
+            self.courses_by_lecturer.setdefault(course['name'], []).append(cid)
+        ## 受講希望者ごとの講座
+        self.courses_by_applicant = {}
+        for cid, course in enumerate(input['courses']):
+            for applicant in course['applicants']:
+                self.courses_by_applicant.setdefault(applicant, []).append(cid)
+        ## 講座を行える時間 (cid, slot)
+        ## - 花背に存在しなければ講座担当できない
+        ## - 希望時間 (強制)
+        self.allowed_slots = {}
+        for cid, course in enumerate(input['courses']):
+            first_sid = self.first_sid[course['name']]
+            last_sid = self.last_sid[course['name']]
+            times = course['times']
+            self.allowed_slots[cid] = [slot
+                                       for sid in range(first_sid, last_sid + 1)
+                                       for slot in self.slots_by_session.get(sid, [])
+                                       if not times or slot[0] in times]
+
+    def present(self, name, sid):
+        return self.first_sid[name] <= sid <= self.last_sid[name]
+
+
+def add_slot_viewer_constraints(model, w, c, teaching):
     ## 同じ時間帯に複数の講座を見ることはできない
-    for applicant in w:
-        for slot in timeslots:
-            constraints.append(sum(w[applicant][cid][slot] for cid in w[applicant]) <= 1)
+    watching_at = {}
+    for cid in w:
+        for slot, v in w[cid].items():
+            watching_at.setdefault(slot, []).append(v)
+    with model.family('one_course_at_a_time'):
+        for watching in watching_at.values():
+            if len(watching) > 1:
+                model.add_constraint(quicksum(watching) <= 1)
     ## 同じ講座は1回しか見ない
-    for applicant in w:
-        for cid in w[applicant]:
-            constraints.append(sum(w[applicant][cid].values()) <= 1)
-    ## input['time_slots'] に従ってコマ数設定
-    for t, n in input['time_slots'].items():
-        t = int(t)
-        lhs = 0.0
-        for cid in c:
-            for cslot in c[cid]:
-                if cslot[0] == t:
-                    lhs += c[cid][cslot]
-        constraints.append(lhs == n)
-    ## 同じ人が同一時間帯に複数の講座を持つことはできない
-    for cid1, course1 in enumerate(input['courses']):
-        for cid2, course2 in list(enumerate(input['courses']))[cid1 + 1:]:
-            if course1['name'] == course2['name']:
-                for slot in timeslots:
-                    constraints.append(c[cid1][slot] + c[cid2][slot] <= 1)
-    ## 参加者がいつ花背にいるのか
-    participants_first_sid = {}
-    participants_last_sid = {}
-    session_names = [s['name'] for s in input['sessions']]
-    for name in input['participants']:
-        p = input['participants'][name]
-        participants_first_sid[name] = session_names.index(p['first'])
-        participants_last_sid[name] = session_names.index(p['last'])
-    ## 花背に存在しなければ講座担当できない
-    for cid, course in enumerate(input['courses']):
-        name = course['name']
-        first_sid = participants_first_sid[name]
-        last_sid = participants_last_sid[name]
-        for slot in timeslots:
-            sid = slot[1]
-            if sid < first_sid or last_sid < sid:
-                constraints.append(c[cid][slot] == 0)
-    ## 希望時間 (強制)
-    for cid, course in enumerate(input['courses']):
-        times = course['times']
-        if not times:
-            continue
-        for slot in timeslots:
-            if slot[0] not in times:
-                constraints.append(c[cid][slot] == 0)
+    with model.family('watch_once'):
+        for cid in w:
+            if len(w[cid]) > 1:
+                model.add_constraint(quicksum(w[cid].values()) <= 1)
     ## 講座を見れる条件 (applicant, cid, slot)
-    ## - slot の時刻にapplicantが花背にいなければ無理
     ## - slot の時刻にcidの講座が行なわれていなければダメ
     ## - slot の時刻にapplicantの講座が行われているとダメ
-    for applicant in w:
-        for cid in w[applicant]:
-            for slot in timeslots:
-                sid = slot[1]
-                v = w[applicant][cid][slot]
-                if (sid < participants_first_sid[applicant] or
-                    participants_last_sid[applicant] < sid):
-                    constraints.append(v == 0)
+    viewers, lectures = [], []
+    with model.family('not_while_teaching'):
+        for cid in w:
+            for slot, v in w[cid].items():
+                viewers.append(v)
+                lectures.append(c[cid][slot])
+                for lecture in teaching.get(slot, ()):
+                    model.add_constraint(v <= 1 - lecture)
+    ## v <= c[cid][slot] はまとめて追加
+    n = len(viewers)
+    with model.family('watch_when_held'):
+        model.add_constraint_block(np.repeat(np.arange(n), 2),
+                                   np.stack([model.columns(viewers), model.columns(lectures)], axis=1),
+                                   np.tile([1.0, -1.0], n), '<=', np.zeros(n))
+
+
+def add_compact_viewer_constraints(model, w, c, watchable, teaching):
+    courses_at = {}
+    ## applicantが花背にいる間にcidの講座が行なわれなければダメ
+    with model.family('watch_when_held'):
+        for cid, slots in watchable.items():
+            for slot in slots:
+                courses_at.setdefault(slot, []).append(cid)
+            if len(slots) < len(c[cid]):
+                model.add_constraint(w[cid] <= quicksum(c[cid][slot] for slot in slots))
+    ## 自分の講座と同じ時間に行なわれるとダメ
+    with model.family('not_while_teaching'):
+        for cid, slots in watchable.items():
+            for slot in slots:
+                if slot in teaching:
+                    model.add_constraint(w[cid] + c[cid][slot] + quicksum(teaching[slot]) <= 2)
+    ## 見たい講座が同じ時間に行なわれれば片方しか見れない
+    with model.family('one_course_at_a_time'):
+        for slot, cids in courses_at.items():
+            for i, cid1 in enumerate(cids):
+                for cid2 in cids[i + 1:]:
+                    model.add_constraint(w[cid1] + w[cid2] + c[cid1][slot] + c[cid2][slot] <= 3)
+
+
+class TimeTableModel(object):
+    # 時間割の MILP モデル
+    ## 制約はセッション・講座・枠・受講希望者ごとの断片に分けて作り，
+    ## 入力が変わったら依存する値 (signature) の変わった断片だけを作り直す
+    def __init__(self, input, formulation='slot', lengths=None):
+        self.formulation = formulation
+        self.lengths = lengths
+        self.fragments = {}
+        self.update(input)
+
+    def update(self, input):
+        self.input = input
+        self.index = index = InstanceIndex(input, self.lengths)
+        # 変数作成 (全てバイナリ変数, 取りうる組み合わせのみ)
+        ## 誰がどの時間に講座をするか
+        ## 変数は VariableArray (講座 × timeslot など) で宣言し，制約生成用に辞書からも引けるようにする
+        courses = range(len(input['courses']))
+        self.C = VariableArray('c_{{{0},{1}}}', [courses, index.timeslots],
+                               [(cid, slot) for cid in courses for slot in index.allowed_slots[cid]])
+        self.c = c = dict((cid, {}) for cid in courses)
+        self.lectures_at = {slot: [] for slot in index.timeslots}
+        for (cid, slot), v in self.C:
+            c[cid][slot] = v
+            self.lectures_at[slot].append(v)
+        ## セッション内の講座時間
+        self.S = VariableArray('s_{{{0},{1}}}', [range(len(input['sessions'])),
+                                                 [int(time) for time in input['time_slots'].keys()]])
+        self.s = s = {}
+        for (sid, time), v in self.S:
+            s.setdefault(sid, {})[time] = v
+        ## 受講希望者が講座を見れる timeslot (花背にいて講座が行なわれ得る時間，自分の講座は除く)
+        self.watchable = {}
+        for applicant, cids in index.courses_by_applicant.items():
+            self.watchable[applicant] = {}
+            for cid in cids:
+                if input['courses'][cid]['name'] == applicant:
                     continue
-                constraints.append(v <= c[cid][slot])
-                for cid2, course in enumerate(input['courses']):
-                    if course['name'] == applicant:
-                        constraints.append(v <= 1 - c[cid2][slot])
-    # ソルバで求解
-    solution = solver.maximize(objective, constraints)
-    time_table = []
-    if solution:
-        print('objective value: {0}'.format(solution.objective_value))
+                slots = [slot for slot in index.allowed_slots[cid] if index.present(applicant, slot[1])]
+                if slots:
+                    self.watchable[applicant][cid] = slots
+        ## 誰がどの講座を見るか (formulation == 'compact' なら timeslot の添字なし)
+        applicants = list(index.courses_by_applicant)
+        if self.formulation == 'compact':
+            self.W = VariableArray('w_{{{0},{1}}}', [applicants, courses],
+                                   [(a, cid) for a in applicants for cid in self.watchable[a]])
+        else:
+            self.W = VariableArray('w_{{{0},{1},{2}}}', [applicants, courses, index.timeslots],
+                                   [(a, cid, slot) for a in applicants
+                                    for cid, slots in self.watchable[a].items() for slot in slots])
+        self.viewers = dict((applicant, {}) for applicant in applicants)
+        if self.formulation == 'compact':
+            for (applicant, cid), v in self.W:
+                self.viewers[applicant][cid] = v
+        else:
+            for (applicant, cid, slot), v in self.W:
+                self.viewers[applicant].setdefault(cid, {})[slot] = v
+        ## 断片ごとの signature
+        sessions = tuple((session['name'], session['rooms'], session['time']) for session in input['sessions'])
+        allowed = tuple(tuple(index.allowed_slots[cid]) for cid in c)
+        signatures = {('sessions',): (sessions, tuple(input['time_slots'].keys()), self.lengths),
+                      ('slots',): (sessions, allowed, tuple(sorted(input['time_slots'].items())),
+                                   tuple(course['name'] for course in input['courses']))}
+        for cid in c:
+            signatures[('course', cid)] = allowed[cid]
+        for applicant, cids in index.courses_by_applicant.items():
+            wishes = tuple((cid, input['courses'][cid]['name'] == applicant,
+                            tuple(slot for slot in allowed[cid] if index.present(applicant, slot[1])))
+                           for cid in cids)
+            teaching = tuple((cid, allowed[cid]) for cid in index.courses_by_lecturer.get(applicant, ()))
+            signatures[('applicant', applicant)] = (wishes, teaching)
+        ## 変わった断片だけ作り直す
+        rebuilt = 0
+        for key in list(self.fragments):
+            if key not in signatures:
+                del self.fragments[key]
+        for key, signature in signatures.items():
+            if key in self.fragments and self.fragments[key][0] == signature:
+                continue
+            self.fragments[key] = (signature,) + getattr(self, '_build_' + key[0])(*key[1:])
+            rebuilt += 1
+        self.w = dict((key[1], fragment[3]) for key, fragment in self.fragments.items()
+                      if key[0] == 'applicant')
+        # 目的関数と制約をまとめる
+        self.objective = LinearExpression()
+        self.model = Model()
+        for key in sorted(self.fragments, key=str):
+            _, model, objective, _ = self.fragments[key]
+            self.objective += objective
+            self.model.add_model(model)
+        print('model: rebuilt {0}/{1} fragments'.format(rebuilt, len(signatures)), file=sys.stderr)
+        return rebuilt
+
+    def statistics(self):
+        # 制約族 (制約を追加するときに model.family で付けた名前) ごとの制約・非零要素・変数の数
+        return self.model.family_statistics()
+
+    def _build_sessions(self):
+        model = Model()
+        s = self.s
+        ## 講座の時間は各セッション内では全て同じ
+        with model.family('one_length_per_session'):
+            for sid in s:
+                model.add_constraint(quicksum(s[sid].values()) <= 1)
+        ## 講座時間が固定されていれば従う
+        if self.lengths is not None:
+            with model.family('fixed_length'):
+                for sid in s:
+                    model.add_constraint(s[sid][self.lengths[sid]] == 1)
+        return model, LinearExpression(), None
+
+    def _build_course(self, cid):
+        model = Model()
+        c, s = self.c, self.s
+        ## n分講座があればそのセッション内の講座は全てn分
+        with model.family('session_length'):
+            for cslot in c[cid]:
+                model.add_constraint(c[cid][cslot] <= s[cslot[1]][cslot[0]])
+        ## 1人の講座は1回だけ
+        with model.family('course_once'):
+            model.add_constraint(quicksum(c[cid].values()) == 1)
+        return model, LinearExpression(), None
+
+    def _build_slots(self):
+        model = Model()
+        input, index, c = self.input, self.index, self.c
+        ## 部屋数より多い講座は無理
+        with model.family('rooms'):
+            for slot in index.timeslots:
+                rooms = input['sessions'][slot[1]]['rooms']
+                if len(self.lectures_at[slot]) > rooms:
+                    model.add_constraint(quicksum(self.lectures_at[slot]) <= rooms)
+        ## input['time_slots'] に従ってコマ数設定
+        with model.family('slot_count'):
+            for t, n in input['time_slots'].items():
+                model.add_constraint(quicksum(v for slot in index.slots_by_length[int(t)]
+                                              for v in self.lectures_at[slot]) == n)
+        ## 同じ人が同一時間帯に複数の講座を持つことはできない
+        with model.family('one_course_per_lecturer'):
+            for name in index.courses_by_lecturer:
+                for teaching in self._teaching_at(name).values():
+                    if len(teaching) > 1:
+                        model.add_constraint(quicksum(teaching) <= 1)
+        return model, LinearExpression(), None
+
+    def _teaching_at(self, name):
+        teaching = {}
+        for cid in self.index.courses_by_lecturer.get(name, ()):
+            for slot, v in self.c[cid].items():
+                teaching.setdefault(slot, []).append(v)
+        return teaching
+
+    def _build_applicant(self, applicant):
+        ## Xがidの講座を見れるかどうか
+        ## - slot の時刻にapplicantが花背にいなければ無理
+        ## - slot の時刻にcidの講座が行なわれ得なければダメ
+        ## - 自分の講座は見ない
+        ## formulation == 'slot': 時間T毎に変数を作る w[applicant][cid][slot]
+        ## formulation == 'compact': 時間によらず1つ w[applicant][cid]
+        cids = self.index.courses_by_applicant[applicant]
+        w = self.viewers[applicant]
+        watchable = self.watchable[applicant]
+        # 目的関数
+        objective = LinearExpression()
+        weight = 1.0 / len(cids)
+        for cid in w:
+            if self.formulation == 'compact':
+                objective += weight * w[cid]
+            else:
+                objective += weight * quicksum(w[cid].values())
+        # 制約
+        model = Model()
+        teaching = self._teaching_at(applicant)
+        if self.formulation == 'compact':
+            add_compact_viewer_constraints(model, w, self.c, watchable, teaching)
+        else:
+            add_slot_viewer_constraints(model, w, self.c, teaching)
+        return model, objective, w
+
+    def time_table(self, solution):
+        # 解から時間割を作る
+        ## 講座 × timeslot の配置を1つの配列にしてから，セッションごとに切り出す
+        input = self.input
+        placed = np.zeros(self.C.shape, dtype=bool)
+        placed[self.C.nonzero(solution)] = True
+        chosen = np.zeros(self.S.shape, dtype=bool)
+        chosen[self.S.nonzero(solution)] = True
+        lengths = self.S.index_sets[1]
+        timeslots = self.C.index_sets[1]
+        time_table = []
         for sid, session in enumerate(input['sessions']):
             sname = session['name']
             rooms = session['rooms']
             stime = session['time']
             ret = {'name': sname, 'rooms': rooms, 'time': stime, 'courses': []}
-            for t in s[sid]:
-                if solution[s[sid][t]]:
-                    ret['slot'] = t
-                    for i in range(stime // t):
-                        courses = []
-                        slot = (t, sid, i)
-                        for cid in c:
-                            if solution[c[cid][slot]]:
-                                courses.append((input['courses'][cid]['name'], input['courses'][cid]['title']))
-                        ret['courses'].append(courses)
+            for k in np.flatnonzero(chosen[sid]).tolist():
+                t = lengths[k]
+                ret['slot'] = t
+                for i in range(stime // t):
+                    column = self.C.index_of((t, sid, i), axis=1)
+                    cids = np.flatnonzero(placed[:, column]).tolist() if column is not None else []
+                    ret['courses'].append([(input['courses'][cid]['name'], input['courses'][cid]['title'])
+                                           for cid in cids])
             time_table.append(ret)
-        for applicant in w:
-            for cid in w[applicant]:
-                if all(not solution[w[applicant][cid][slot]] for slot in w[applicant][cid]):
+        return time_table
+
+    def solve(self, solver, previous=None, callback=None):
+        input, index, c, s, w = self.input, self.index, self.c, self.s, self.w
+        # ソルバで求解 (前回の時間割があれば初期解として渡す)
+        ## callback があれば，求解中に見つかった暫定解の時間割を (目的関数値, 時間割) で渡す
+        start = None
+        if previous is not None:
+            start = warm_start_values(input, previous, w, c, s)
+        incumbent = None
+        if callback is not None:
+            incumbent = lambda solution: callback(solution.objective_value, self.time_table(solution))
+        solution = solver.maximize(self.objective, self.model, start=start, callback=incumbent)
+        ## 時間やギャップの制限で止まったときは最適とは限らない
+        self.solution = solution
+        self.status = solution.status if solution else None
+        if solution:
+            print('objective value: {0}'.format(solution.objective_value))
+            if solution.status not in (None, 'optimal'):
+                gap = '' if solution.gap is None else ', gap: {0:.4%}'.format(solution.gap)
+                print('status: {0}{1}'.format(solution.status, gap), file=sys.stderr)
+            time_table = self.time_table(solution)
+            ## 見れる (受講希望者, 講座) の組を配列で求め，見れない希望だけを表示する
+            watched = np.zeros(self.W.shape[:2], dtype=bool)
+            watched[self.W.nonzero(solution)[:2]] = True
+            for a, (applicant, cids) in enumerate(index.courses_by_applicant.items()):
+                for cid in np.array(cids)[~watched[a, cids]].tolist():
                     print('{0} さんは {1} さんの {2} という講座を見れません'.format(applicant,
                                                                                     input['courses'][cid]['name'],
                                                                                     input['courses'][cid]['title']))
 
+            return time_table
+
+
+def find_best_time_table(input, solver, previous=None, formulation='slot', lengths=None, callback=None):
+    return TimeTableModel(input, formulation, lengths).solve(solver, previous, callback)
+
+
+def apply_patch(input, patch):
+    # 入力への小さな変更を適用した新しい入力を返す
+    ## patch のキー:
+    ## - 'time_slots': {時間: コマ数} (上書き)
+    ## - 'sessions': {セッション名: {'rooms': 部屋数, 'time': 時間}} (上書き)
+    ## - 'participants': {名前: {'first': ..., 'last': ...} または None (削除)}
+    ## - 'remove_courses': [[講師, タイトル], ...]
+    ## - 'add_courses': [講座, ...] (末尾に追加)
+    ## - 'update_courses': [{'name': 講師, 'title': タイトル, 変更するキー: 値, ...}, ...]
+    ## - 'add_applicants' / 'remove_applicants': [[講師, タイトル, 受講希望者], ...]
+    input = copy.deepcopy(input)
+    input['time_slots'].update(patch.get('time_slots', {}))
+    sessions = dict((session['name'], session) for session in input['sessions'])
+    for name, update in patch.get('sessions', {}).items():
+        sessions[name].update(update)
+    for name, presence in patch.get('participants', {}).items():
+        if presence is None:
+            input['participants'].pop(name, None)
+        else:
+            input['participants'][name] = presence
+    removed = [tuple(key) for key in patch.get('remove_courses', [])]
+    input['courses'] = [course for course in input['courses'] if (course['name'], course['title']) not in removed]
+    input['courses'].extend(copy.deepcopy(patch.get('add_courses', [])))
+    courses = dict(((course['name'], course['title']), course) for course in input['courses'])
+    for update in patch.get('update_courses', []):
+        courses[(update['name'], update['title'])].update(update)
+    for name, title, applicant in patch.get('add_applicants', []):
+        if applicant not in courses[(name, title)]['applicants']:
+            courses[(name, title)]['applicants'].append(applicant)
+    for name, title, applicant in patch.get('remove_applicants', []):
+        if applicant in courses[(name, title)]['applicants']:
+            courses[(name, title)]['applicants'].remove(applicant)
+    return input
+
+
+class TimeTableSession(object):
+    # 作ったモデルを保持しておき，入力の変更後は前回の時間割を初期解にして解き直す
+    def __init__(self, input, solver, formulation='slot'):
+        self.input = input
+        self.solver = solver
+        self.model = TimeTableModel(input, formulation)
+        self.time_table = None
+
+    def solve(self):
+        time_table = self.model.solve(self.solver, self.time_table)
+        if time_table:
+            self.time_table = time_table
         return time_table
 
+    def update(self, input):
+        self.input = input
+        self.model.update(input)
+        return self.solve()
+
+    def apply(self, patch):
+        return self.update(apply_patch(self.input, patch))
+
+
+def slot_length_patterns(input, index):
+    # 各セッションの講座時間の組み合わせ (time_slots のコマ数を満たせるもの) を列挙
+    lengths = sorted(map(int, input['time_slots'].keys()))
+    required = dict((int(t), n) for t, n in input['time_slots'].items())
+    sessions = input['sessions']
+    capacity = [dict((t, session['rooms'] * (session['time'] // t)) for t in lengths)
+                for session in sessions]
+    ## 残りのセッションを全てtにしても足りなければ打ち切り
+    remaining = [dict((t, sum(c[t] for c in capacity[sid:])) for t in lengths)
+                 for sid in range(len(sessions) + 1)]
+
+    def extend(pattern, assigned):
+        sid = len(pattern)
+        if any(assigned[t] + remaining[sid][t] < required[t] for t in lengths):
+            return
+        if sid == len(sessions):
+            ## 全ての講座がどこかの枠で行なえること
+            if all(any((pattern[i], i) in slots for i in range(len(sessions)))
+                   for slots in course_sessions):
+                yield tuple(pattern)
+            return
+        for t in lengths:
+            assigned[t] += capacity[sid][t]
+            yield from extend(pattern + [t], assigned)
+            assigned[t] -= capacity[sid][t]
+
+    course_sessions = [set((slot[0], slot[1]) for slot in index.allowed_slots[cid])
+                       for cid in range(len(input['courses']))]
+    yield from extend([], dict((t, 0) for t in lengths))
+
+
+def pattern_upper_bound(input, index, lengths):
+    # 講座時間を固定したときの目的関数値の上界
+    ## 各人が見れるのは「見れる可能性のある講座数」と「いる間の枠数」の小さい方まで
+    bound = 0.0
+    for applicant, cids in index.courses_by_applicant.items():
+        watchable = 0
+        for cid in cids:
+            if input['courses'][cid]['name'] == applicant:
+                continue
+            if any(slot[0] == lengths[slot[1]] and index.present(applicant, slot[1])
+                   for slot in index.allowed_slots[cid]):
+                watchable += 1
+        slots = sum(input['sessions'][sid]['time'] // lengths[sid]
+                    for sid in range(index.first_sid[applicant], index.last_sid[applicant] + 1))
+        bound += min(watchable, slots) / len(cids)
+    return bound
+
+
+def solve_pattern(input, solver, formulation, lengths):
+    # 時間割と求解の状態 (時間割が無ければ，実行不能 'infeasible' か制限で止まったかをソルバの状態で返す)
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        model = TimeTableModel(input, formulation, lengths)
+        time_table = model.solve(solver)
+    return time_table, model.status if time_table is not None else solver.status
+
+
+def decompose_time_table(input, solver, workers=None, gap=0.0, formulation='slot', max_patterns=4096):
+    # 講座時間の組み合わせごとに部分問題を並列に解く (ソルバの時間制限は組み合わせごとにかかる)
+    ## 上界の大きい順に解き，上界が暫定解の (1 + gap) 倍以下の組み合わせは解かない
+    ## 組み合わせが max_patterns 個より多ければ，上界の大きい max_patterns 個だけを解く
+    index = InstanceIndex(input)
+    workers = workers or os.cpu_count()
+    patterns = []
+    total = 0
+    dropped = 0.0
+    for lengths in slot_length_patterns(input, index):
+        pattern = (pattern_upper_bound(input, index, lengths), total, lengths)
+        total += 1
+        if len(patterns) < max_patterns:
+            heapq.heappush(patterns, pattern)
+        elif pattern[0] > patterns[0][0]:
+            dropped = max(dropped, heapq.heapreplace(patterns, pattern)[0])
+        else:
+            dropped = max(dropped, pattern[0])
+    complete = total == len(patterns)
+    patterns = [(bound, lengths) for bound, _, lengths in sorted(patterns, key=lambda p: (-p[0], p[1]))]
+    if complete:
+        print('decomposition: patterns: {0}'.format(total), file=sys.stderr)
+    else:
+        print('decomposition: patterns: {0}, truncated to the {1} with the largest bounds '
+              '(largest dropped bound: {2:.4f})'.format(total, len(patterns), dropped), file=sys.stderr)
+    best, best_time_table = None, None
+    ## 数が多くて解かなかった組み合わせの上界
+    open_bound = dropped
+    solved = opened = 0
+    with ProcessPoolExecutor(workers) as executor:
+        queue = list(reversed(patterns))
+        running = {}
+        while queue or running:
+            while queue and len(running) < workers:
+                bound, lengths = queue[-1]
+                if best is not None and bound <= best * (1 + gap) + Model.EPS:
+                    break
+                queue.pop()
+                running[executor.submit(solve_pattern, input, solver, formulation, lengths)] = (bound, lengths)
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                bound, lengths = running.pop(future)
+                time_table, status = future.result()
+                solved += 1
+                value = score_time_table(input, time_table) if time_table else None
+                if value is not None:
+                    result = '{0:.4f}'.format(value)
+                elif status == 'infeasible':
+                    result = 'infeasible'
+                else:
+                    result = 'no solution ({0})'.format(status or 'unknown')
+                ## 最適か実行不能と分かった組み合わせ以外は上界が残る
+                if status not in ('optimal', 'infeasible'):
+                    open_bound = max(open_bound, bound)
+                    opened += 1
+                    result += ', open'
+                print('pattern {0}: bound: {1:.4f}, objective: {2}'.format(lengths, bound, result),
+                      file=sys.stderr)
+                if value is not None and (best is None or value > best):
+                    best, best_time_table = value, time_table
+    ## 解かなかった組み合わせの上界
+    if queue:
+        open_bound = max(open_bound, queue[-1][0])
+    if best is not None:
+        bound = max(best, open_bound)
+        print('decomposition: solved: {0}/{1}, open: {2}, objective: {3:.4f}, bound: {4:.4f}{5}'.format(
+            solved, len(patterns), opened, best, bound, '' if complete else ' (patterns truncated)'),
+              file=sys.stderr)
+        print('objective value: {0}'.format(best))
+    else:
+        print('decomposition: solved: {0}/{1}, open: {2}, no solution'.format(solved, len(patterns), opened),
+              file=sys.stderr)
+    return best_time_table
+
+
+def score_time_table(input, time_table):
+    # 時間割の目的関数値 (各人の見れる講座の割合の和)
+    scorer = Scorer(input)
+    return float(scorer.score(scorer.encode(time_table))[0])
+
+
+def create_solver(name=None, path=None, format='lp', pipe=False, workers=1, node_limit=100000,
+                  time_limit=None, cache=None, cache_size=64, quiet=False, gap=None):
+    if name == 'bnb':
+        solver = BranchAndBound(quiet=quiet, node_limit=node_limit, time_limit=time_limit, gap=gap)
+    elif workers > 1:
+        solver = scip_portfolio(workers, path=path or 'scip', format=format, quiet=True,
+                                time_limit=time_limit, gap=gap)
+    elif path or name == 'scip':
+        solver = SCIP(path=path or 'scip', format=format, pipe=pipe, quiet=quiet, time_limit=time_limit, gap=gap)
+    else:
+        solver = CPLEX(format=format, quiet=quiet, time_limit=time_limit, gap=gap)
+    if cache:
+        solver = CachedSolver(solver, SolutionCache(cache, cache_size * 1024 * 1024), quiet=quiet)
+    return solver
+
 
 def output_time_table(time_table):
     print('|日程|時間|部屋1|講師|部屋2|講師|')
@@ -218,18 +694,136 @@ def output_time_table(time_table):
 
 if __name__ == '__main__':
     import sys
+    sys.stdin = open(sys.stdin.fileno(), 'r', encoding='utf-8')
+    sys.stdout = open(sys.stdout.fileno(), 'w', encoding='utf-8')
+    sys.stderr = open(sys.stderr.fileno(), 'w', encoding='utf-8')
     from optparse import OptionParser
     parser = OptionParser()
     parser.add_option("--scip", dest="scip", help="path to a SCIP solver", metavar="PATH")
+    parser.add_option("--format", dest="format", default="lp",
+                      choices=["lp", "mps", "mps.gz"], help="model file format (lp, mps, mps.gz)")
+    parser.add_option("--pipe", dest="pipe", action="store_true", default=False,
+                      help="stream the model to SCIP through a FIFO instead of a file")
+    parser.add_option("--workers", dest="workers", type="int", default=1,
+                      help="race N differently configured SCIP (and CPLEX) runs", metavar="N")
+    parser.add_option("--solver", dest="solver", choices=["scip", "cplex", "bnb", "heuristic"],
+                      help="solver to use (scip, cplex, bnb, heuristic); bnb solves in-process with NumPy, "
+                      "heuristic uses greedy construction and simulated annealing without a MILP solver")
+    parser.add_option("--heuristic-start", dest="heuristic_start", action="store_true", default=False,
+                      help="use a time table found by the heuristic as the initial solution")
+    parser.add_option("--heuristic-time", dest="heuristic_time", type="float", metavar="SECONDS",
+                      help="time spent by --heuristic-start, taken out of --time-limit "
+                      "(default: a tenth of --time-limit, or 1 second)")
+    parser.add_option("--formulation", dest="formulation", default="slot", choices=["slot", "compact"],
+                      help="model formulation (slot, compact); compact drops the slot index from viewer variables")
+    parser.add_option("--decompose", dest="decompose", type="int", metavar="N",
+                      help="fix the slot length of each session and solve the patterns in N processes "
+                      "(--time-limit applies to each pattern)")
+    parser.add_option("--gap", dest="gap", type="float", default=0.0,
+                      help="relative optimality gap at which the solver stops, also used when decomposing "
+                      "(default: 0)")
+    parser.add_option("--time-limit", dest="time_limit", type="float",
+                      help="time limit in seconds; the best time table found so far is used", metavar="SECONDS")
+    parser.add_option("--incumbents", dest="incumbents", metavar="FILE",
+                      help="write each improved time table found while solving as JSON to FILE")
+    parser.add_option("--node-limit", dest="node_limit", type="int", default=100000,
+                      help="branch-and-bound node limit (bnb)", metavar="N")
+    parser.add_option("--cache", dest="cache", metavar="DIR",
+                      help="reuse solutions of identical models cached in DIR")
+    parser.add_option("--cache-size", dest="cache_size", type="int", default=64,
+                      help="maximum size of the solution cache in MB (default: 64)", metavar="MB")
+    parser.add_option("--save", dest="save", metavar="FILE",
+                      help="also write the time table as JSON to FILE")
+    parser.add_option("--warm-start", dest="warm_start", metavar="FILE",
+                      help="use a time table saved with --save as the initial solution")
+    parser.add_option("--instance-cache", dest="instance_cache", metavar="DIR",
+                      help="cache validated inputs in DIR as compiled .npz files keyed by the input hash")
+    parser.add_option("--profile", dest="profile", metavar="FILE",
+                      help="write time and peak memory of each phase, model sizes and solver statistics "
+                      "as JSON to FILE")
+    parser.add_option("--profile-build", dest="profile_build", metavar="FILE",
+                      help="write cProfile statistics of the model build to FILE (see pstats)")
     options, args = parser.parse_args()
 
     if len(args) != 1:
         print('Usage: python3 time_table.py input.json [options]', file=sys.stderr)
         exit(-1)
-    if options.scip:
-        solver = SCIP(path=options.scip)
+    time_limit = options.time_limit
+    heuristic_limit = time_limit or 1.0
+    if options.heuristic_start and options.solver != 'heuristic' and not options.decompose and \
+       not options.warm_start:
+        ## 初期解を探す時間は MILP ソルバの制限時間から差し引く
+        heuristic_limit = options.heuristic_time or (time_limit / 10.0 if time_limit else 1.0)
+        if time_limit is not None:
+            heuristic_limit = min(heuristic_limit, time_limit)
+            time_limit -= heuristic_limit
+    solver = create_solver(options.solver, options.scip, options.format, options.pipe, options.workers,
+                           options.node_limit, time_limit, options.cache, options.cache_size,
+                           gap=options.gap or None)
+    profiler = None
+    if options.profile:
+        from profiling import Profiler
+        profiler = Profiler().start()
+        profiler.instrument_solver(solver)
+
+    def phase(name):
+        return profiler.phase(name) if profiler else contextlib.nullcontext()
+    with phase('read_input_file'):
+        input = read_input_file(args[0], options.instance_cache)
+    model = None
+    previous = None
+    if options.warm_start:
+        with open(options.warm_start, encoding='utf-8') as f:
+            previous = json.load(f)
+    if options.solver == 'heuristic' or options.heuristic_start:
+        from heuristic import heuristic_time_table
+    if options.solver == 'heuristic':
+        with phase('solve'):
+            time_table = heuristic_time_table(input, heuristic_limit)
+    elif options.decompose:
+        with phase('solve'):
+            time_table = decompose_time_table(input, solver, options.decompose, options.gap, options.formulation)
     else:
-        solver = CPLEX()
-    input = read_input_file(args[0])
-    time_table = find_best_time_table(input, solver)
+        if options.heuristic_start and previous is None:
+            with contextlib.redirect_stdout(sys.stderr):
+                previous = heuristic_time_table(input, heuristic_limit)
+        callback = None
+        if options.incumbents:
+            def callback(objective_value, incumbent):
+                print('incumbent: objective value: {0}'.format(objective_value), file=sys.stderr)
+                with open(options.incumbents, 'w', encoding='utf-8') as f:
+                    json.dump(incumbent, f, ensure_ascii=False, indent=2)
+        with phase('build'):
+            if options.profile_build:
+                import cProfile
+                build_profile = cProfile.Profile()
+                model = build_profile.runcall(TimeTableModel, input, options.formulation)
+                build_profile.dump_stats(options.profile_build)
+            else:
+                model = TimeTableModel(input, options.formulation)
+        if profiler:
+            profiler.instrument(model, 'time_table', 'extract')
+        with phase('solve'):
+            time_table = model.solve(solver, previous, callback)
+    if profiler:
+        profiler.stop()
+        metrics = {'input': args[0], 'solver': options.solver, 'formulation': options.formulation,
+                   'phases': profiler.phases}
+        if model is not None:
+            metrics['model'] = {'columns': model.model.num_columns, 'rows': model.model.num_rows,
+                                'nonzeros': model.model.num_nonzeros, 'families': model.statistics()}
+            if model.solution:
+                metrics['result'] = dict(model.solution.statistics, status=model.solution.status,
+                                         gap=model.solution.gap,
+                                         objective_value=model.solution.objective_value)
+            else:
+                metrics['result'] = {'status': 'no solution'}
+        with open(options.profile, 'w', encoding='utf-8') as f:
+            json.dump(metrics, f, ensure_ascii=False, indent=2)
+    if time_table is None:
+        print('no solution found', file=sys.stderr)
+        exit(1)
+    if options.save:
+        with open(options.save, 'w', encoding='utf-8') as f:
+            json.dump(time_table, f, ensure_ascii=False, indent=2)
     output_time_table(time_table)